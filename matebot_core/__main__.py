@@ -13,21 +13,33 @@ from collections import OrderedDict
 import uvicorn
 import alembic.config
 import sqlalchemy.exc
+from sqlalchemy import delete
 
 from matebot_core import settings as _settings
 from matebot_core.api import auth
 from matebot_core.api.api import create_app
-from matebot_core.persistence import database, models
+from matebot_core.misc import export, profiler
+from matebot_core.persistence import counters, database, models
 
 
 DEFAULT_COMMUNITY_NAME = "Community"
 
 
+def _positive_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: {value!r}") from None
+    if not 0 < number < float("inf"):
+        raise argparse.ArgumentTypeError(f"must be a finite number greater than zero: {value!r}")
+    return number
+
+
 def get_parser(program: str) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog=program)
 
     commands = parser.add_subparsers(
-        description="Available sub-commands: init, apps*, users*, run, systemd, auto",
+        description="Available sub-commands: init, apps*, users*, export, run, systemd, auto",
         dest="command",
         required=True,
         metavar="<command>",
@@ -85,6 +97,11 @@ def get_parser(program: str) -> argparse.ArgumentParser:
                     "with voucher can't become internals by this command)"
     )
 
+    parser_export = commands.add_parser(
+        "export",
+        description="Export all transactions as newline-delimited JSON or CSV without loading them into memory"
+    )
+
     parser_run = commands.add_parser(
         "run",
         description="Run 'uvicorn' ASGI server to serve the MateBot core REST API"
@@ -181,6 +198,39 @@ def get_parser(program: str) -> argparse.ArgumentParser:
         help="Permission level for the targeted user (choices: 'unchanged', 'external', 'internal', 'privileged')"
     )
 
+    parser_export.add_argument(
+        "--format",
+        choices=[f.value for f in export.ExportFormat],
+        default=export.ExportFormat.NDJSON.value,
+        help="Format of the exported data (default: ndjson)"
+    )
+    parser_export.add_argument(
+        "--output",
+        type=str,
+        default="-",
+        metavar="file",
+        help="Path of the output file (default: standard output)"
+    )
+    parser_export.add_argument(
+        "--member",
+        type=int,
+        metavar="ID",
+        help="Only export transactions sent or received by the user with this ID"
+    )
+    parser_export.add_argument(
+        "--since",
+        type=int,
+        metavar="timestamp",
+        help="Only export transactions made at or after this UNIX timestamp"
+    )
+    parser_export.add_argument(
+        "--batch-size",
+        type=int,
+        default=export.DEFAULT_BATCH_SIZE,
+        metavar="n",
+        help=f"Number of rows read from the database at once (default: {export.DEFAULT_BATCH_SIZE})"
+    )
+
     parser_run.add_argument(
         "--host",
         type=str,
@@ -239,6 +289,16 @@ def get_parser(program: str) -> argparse.ArgumentParser:
         metavar="p",
         help="Sub-mount the application below the given path"
     )
+    parser_run.add_argument(
+        "--profile",
+        type=_positive_float,
+        nargs="?",
+        const=0.01,
+        default=None,
+        metavar="interval",
+        help="Run a sampling profiler until shutdown, writing its stacks to the profile directory (not valid with "
+             "--reload or --workers)"
+    )
 
     parser_systemd.add_argument(
         "--force",
@@ -348,7 +408,13 @@ def run_server(args: argparse.Namespace):
     if host is None:
         host = settings.server.host
 
+    if args.profile is not None and (args.reload or (args.workers or 1) > 1):
+        print("The sampling profiler can't be used with auto-reload or multiple workers.", file=sys.stderr)
+        return 1
+
     app = create_app(settings=settings)
+    if args.profile is not None:
+        profiler.profiler.start(args.profile)
 
     logging.getLogger("matebot_core").info(f"Server running at host {host} port {port}")
     uvicorn.run(
@@ -553,12 +619,16 @@ def del_app(args: argparse.Namespace) -> int:
             return 1
         application = applications[0]
 
+    session.execute(delete(models.idempotency_keys).where(models.idempotency_keys.c.application_id == application.id))
     session.delete(application)
+    counters.bump_counter(session, counters.ALIASES)
+    counters.bump_counter(session, counters.APPLICATIONS)
+    auth.revoke_refresh_tokens(session, application.id)
     session.commit()
     print(
         f"Successfully deleted application named {application.name!r} (ID {application.id}). "
-        f"Further login won't be possible. You should restart the server process in order to "
-        f"forcefully invalidate the access token the application might have stored."
+        f"Further login won't be possible and access and refresh tokens the application "
+        f"might have stored have been revoked."
     )
     return 0
 
@@ -640,6 +710,29 @@ def handle_users(args: argparse.Namespace) -> int:
     }[args.action](args)
 
 
+def export_transactions(args: argparse.Namespace) -> int:
+    if args.batch_size < 1:
+        print("The batch size must be positive.", file=sys.stderr)
+        return 1
+
+    config = _settings.Settings()
+    database.init(config.database.connection, config.database.debug_sql)
+    chunks = export.export_transactions(
+        export.ExportFormat(args.format),
+        args.batch_size,
+        member_id=args.member,
+        created_since=args.since
+    )
+    if args.output == "-":
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        return 0
+    with open(args.output, "w", newline="") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return 0
+
+
 def run_in_auto_mode(args: argparse.Namespace) -> int:
     # Handle loading and creation of the database
     def _handle():
@@ -736,6 +829,7 @@ if __name__ == '__main__':
         "init": init_project,
         "apps": handle_apps,
         "users": handle_users,
+        "export": export_transactions,
         "auto": run_in_auto_mode,
         "systemd": handle_systemd
     }
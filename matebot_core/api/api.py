@@ -20,11 +20,11 @@ try:
 except ImportError:
     StaticFiles = None
 
-from . import base, versioning
+from . import auth, base, compression, dependency, helpers, idempotency, limits, monitoring, negotiation, versioning
 from .routers import router
 from .. import schemas, __version__
-from ..misc import notifier
-from ..persistence import database
+from ..misc import cache, loop_monitor, metrics, notifier, profiler, tracing
+from ..persistence import database, slow_queries
 from ..settings import Settings
 from .. import __file__ as _package_init_path
 
@@ -74,7 +74,8 @@ following three different `4xx` error responses are used in the API code:
    supply an API token, the API token has already expired or is otherwise
    invalid. If a client encounters such a response, it should use the
    `POST /login` endpoint with its username and password to gather a fresh API
-   token, which should be included in the `Authorization` header field.
+   token, which should be included in the `Authorization` header field. If the
+   client still holds a valid refresh token, it should use `POST /refresh` instead.
 3. The `409` (Conflict) error response is usually not adequate for end users,
    since it may contain technical information. It may be seen if certain logical
    or database constraints are violated. The user agent should usually try to
@@ -188,10 +189,26 @@ def create_app(
             notifier.Callback.push(schemas.EventType.SERVER_STARTED, {"base_url": settings.server.public_base_url})
         logger.info("Starting API...")
         asyncio.get_event_loop().create_task(notify_server_started())
+        if settings.server.event_loop_monitor_interval > 0:
+            loop_monitor.monitor.interval = settings.server.event_loop_monitor_interval
+            loop_monitor.monitor.threshold = settings.server.event_loop_block_threshold
+            loop_monitor.monitor.start()
 
     def shutdown_server():
         logger.info("Shutting down...")
+        logger.info(f"Alias cache statistics: {helpers.alias_cache.stats()}")
+        logger.info(f"Token cache statistics: {dependency.token_cache.stats()}")
+        logger.info(f"Response cache statistics: {helpers.response_cache.stats()}")
+        logger.info(f"Search coalescing statistics: {helpers.search_flights.stats()}")
+        logger.info(f"Rate limiter statistics: {limits.rate_limiter.stats()}")
+        logger.info(f"Concurrency limiter statistics: {limits.concurrency_limiter.stats()}")
+        if loop_monitor.monitor.running:
+            logger.info(f"Event loop lag statistics: {loop_monitor.monitor.stats()}")
+            loop_monitor.monitor.stop()
+        if profiler.profiler.running:
+            profiler.profiler.dump(profiler.profiler.stop(), settings.server.profile_directory)
         notifier.Callback.wait_stop()
+        auth.shutdown_hashing_executor()
 
     if settings is None:
         settings = Settings()
@@ -203,6 +220,34 @@ def create_app(
 
     if configure_database:
         database.init(settings.database.connection, settings.database.debug_sql)
+    helpers.alias_cache.maxsize = settings.server.alias_cache_size
+    if settings.server.response_cache_file:
+        helpers.response_cache = cache.SQLiteFileCache(
+            settings.server.response_cache_file,
+            settings.server.response_cache_size
+        )
+    else:
+        helpers.response_cache.maxsize = settings.server.response_cache_size
+    dependency.token_cache.revalidation_interval = settings.server.token_revalidation_interval
+    auth.token_secret = settings.server.token_secret
+    if auth.token_secret is None:
+        logger.warning(
+            "No persistent token secret configured, so tokens are only valid in the worker "
+            "process which created them until it stops. Set 'server.token_secret' to fix this."
+        )
+    # The routes are created by 'add_router' below, so this has to be set before
+    dependency.UnitOfWorkRoute.validate_responses = settings.server.validate_responses
+    idempotency.key_lifetime = settings.server.idempotency_key_lifetime
+    monitoring.debug_query_headers = settings.database.debug_query_headers
+    monitoring.query_count_budget = settings.database.query_count_budget
+    monitoring.query_duration_budget = settings.database.query_duration_budget
+    slow_queries.threshold = settings.database.slow_query_threshold
+    slow_queries.sample_rate = settings.database.slow_query_sample_rate
+    slow_queries.max_entries_per_minute = settings.database.slow_query_log_limit
+    slow_queries.explain = settings.database.slow_query_explain
+    tracing.sample_rate = settings.server.trace_sample_rate
+    limits.rate_limiter.configure(settings.server.rate_limits)
+    limits.concurrency_limiter.limit = settings.server.max_concurrent_requests
 
     static_dirs = [
         static_directory for static_directory in [
@@ -247,11 +292,41 @@ def create_app(
 
     assert isinstance(app, versioning.VersionedFastAPI), "'VersionedFastAPI' instance required"
     app.add_router(router)
+    if negotiation.msgpack is not None:
+        app.add_middleware(negotiation.MessagePackMiddleware)
+    else:
+        logger.debug("MessagePack support is not available, since the 'msgpack' package is not installed")
+    if settings.server.compression_level > 0:
+        app.add_middleware(
+            compression.CompressionMiddleware,
+            minimum_size=settings.server.compression_minimum_size,
+            level=settings.server.compression_level
+        )
+        if compression.brotli is None:
+            logger.debug("Brotli compression is not available, since the 'brotli' package is not installed")
+
+    if settings.server.metrics_path:
+        _add_metrics_endpoint(app, settings.server.metrics_path, settings.server.metrics_authentication)
 
     app.finish()
     return app
 
 
+def _add_metrics_endpoint(app: fastapi.FastAPI, path: str, authentication: bool):
+    monitoring.register_callback_metrics(
+        {"alias": helpers.alias_cache, "token": dependency.token_cache, "response": helpers.response_cache},
+        helpers.search_flights
+    )
+
+    @app.get(path, include_in_schema=False)
+    async def get_metrics(request: fastapi.Request):
+        if authentication:
+            token = await dependency.oauth2_scheme(request)
+            with database.get_new_session() as session:
+                dependency.authenticate_application(token, session)
+        return fastapi.responses.Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 class APIWrapper:
     """
     Wrapper class around the FastAPI main object, accessible via the ``app`` property
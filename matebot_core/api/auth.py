@@ -2,29 +2,77 @@
 Authentication helper library for the core REST API
 """
 
+import sys
+import time
+import asyncio
 import datetime
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
 
+import sqlalchemy.exc
 from jose import jwt
 from sqlalchemy.orm import Session
 from argon2 import PasswordHasher, profiles
 
 from . import base
 from .. import schemas
-from ..persistence import database, models
+from ..misc import metrics
+from ..persistence import counters, database, models
 from ..settings import Settings
 
 
 _password_check: Optional[PasswordHasher] = None
+_hashing_executor: Optional[ThreadPoolExecutor] = None
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+token_secret: Optional[str] = None
+"""
+Persistent secret to sign tokens, see ``ServerConfig.token_secret``
+
+Tokens are signed with a random key of the worker process if it's not set, so
+that they are only valid in the worker process which created them until it stops.
+"""
+
+hashing_duration = metrics.registry.histogram(
+    "matebot_password_hashing_duration_seconds",
+    "Duration of hashing and verifying passwords with Argon2 per operation",
+    ("operation",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+def _timed(operation: str, func: Callable[..., Any], *args) -> Any:
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        hashing_duration.observe(time.perf_counter() - start, operation)
 
 
 def hash_password(password: str) -> str:
-    return _get_password_check().hash(password)
+    return _timed("hash", _get_password_check().hash, password)
 
 
-async def check_app_credentials(application: str, password: str, session: Session) -> bool:
+class RefreshTokenClaims(NamedTuple):
+    """
+    Owner and generation of a verified refresh token
+    """
+
+    name: str
+    application_id: int
+    generation: int
+
+
+async def check_app_credentials(application: str, password: str, session: Session) -> int:
     """
     Check the correctness of a password for a given application, raise some error otherwise
+
+    :return: the ID of the application
+
+    The expensive hashing operations are executed in a bounded thread pool
+    (see ``_get_hashing_executor``), so that they don't block the event loop.
     """
 
     checker = _get_password_check()
@@ -34,13 +82,14 @@ async def check_app_credentials(application: str, password: str, session: Sessio
     if len(apps) == 0:
         raise ValueError(f"Unknown app {application!r}!")
     app = apps[0]
-    checker.verify(app.hashed_password, password)
+    loop = asyncio.get_running_loop()
+    executor = _get_hashing_executor()
+    await loop.run_in_executor(executor, _timed, "verify", checker.verify, app.hashed_password, password)
     if checker.check_needs_rehash(app.hashed_password):
-        app.hashed_password = checker.hash(password)
-        with database.get_new_session() as s:
-            s.add(app)
-            s.commit()
-    return True
+        app.hashed_password = await loop.run_in_executor(executor, _timed, "hash", checker.hash, password)
+        session.add(app)
+        session.flush()
+    return app.id
 
 
 def create_application(name: str, password: str) -> schemas.Application:
@@ -63,13 +112,153 @@ def _get_password_check() -> PasswordHasher:
     return _password_check
 
 
-def create_access_token(username: str, expiration_minutes: int = 120) -> str:
+def _get_hashing_executor() -> ThreadPoolExecutor:
+    """
+    Return the thread pool for password hashing, which caps the number of concurrent hash operations
+
+    Argon2 releases the GIL while hashing, so threads are sufficient to keep
+    the event loop responsive. Further logins wait in the queue of the pool.
+    """
+
+    global _hashing_executor
+    if _hashing_executor is None:
+        _hashing_executor = ThreadPoolExecutor(
+            max_workers=Settings().server.password_hashing_workers,
+            thread_name_prefix="password-hashing"
+        )
+    return _hashing_executor
+
+
+def shutdown_hashing_executor():
+    global _hashing_executor
+    if _hashing_executor is not None:
+        if sys.version_info >= (3, 9):
+            _hashing_executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            # Pending hashes still run on Python 3.8, which only delays the exit of its worker threads
+            _hashing_executor.shutdown(wait=False)
+        _hashing_executor = None
+
+
+def _get_secret() -> str:
+    return token_secret or base.runtime_key
+
+
+def _create_token(username: str, token_type: str, expiration_minutes: int, **claims) -> str:
     return jwt.encode(
         {
             "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=expiration_minutes),
             "iat": datetime.datetime.utcnow(),
-            "sub": username
+            "sub": username,
+            "typ": token_type,
+            **claims
         },
-        base.runtime_key,
+        _get_secret(),
         algorithm=jwt.ALGORITHMS.HS256
     )
+
+
+def _decode_token(token: str, token_type: str) -> Dict[str, Any]:
+    try:
+        payload = jwt.decode(
+            token,
+            _get_secret(),
+            algorithms=[jwt.ALGORITHMS.HS256],
+            options={"require_exp": True, "require_iat": True}
+        )
+    except jwt.JWTError as exc:
+        raise ValueError(str(exc)) from exc
+    if payload.get("sub", None) is None or int(payload.get("exp", 0)) <= 0:
+        raise ValueError("Missing subject or expiration")
+    if payload.get("typ", ACCESS_TOKEN_TYPE) != token_type:
+        raise ValueError(f"Expected token of type {token_type!r}")
+    return payload
+
+
+def create_access_token(username: str, expiration_minutes: int = 120) -> str:
+    return _create_token(username, ACCESS_TOKEN_TYPE, expiration_minutes)
+
+
+def refresh_counter(application_id: int) -> str:
+    """
+    Return the name of the counter holding the generation of the refresh tokens of the application
+    """
+
+    return f"refresh:{application_id}"
+
+
+def create_refresh_token(
+        session: Session,
+        application_id: int,
+        username: str,
+        expiration_minutes: Optional[int] = None
+) -> str:
+    """
+    Create a long-lived token which can only be used to gather new access tokens via ``POST /refresh``
+
+    The token is bound to the ID of the application and the current generation
+    of its refresh tokens, so only the latest refresh token of an application
+    is valid once ``use_refresh_token`` has rotated it.
+    """
+
+    if expiration_minutes is None:
+        expiration_minutes = Settings().server.refresh_token_lifetime
+    generation = counters.get_counter(session, refresh_counter(application_id))
+    return _create_token(username, REFRESH_TOKEN_TYPE, expiration_minutes, aid=application_id, gen=generation)
+
+
+def decode_refresh_token(token: str) -> RefreshTokenClaims:
+    """
+    Verify the refresh token and return its claims, but don't check whether it has been used already
+
+    :raises ValueError: when the token is invalid, expired or of another type
+    """
+
+    payload = _decode_token(token, REFRESH_TOKEN_TYPE)
+    try:
+        return RefreshTokenClaims(payload["sub"], int(payload["aid"]), int(payload["gen"]))
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError("Missing application or generation") from exc
+
+
+def use_refresh_token(session: Session, token: str) -> RefreshTokenClaims:
+    """
+    Verify the refresh token and revoke it (and all other refresh tokens of its application) in the session
+
+    Concurrent uses of the same token are detected by incrementing the generation
+    counter only if it still has the value of the token, so that exactly one of
+    them succeeds. The caller should create a new refresh token afterwards.
+
+    :raises ValueError: when the token is invalid, has been used already or its application doesn't exist anymore
+    """
+
+    claims = decode_refresh_token(token)
+    app = session.get(models.Application, claims.application_id)
+    if app is None or app.name != claims.name:
+        raise ValueError(f"Unknown application {claims.name!r} (ID {claims.application_id})")
+    try:
+        with session.begin_nested():
+            if not counters.compare_and_bump(session, refresh_counter(app.id), claims.generation):
+                raise ValueError("The refresh token has been used or revoked already")
+    except sqlalchemy.exc.IntegrityError as exc:
+        raise ValueError("The refresh token has been used concurrently") from exc
+    return claims
+
+
+def revoke_refresh_tokens(session: Session, application_id: int):
+    """
+    Revoke all refresh tokens issued to the application so far in the session's unit of work
+    """
+
+    counters.bump_counter(session, refresh_counter(application_id))
+
+
+def decode_token(token: str, token_type: str) -> Tuple[str, int]:
+    """
+    Verify the token of the given type and return the name of its owning application and its expiration
+
+    :raises ValueError: when the token is invalid, expired or of another type
+    """
+
+    payload = _decode_token(token, token_type)
+    return payload["sub"], int(payload["exp"])
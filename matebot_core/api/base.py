@@ -139,8 +139,12 @@ class APIException(HTTPException):
             logger.error("Invalid exception class for base handler")
 
         logger.debug(
-            f"{type(exc).__name__}: {message} @ '{request.method} "
-            f"{request.url.path}' (details: {exc.detail})"
+            "%s: %s @ '%s %s' (details: %s)",
+            type(exc).__name__,
+            message,
+            request.method,
+            request.url.path,
+            exc.detail
         )
         return JSONResponse(jsonable_encoder(schemas.APIError(
             error=True,
@@ -169,6 +173,20 @@ class BadRequest(APIException):
         )
 
 
+class Forbidden(APIException):
+    """
+    Exception when the requesting application isn't allowed to use the requested functionality
+    """
+
+    def __init__(self, message: str, detail: Optional[str] = None):
+        super().__init__(
+            status_code=403,
+            detail=detail,
+            repeat=False,
+            message=message
+        )
+
+
 class NotFound(APIException):
     """
     Exception when a requested resource was not found in the system
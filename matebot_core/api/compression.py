@@ -0,0 +1,149 @@
+"""
+MateBot ASGI middleware for negotiated response compression
+
+Responses are compressed with brotli (if the optional ``brotli`` package
+is installed) or gzip, depending on the ``Accept-Encoding`` header of the
+request. Small responses are sent uncompressed, since compressing them
+wastes CPU time without saving much bandwidth. Streaming responses (e.g.
+exports) are compressed chunk by chunk and every chunk is flushed, so
+that clients can decompress the data while it's still being sent.
+"""
+
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def select_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Select the preferred supported content coding of the given ``Accept-Encoding`` header, if any
+
+    Codings with a quality value of zero are treated as rejected (see RFC 9110, section 12.5.3).
+    """
+
+    qualities = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    wildcard = qualities.get("*", 0.0)
+    candidates = [(qualities.get(coding, wildcard), -i, coding) for i, coding in enumerate(supported)]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else None
+
+
+class _Compressor:
+    """
+    Incremental compressor of a single response body for one content coding
+    """
+
+    def __init__(self, encoding: str, level: int):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=min(level, 11))
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + (self._brotli.flush() if flush else b"")
+        return self._zlib.compress(data) + (self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Middleware compressing response bodies of at least ``minimum_size`` bytes using the negotiated coding
+
+    :param app: the wrapped ASGI application
+    :param minimum_size: minimal size of complete response bodies to be compressed
+    :param level: compression level for gzip (1-9), also used as quality for brotli
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, level: int = 6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = select_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                passthrough = "content-encoding" in headers or message["status"] in (204, 304)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if passthrough:
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            if start_message is not None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding, self.level)
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                    message["body"] = compressor.compress(body, flush=True)
+                else:
+                    message["body"] = compressor.finish(body)
+                    headers["Content-Length"] = str(len(message["body"]))
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+
+            message["body"] = compressor.compress(body, flush=True) if more_body else compressor.finish(body)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
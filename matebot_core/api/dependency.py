@@ -2,32 +2,80 @@
 MateBot API dependency library
 """
 
+import math
+import time
+import asyncio
 import logging
-from typing import Generator, Optional, Tuple
+import functools
+from typing import Callable, Coroutine, Generator, List, NamedTuple, Optional, Tuple
 
 import sqlalchemy.exc
 import fastapi.datastructures
-from fastapi import BackgroundTasks, Depends, Request, Response
+from fastapi import BackgroundTasks, Depends, Query, Request, Response
+from fastapi.routing import APIRoute
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
 from sqlalchemy.orm import Session
 
-from . import base
-from ..persistence import database, models
+from . import auth, base, idempotency, limits, monitoring
+from ..misc import tracing
+from ..misc.cache import VersionedCache
+from ..persistence import counters, database, models
 from ..settings import Settings
 
 
-def get_session() -> Generator[Session, None, bool]:
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+MAX_ID_BATCH_SIZE = 100
+"""Maximum number of IDs which can be looked up at once by the ``id`` query parameter of search endpoints"""
+
+BATCH_SESSION_SCOPE_KEY = "matebot.batch_session"
+"""Key of the ASGI scope of sub-requests of a batch request holding the session of the batch request"""
+
+
+class AuthenticatedApplication(NamedTuple):
+    """
+    Identity of the application owning a verified access token
+    """
+
+    id: int
+    name: str
+    expiration: int
+
+
+token_cache = VersionedCache(counters.APPLICATIONS, maxsize=256)
+"""
+Cache mapping verified access tokens to the identity of their owning application
+
+Entries are only used until the token expires. Deleting an application
+increments the applications version counter, which drops all cached tokens.
+"""
+
+
+def get_session(request: Request) -> Generator[Session, None, bool]:
     """
     Return a generator to handle database sessions gracefully
+
+    The session is the single unit of work of the request. Path operations and
+    helper functions only add and flush their changes, while the session is
+    committed exactly once by the ``UnitOfWorkRoute`` after the path operation
+    returned, but before the response is sent (see ``commit_request_session``).
+    Anything that hasn't been committed will be rolled back when it's closed.
+
+    Sub-requests of a batch request (see ``POST /batch``) use the session of
+    the batch request instead, which is committed or rolled back by it only.
     """
 
+    batch_session: Optional[Session] = request.scope.get(BATCH_SESSION_SCOPE_KEY)
+    if batch_session is not None:
+        yield batch_session
+        return True
+
     logger = logging.getLogger(__name__)
     session = database.get_new_session()
+    request.state.session = session
 
     try:
         yield session
-        session.flush()
     except sqlalchemy.exc.DBAPIError as exc:
         details = exc.statement.replace("\n", "")
         logger.exception(f"{type(exc).__name__}: {', '.join(exc.args)} @ {details!r}")
@@ -41,10 +89,177 @@ def get_session() -> Generator[Session, None, bool]:
         session.rollback()
         raise
     finally:
+        request.state.session = None
         session.close()
     return True
 
 
+def commit_request_session(request: Request):
+    """
+    Commit the session of the request, which publishes its pending callback events afterwards
+    """
+
+    session: Optional[Session] = getattr(request.state, "session", None)
+    if session is not None:
+        with tracing.span("db.commit"):
+            session.commit()
+
+
+def _trace_endpoint(call: Callable) -> Callable:
+    # The serialization of the result starts in the context of the endpoint, but ends in the context of the route
+    name = f"endpoint.{call.__name__}"
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            with tracing.span(name):
+                result = await call(*args, **kwargs)
+            tracing.start_deferred_span("serialize")
+            return result
+
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            with tracing.span(name):
+                result = call(*args, **kwargs)
+            tracing.start_deferred_span("serialize")
+            return result
+
+    return endpoint
+
+
+class UnitOfWorkRoute(APIRoute):
+    """
+    API route that commits the request's database session once after a successful path operation
+
+    Any exception raised while committing the session will be handled by the
+    ``get_session`` dependency, which rolls back the session in that case.
+
+    Unless ``validate_responses`` is set, the returned content won't be validated
+    against the response model of the route again, since path operations return
+    schemas which were built internally anyways. The response model is still used
+    for the OpenAPI definition in either case. Its default matches the default of
+    ``ServerConfig.validate_responses``. Since the handler of a route is built when
+    the route is created, the class attribute must be set before the routes are added
+    to the app, which is why ``create_app`` sets it before calling ``add_router``.
+
+    Path operations annotated by ``idempotency.idempotent`` accept the ``Idempotency-Key``
+    header. Successful responses of those requests are stored with the key in the same
+    unit of work, while requests with a known key return the stored response instead.
+    Operations of batch requests (see ``POST /batch``) reject idempotency keys with ``400``.
+
+    Requests exceeding the maximum number of concurrent requests of the worker process
+    are rejected with ``503`` (see ``limits.concurrency_limiter``), except for operations
+    of batch requests, which have been admitted together with their batch request already.
+
+    Every request is counted and timed per method, route template and status code, together
+    with the number and duration of its database queries (see ``monitoring.RequestTimer``),
+    which are added to the response headers if ``monitoring.debug_query_headers`` is set.
+    Afterwards, the request is written to the structured access log (see ``monitoring.log_access``).
+
+    Every request runs in the root span of a trace (see ``misc.tracing``), which contains
+    the spans of the path operation, the serialization of its result and the commit.
+    """
+
+    validate_responses: bool = False
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[None, None, Response]]:
+        if not self.validate_responses:
+            self.secure_cloned_response_field = None
+        self.dependant.call = _trace_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+        idempotent = idempotency.is_idempotent(self.endpoint)
+
+        async def handle_request(request: Request) -> Response:
+            key = idempotency.get_key(request) if idempotent else None
+            if key is not None:
+                if BATCH_SESSION_SCOPE_KEY in request.scope:
+                    # The response would have to be stored in the session of the batch request, which may roll back
+                    raise base.BadRequest("Operations of batch requests don't support idempotency keys.", detail=key)
+                return await _handle_idempotent_request(request, key, handler)
+            response = await handler(request)
+            tracing.finish_deferred_spans()
+            commit_request_session(request)
+            return response
+
+        async def admit_request(request: Request) -> Response:
+            if BATCH_SESSION_SCOPE_KEY in request.scope:
+                return await handle_request(request)
+            if not limits.concurrency_limiter.try_acquire():
+                raise base.APIException(
+                    status_code=503,
+                    detail=f"limit={limits.concurrency_limiter.limit}",
+                    repeat=True,
+                    message="The server is overloaded. Please try again later.",
+                    headers={"Retry-After": "1"}
+                )
+            try:
+                return await handle_request(request)
+            finally:
+                limits.concurrency_limiter.release()
+
+        async def route_handler(request: Request) -> Response:
+            route = request.scope.get("root_path", "") + self.path_format
+            with tracing.trace(
+                    f"{request.method} {route}",
+                    request.headers.get(tracing.TRACEPARENT_HEADER),
+                    **{"http.method": request.method, "http.route": route, "http.target": request.url.path}
+            ) as span:
+                timer = monitoring.RequestTimer(route)
+                try:
+                    response = await admit_request(request)
+                except Exception as exc:
+                    status = monitoring.get_status_code(exc)
+                    if span is not None:
+                        span.attributes["http.status_code"] = status
+                    timer.stop(request.method, route, status)
+                    monitoring.log_access(request, route, status, timer)
+                    raise
+                if span is not None:
+                    span.attributes["http.status_code"] = response.status_code
+                timer.stop(request.method, route, response.status_code)
+                if monitoring.debug_query_headers:
+                    timer.add_headers(response)
+                monitoring.log_access(request, route, response.status_code, timer, response)
+                return response
+
+        return route_handler
+
+
+async def _handle_idempotent_request(
+        request: Request,
+        key: str,
+        handler: Callable[[Request], Coroutine[None, None, Response]]
+) -> Response:
+    fingerprint = await idempotency.get_fingerprint(request)
+    token = await oauth2_scheme(request)
+    with database.get_new_session() as session:
+        application = authenticate_application(token, session)
+        application_id = application.id
+        request.state.application = application.name
+        response = idempotency.lookup(session, application_id, key, fingerprint)
+    if response is not None:
+        return response
+
+    response = await handler(request)
+    tracing.finish_deferred_spans()
+    session: Optional[Session] = getattr(request.state, "session", None)
+    if session is None or not 200 <= response.status_code < 300:
+        commit_request_session(request)
+        return response
+    try:
+        idempotency.store(session, application_id, key, fingerprint, response)
+        commit_request_session(request)
+    except sqlalchemy.exc.IntegrityError:
+        # A concurrent request with the same key has been committed first, so its response is returned instead
+        session.rollback()
+        with database.get_new_session() as session:
+            response = idempotency.lookup(session, application_id, key, fingerprint)
+        if response is None:
+            raise base.Conflict("A concurrent request with the same idempotency key failed.", detail=key, repeat=True)
+    return response
+
+
 class MinimalRequestData:
     """
     Collection of minimal dependencies used only for internal functionalities
@@ -70,7 +285,11 @@ class MinimalRequestData:
         return self._config
 
 
-async def check_auth_token(token: str = Depends(OAuth2PasswordBearer(tokenUrl="login"))) -> Tuple[str, str, int]:
+def decode_auth_token(token: str) -> Tuple[str, int]:
+    """
+    Verify the access token and return the name of its owning application and its expiration
+    """
+
     credentials_exception = base.APIException(
         status_code=401,
         detail=f"token={token!r}",
@@ -79,21 +298,41 @@ async def check_auth_token(token: str = Depends(OAuth2PasswordBearer(tokenUrl="l
     )
 
     try:
-        payload = jwt.decode(
-            token,
-            base.runtime_key,
-            algorithms=[jwt.ALGORITHMS.HS256],
-            options={"require_exp": True, "require_iat": True}
-        )
-        username = payload.get("sub", None)
-        expiration = int(payload.get("exp", 0))
-        if username is None or expiration <= 0:
-            raise credentials_exception
-        return token, username, expiration
-    except (jwt.JWTError, ValueError) as exc:
+        return auth.decode_token(token, auth.ACCESS_TOKEN_TYPE)
+    except ValueError as exc:
         raise credentials_exception from exc
 
 
+async def check_auth_token(token: str = Depends(oauth2_scheme)) -> Tuple[str, str, int]:
+    return (token, *decode_auth_token(token))
+
+
+def authenticate_application(token: str, session: Session) -> AuthenticatedApplication:
+    """
+    Determine the application owning the access token, using the token cache where possible
+
+    :param token: the (not yet verified) access token of the request
+    :param session: database session used to look up the application on cache misses
+    :return: the identity of the token owner
+    :raises APIException: when the token is invalid or its owner couldn't be determined
+    """
+
+    version = token_cache.validate(session)
+    cached: Optional[AuthenticatedApplication] = token_cache.get_versioned(token, version)
+    if cached is not None:
+        if cached.expiration > time.time():
+            return cached
+        token_cache.discard(token)
+
+    name, expiration = decode_auth_token(token)
+    target_apps = session.query(models.Application.id).filter_by(name=name).all()
+    if len(target_apps) != 1:
+        raise base.APIException(status_code=500, detail=token, message="Token owner couldn't be determined")
+    app = AuthenticatedApplication(target_apps[0].id, name, expiration)
+    token_cache.put_versioned(token, app, version)
+    return app
+
+
 class LocalRequestData(MinimalRequestData):
     """
     Collection of core dependencies used by all path operations
@@ -102,6 +341,9 @@ class LocalRequestData(MinimalRequestData):
     will almost certainly be used by request handlers (path operations).
     Note that any dependency added here will be added to the OpenAPI
     definition, if it refers to a Query, Header, Path or Cookie.
+
+    Requests of applications exceeding their rate limits are rejected
+    with ``429`` after authentication (see ``limits.rate_limiter``).
     """
 
     def __init__(
@@ -110,22 +352,98 @@ class LocalRequestData(MinimalRequestData):
             response: Response,
             tasks: BackgroundTasks,
             session: Session = Depends(get_session),
-            auth_check: Tuple[str, str, int] = Depends(check_auth_token)
+            token: str = Depends(oauth2_scheme)
     ):
         super().__init__(request, response, session)
         self.tasks: BackgroundTasks = tasks
-        self._token, self._requesting_app_name, self._token_expiration = auth_check
         self.headers: fastapi.datastructures.Headers = request.headers
         self.session: sqlalchemy.orm.Session = session
         self._config: Optional[Settings] = None
 
-        target_apps = session.query(models.Application).filter_by(name=self._requesting_app_name).all()
-        if len(target_apps) != 1:
-            raise base.APIException(status_code=500, detail=self._token, message="Token owner couldn't be determined")
-        self.origin_app: models.Application = target_apps[0]
+        app = authenticate_application(token, session)
+        request.state.application = app.name
+        wait = limits.rate_limiter.acquire(app.name, limits.request_kind(request.method))
+        if wait > 0:
+            raise base.APIException(
+                status_code=429,
+                detail=f"app={app.name!r}",
+                repeat=True,
+                message="Too many requests. Please slow down and try again later.",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+        self._token = token
+        self._requesting_app_name = app.name
+        self._token_expiration = app.expiration
+        self.origin_app_id: int = app.id
+
+    @property
+    def origin_app(self) -> models.Application:
+        """
+        Application model of the token owner, which is loaded from the database on first access
+
+        :raises APIException: when the application has been deleted since the token was verified
+        """
+
+        app = self.session.get(models.Application, self.origin_app_id)
+        if app is None:
+            raise base.APIException(
+                status_code=401,
+                detail=f"app={self._requesting_app_name!r}",
+                message="The application of the token doesn't exist anymore",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        return app
 
     @property
     def config(self) -> Settings:
         if self._config is None:
             self._config = Settings()
         return self._config
+
+
+class AdminRequestData(LocalRequestData):
+    """
+    Collection of core dependencies used by administrative path operations
+
+    Only the application configured by ``ServerConfig.admin_application``
+    may use those path operations, all other requests are rejected with ``403``.
+    """
+
+    def __init__(
+            self,
+            request: Request,
+            response: Response,
+            tasks: BackgroundTasks,
+            session: Session = Depends(get_session),
+            token: str = Depends(oauth2_scheme)
+    ):
+        super().__init__(request, response, tasks, session, token)
+        if self._requesting_app_name != self.config.server.admin_application:
+            raise base.Forbidden(
+                "Only the administrative application may use this endpoint.",
+                detail=f"app={self._requesting_app_name!r}"
+            )
+
+
+def id_list(
+        id: Optional[List[str]] = Query(  # noqa
+            None,
+            description=f"Repeated (`id=1&id=5`) or comma-separated (`id=1,5`) list of at most {MAX_ID_BATCH_SIZE} IDs"
+        )
+) -> Optional[List[int]]:
+    """
+    Parse the ``id`` query parameter of search endpoints into a list of unique IDs
+
+    :raises base.BadRequest: when any ID isn't a non-negative integer, no IDs or too many IDs are given
+    """
+
+    if id is None:
+        return None
+    ids = [part.strip() for value in id for part in value.split(",")]
+    # Other Unicode digits (e.g. superscripts) aren't accepted by ``int``, or are confusing at least
+    if not all(part.isascii() and part.isdigit() for part in ids):
+        raise base.BadRequest("Only non-negative integers are valid IDs.", detail=str(id))
+    ids = list(dict.fromkeys(int(part) for part in ids))
+    if len(ids) > MAX_ID_BATCH_SIZE:
+        raise base.BadRequest(f"At most {MAX_ID_BATCH_SIZE} IDs can be looked up at once.", detail=str(len(ids)))
+    return ids
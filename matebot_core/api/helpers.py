@@ -2,18 +2,56 @@
 Generic helper library for the core REST API
 """
 
+import hashlib
 import logging
-from typing import Callable, List, Optional, Type, Union
+import datetime
+import email.utils
+import urllib.parse
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type, Union
 
 import pydantic
 import sqlalchemy
 import sqlalchemy.orm
-from fastapi.responses import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, UJSONResponse
 
 from .base import BadRequest, Conflict, NotFound
+from .negotiation import representation
 from .dependency import LocalRequestData
-from ..persistence import models
+from ..persistence import counters, models
+from ..misc.cache import BytesLRUCache, SingleFlight, SQLiteFileCache, VersionedCache
 from ..misc.logger import enforce_logger
+from ..misc.notifier import Callback
+from .. import __version__, schemas
+
+
+alias_cache = VersionedCache(counters.ALIASES)
+"""
+Cache mapping tuples of application ID and username of confirmed aliases to user IDs
+
+It's invalidated by incrementing the ``ALIASES`` counter, which is required
+whenever an alias is created, confirmed or deleted or a user is deleted.
+"""
+
+response_cache: Union[BytesLRUCache, SQLiteFileCache] = BytesLRUCache()
+"""
+Cache mapping the ETag, path and normalized query parameters of search requests to response bodies
+
+Since the ETag is derived from the table version counters, outdated entries
+can't be hit anymore. Additionally, the cache is cleared whenever events are
+published, which frees the space of outdated entries as early as possible.
+"""
+
+
+def _clear_response_cache(events: List[schemas.Event]):
+    if any(event.event != schemas.EventType.SERVER_STARTED for event in events):
+        response_cache.clear()
+
+
+Callback.subscribe(_clear_response_cache)
+
+search_flights = SingleFlight()
+"""Group of in-flight searches of ``search_models_cached`` shared by concurrent identical requests"""
 
 
 async def return_one(
@@ -56,8 +94,14 @@ async def resolve_user_spec(user_spec: Union[str, int], local: LocalRequestData)
     if not isinstance(user_spec, str):
         raise TypeError(f"Expected int or str, found {type(user_spec)}")
 
+    key = (local.origin_app_id, user_spec)
+    version = alias_cache.validate(local.session)
+    user_id = alias_cache.get_versioned(key, version)
+    if user_id is not None:
+        return await return_one(user_id, models.User, local.session)
+
     possible_aliases = local.session.query(models.Alias).filter_by(
-        application_id=local.origin_app.id,
+        application_id=local.origin_app_id,
         confirmed=True,
         username=user_spec
     ).all()
@@ -69,8 +113,188 @@ async def resolve_user_spec(user_spec: Union[str, int], local: LocalRequestData)
     alias = possible_aliases[0]
     if not isinstance(alias, models.Alias):
         raise TypeError(f"Expected Alias model but got {type(alias)}")
-    user_id = alias.user_id
-    return await return_one(user_id, models.User, local.session)
+    alias_cache.put_versioned(key, alias.user_id, version)
+    return await return_one(alias.user_id, models.User, local.session)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque_tag:
+            return True
+    return False
+
+
+def check_not_modified(local: LocalRequestData, *dependencies: Type[models.Base]) -> Optional[Response]:
+    """
+    Add cache validators to the response and check whether the client's representation is still up-to-date
+
+    The validators are derived from the table version counters of all models whose
+    data may be part of the response, which requires only a single cheap query.
+    Therefore, the query should be done before loading any models. The ``ETag``
+    is only valid for one URL, while the query parameters are not part of it.
+    It depends on the negotiated representation, since JSON and MessagePack
+    responses aren't byte-for-byte equivalent (see the ``negotiation`` module).
+
+    :param local: contextual local data
+    :param dependencies: classes of all models whose data may be part of the response
+    :return: a response with status code ``304`` if the ``If-None-Match`` header
+        of the request matches the current ``ETag``, otherwise None
+    """
+
+    names = sorted(counters.table_counter(model.__tablename__) for model in dependencies)
+    versions, last_modified = counters.get_versions(local.session, names)
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(__version__.encode("UTF-8"))
+    digest.update(representation(local.headers.get("Accept", "")).encode("UTF-8"))
+    for name in names:
+        digest.update(f"{name}={versions[name]};".encode("UTF-8"))
+    headers = {"ETag": f'W/"{digest.hexdigest()}"', "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = email.utils.formatdate(last_modified.timestamp(), usegmt=True)
+
+    if_none_match = local.headers.get("If-None-Match")
+    if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    local.response.headers.update(headers)
+    return None
+
+
+async def search_models_cached(
+        model: Type[models.Base],
+        local: LocalRequestData,
+        dependencies: Iterable[Type[models.Base]],
+        **kwargs
+) -> Response:
+    """
+    Search models like ``search_models``, but support conditional requests and use the response cache
+
+    Concurrent identical requests are coalesced: the first of them runs the search
+    and serializes its results in the thread pool, while the others wait for its
+    response body (see ``search_flights``). Requests are identical if they have the
+    same path, the same normalized query parameters and the same ``ETag``, i.e.
+    they see the same versions of all dependencies. The responses of searches
+    don't depend on the requesting application, so it isn't part of the key.
+
+    :param model: class of a SQLAlchemy model
+    :param local: contextual local data
+    :param dependencies: classes of all models whose data may be part of the response
+        (see ``check_not_modified``), which must include the searched model itself
+    :param kwargs: dict of further arguments passed to ``search_models``
+    :return: either a ``304`` response or the response with the (possibly cached) body
+    """
+
+    not_modified = check_not_modified(local, *dependencies)
+    if not_modified is not None:
+        return not_modified
+
+    query = urllib.parse.urlencode(sorted(local.request.query_params.multi_items()))
+    key = f"{local.response.headers['ETag']} {local.request.url.path}?{query}"
+    body = response_cache.get(key) if response_cache.maxsize > 0 else None
+    if body is None:
+        def search() -> bytes:
+            results = search_models(model, local, **kwargs)
+            content = results.body if isinstance(results, Response) else UJSONResponse(jsonable_encoder(results)).body
+            response_cache.put(key, content)
+            return content
+
+        body = await search_flights.run(key, search)
+    return Response(body, media_type=UJSONResponse.media_type, headers=dict(local.response.headers))
+
+
+_SHALLOW_FIELDS: Dict[Type[models.Base], Dict[str, Optional[str]]] = {
+    models.User: {"aliases": None},
+    models.Transaction: {"sender": "sender_id", "receiver": "receiver_id"},
+    models.Refund: {"creator": "creator_id", "votes": None, "transaction": "transaction_id"},
+    models.Poll: {"user": "user_id", "votes": None},
+    models.Communism: {"multi_transaction": "multi_transaction_id"}
+}
+"""
+Mapping of nested fields of schemas to the columns with their foreign keys for ``expand=none``
+
+Nested lists are mapped to ``None``, i.e. they are omitted, since their entries
+reference the parent model and can therefore be searched separately.
+"""
+
+_COMPUTED_FIELDS: Dict[Type[models.Base], Dict[str, Callable[[Any], Any]]] = {
+    models.Refund: {"allowed": lambda r: None if r.active else r.transaction_id is not None},
+    models.Communism: {"participants": lambda c: [p.binding for p in c.participants]}
+}
+"""
+Mapping of fields of schemas which are no columns to functions calculating them without building the full schema
+"""
+
+
+def _schema_fields(model: Type[models.Base]) -> List[str]:
+    return list(model.schema.fget.__annotations__["return"].__fields__)
+
+
+def _parse_fields(model: Type[models.Base], fields: Optional[str]) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    available = _schema_fields(model)
+    selected = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = selected.difference(available)
+    if unknown:
+        raise BadRequest(
+            f"Unknown fields {', '.join(sorted(unknown))}; available fields are {', '.join(available)}.",
+            detail=str(fields)
+        )
+    return [f for f in available if f in selected or f == "id"]
+
+
+def _sparse_representation(obj: models.Base, fields: List[str], expand: bool) -> Dict[str, Any]:
+    """
+    Build the representation of the given fields of a model, loading only the required relationships
+
+    Columns are read directly, while all other fields are taken from the full
+    schema of the model, which is built only if any such field is requested.
+    """
+
+    model = type(obj)
+    columns = sqlalchemy.inspect(model).column_attrs.keys()
+    shallow = _SHALLOW_FIELDS.get(model, {}) if not expand else {}
+    computed = _COMPUTED_FIELDS.get(model, {})
+    result = {}
+    schema = None
+    for field in fields:
+        if field in shallow:
+            if shallow[field] is not None:
+                result[shallow[field]] = getattr(obj, shallow[field])
+        elif field in computed:
+            result[field] = computed[field](obj)
+        elif field in columns:
+            value = getattr(obj, field)
+            result[field] = int(value.timestamp()) if isinstance(value, datetime.datetime) else value
+        else:
+            if schema is None:
+                schema = obj.schema
+            result[field] = getattr(schema, field)
+    return result
+
+
+def _created_since(model: Type[models.Base], moment: datetime.datetime):
+    if model is models.Transaction:
+        return model.timestamp > moment
+    return model.created > moment
+
+
+def _modified_since(model: Type[models.Base], moment: datetime.datetime):
+    if model is models.Transaction:
+        return model.timestamp > moment
+    if model is models.User:
+        return sqlalchemy.or_(model.modified > moment, model.aliases.any(models.Alias.modified > moment))
+    if model in (models.Poll, models.Refund):
+        return sqlalchemy.or_(
+            model.modified > moment,
+            model.ballot.has(models.Ballot.votes.any(models.Vote.modified > moment))
+        )
+    return model.modified > moment
 
 
 def search_models(
@@ -80,8 +304,12 @@ def search_models(
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
+        fields: Optional[str] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         **kwargs
-) -> List[pydantic.BaseModel]:
+) -> Union[Response, List[pydantic.BaseModel]]:
     """
     Return the schemas of all user models that equal all kwargs and pass the special filter function
 
@@ -94,23 +322,55 @@ def search_models(
         limit is given, the page will be ignored due to its missing size specification
     :param descending: reverse the order of results received from the database (the
         item filter will process the reversed results, which however shouldn't matter)
+    :param created_since: optional UNIX timestamp to only include models created at or after it
+    :param modified_since: optional UNIX timestamp to only include models modified at or
+        after it, where users count as modified if one of their aliases has been modified,
+        polls and refunds count as modified if one of their votes has been modified and
+        transactions count as modified when they have been created
+    :param fields: optional comma-separated list of the fields of the schema which
+        should be returned (the ``id`` is always included), where unused relationships
+        of the models won't be loaded at all
+    :param expand: with ``Expansion.NONE``, nested models are replaced by their foreign
+        keys (e.g. ``sender_id`` instead of ``sender``) and nested lists are omitted
     :param kwargs: dict of extra attribute checks on the model (empty values in the
-        dict are ignored and won't be treated as check for ``None`` in the model)
-    :return: list of schemas of all models that equal all kwargs and passed the filter function
+        dict are ignored and won't be treated as check for ``None`` in the model,
+        while lists are treated as sets of allowed values, i.e. ``IN (...)``)
+    :return: list of schemas of all models that equal all kwargs and passed the filter
+        function, or a response with the sparse representations of those models
+    :raises BadRequest: when unknown fields have been selected
     """
 
+    selected_fields = _parse_fields(model, fields)
     query = local.session.query(model)
+    # SQLite compares timestamps as strings, where '2023-01-01 00:00:00' < '2023-01-01 00:00:00.000000',
+    # so the inclusive lower bound is expressed as strict comparison with a moment slightly before it
+    just_before = datetime.timedelta(microseconds=1)
+    if created_since is not None:
+        query = query.filter(_created_since(model, datetime.datetime.fromtimestamp(created_since) - just_before))
+    if modified_since is not None:
+        query = query.filter(_modified_since(model, datetime.datetime.fromtimestamp(modified_since) - just_before))
     for k in kwargs:
-        if kwargs[k] is not None:
+        if isinstance(kwargs[k], list):
+            query = query.filter(getattr(model, k).in_(kwargs[k]))
+        elif kwargs[k] is not None:
             query = query.filter_by(**{k: kwargs[k]})
     if descending:
         query = query.order_by(sqlalchemy.desc(model.id))
-    results = [obj.schema for obj in query.all() if specialized_item_filter is None or specialized_item_filter(obj)]
+    results = [obj for obj in query.all() if specialized_item_filter is None or specialized_item_filter(obj)]
     if limit and page:
-        return results[limit*page:limit*(page+1)]
+        results = results[limit*page:limit*(page+1)]
     elif limit:
-        return results[:limit]
-    return results
+        results = results[:limit]
+
+    if selected_fields is None and expand == schemas.Expansion.ALL:
+        return [obj.schema for obj in results]
+    if selected_fields is None:
+        selected_fields = _schema_fields(model)
+    expanded = expand == schemas.Expansion.ALL
+    return UJSONResponse(
+        jsonable_encoder([_sparse_representation(obj, selected_fields, expanded) for obj in results]),
+        headers=dict(local.response.headers)
+    )
 
 
 async def delete_one_of_model(
@@ -120,7 +380,7 @@ async def delete_one_of_model(
         logger: Optional[logging.Logger] = None
 ):
     """
-    Delete the identified instance of a model from the database (triggering callbacks)
+    Delete the identified instance of a model from the database (flushing, but not committing it)
 
     :param instance_id: unique identifier of the instance to be deleted
     :param model: class of the SQLAlchemy model
@@ -133,7 +393,7 @@ async def delete_one_of_model(
     obj = await return_one(instance_id, model, local.session)
     enforce_logger(logger).debug(f"Deleting model {obj!r}...")
     local.session.delete(obj)
-    local.session.commit()
+    local.session.flush()
     return Response(status_code=204)
 
 
@@ -158,5 +418,5 @@ async def drop_user_privileges_impl(
             raise BadRequest("You are not allowed to drop another user's privileges!")
     user = transform_func(user)
     local.session.add(user)
-    local.session.commit()
+    local.session.flush()
     return user
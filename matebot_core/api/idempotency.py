@@ -0,0 +1,117 @@
+"""
+MateBot API library for idempotent requests using the ``Idempotency-Key`` header
+
+Clients may send a unique key with requests to endpoints which are annotated
+by ``idempotent``, e.g. to send money. The response of a successful request
+is stored per application together with the key, in the same transaction as
+the changes of the request. Repeating a request with the same key returns
+the stored response without executing the request again, until the key
+expires. Therefore, clients can safely retry requests after timeouts.
+Failed requests aren't stored, since they didn't change anything.
+"""
+
+import hashlib
+import datetime
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from .base import BadRequest, Conflict
+from ..persistence.models import idempotency_keys
+
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENT_ANNOTATION_NAME = "_idempotent"
+MAX_KEY_LENGTH = 255
+
+key_lifetime: int = 1440
+"""Number of minutes a key and its response are stored, see ``ServerConfig.idempotency_key_lifetime``"""
+
+
+def idempotent(func: Callable) -> Callable:
+    """
+    Decorate a path operation function to support the ``Idempotency-Key`` header
+    """
+
+    setattr(func, IDEMPOTENT_ANNOTATION_NAME, True)
+    return func
+
+
+def is_idempotent(func: Callable) -> bool:
+    return getattr(func, IDEMPOTENT_ANNOTATION_NAME, False)
+
+
+def get_key(request: Request) -> Optional[str]:
+    """
+    Return the idempotency key of the request, if any
+
+    :raises BadRequest: when the key is empty, too long or contains non-printable characters
+    """
+
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if key is None:
+        return None
+    if not 0 < len(key) <= MAX_KEY_LENGTH or not key.isprintable():
+        raise BadRequest(
+            f"The idempotency key must consist of 1 to {MAX_KEY_LENGTH} printable characters.",
+            detail=repr(key)
+        )
+    return key
+
+
+async def get_fingerprint(request: Request) -> str:
+    """
+    Return the hash of the method, URL and body of the request, which must be equal for repeated requests
+    """
+
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{request.method} {request.url.path}?{request.url.query}\n".encode("utf-8"))
+    fingerprint.update(await request.body())
+    return fingerprint.hexdigest()
+
+
+def lookup(session: Session, application_id: int, key: str, fingerprint: str) -> Optional[Response]:
+    """
+    Return the stored response for the key of the application, if it hasn't expired yet
+
+    :raises Conflict: when the key has been used for a different request before
+    """
+
+    row = session.execute(
+        select(idempotency_keys.c.fingerprint, idempotency_keys.c.status, idempotency_keys.c.body)
+        .where(idempotency_keys.c.application_id == application_id)
+        .where(idempotency_keys.c.key == key)
+        .where(idempotency_keys.c.expires > datetime.datetime.now())
+    ).first()
+    if row is None:
+        return None
+    if row.fingerprint != fingerprint:
+        raise Conflict("The idempotency key has already been used for a different request.", detail=key)
+    return Response(row.body, status_code=row.status, media_type="application/json", headers={REPLAYED_HEADER: "true"})
+
+
+def store(session: Session, application_id: int, key: str, fingerprint: str, response: Response):
+    """
+    Store the response for the key of the application in the session's unit of work
+
+    Expired keys of the application are deleted in the same step. Storing a key which
+    has been stored by a concurrent request already fails when it's flushed or committed.
+    """
+
+    now = datetime.datetime.now()
+    session.execute(
+        delete(idempotency_keys)
+        .where(idempotency_keys.c.application_id == application_id)
+        .where(idempotency_keys.c.expires <= now)
+    )
+    session.execute(insert(idempotency_keys).values(
+        application_id=application_id,
+        key=key,
+        fingerprint=fingerprint,
+        status=response.status_code,
+        body=response.body,
+        expires=now + datetime.timedelta(minutes=key_lifetime)
+    ))
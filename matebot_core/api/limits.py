@@ -0,0 +1,138 @@
+"""
+MateBot API library for rate limiting and admission control
+
+Every application has two token buckets per worker process: one for reading
+requests (``GET`` and ``HEAD``) and one for all other, i.e. writing requests.
+A bucket holds up to ``burst`` tokens and is refilled with ``rate`` tokens per
+second. Each request of an application takes one token of the matching bucket
+or is rejected if the bucket is empty, telling the client when to retry.
+
+Additionally, the number of requests handled concurrently by a worker process
+can be capped. Requests exceeding that cap are rejected immediately instead of
+queueing up, so that the worker stays responsive under load.
+"""
+
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+from ..schemas import config
+
+
+READ = "read"
+WRITE = "write"
+
+
+def request_kind(method: str) -> str:
+    """
+    Return the kind of the rate limit which applies to requests of the given HTTP method
+    """
+
+    return READ if method in ("GET", "HEAD") else WRITE
+
+
+class TokenBucket:
+    """
+    Token bucket with a maximum of ``burst`` tokens, refilled with ``rate`` tokens per second
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def acquire(self, now: float) -> float:
+        """
+        Take one token at the given monotonic time, returning zero or the number of seconds until one is available
+        """
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Thread-safe collection of the token buckets of all applications, using the configured limits
+    """
+
+    def __init__(self, limits: Optional[config.RateLimitConfig] = None):
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.limits = limits or config.RateLimitConfig()
+        self.admitted: Dict[Tuple[str, str], int] = {}
+        self.rejected: Dict[Tuple[str, str], int] = {}
+
+    def configure(self, limits: config.RateLimitConfig):
+        with self._lock:
+            self.limits = limits
+            self._buckets.clear()
+
+    def get_limit(self, application: str, kind: str) -> Optional[config.RateLimit]:
+        """
+        Return the limit of the application for requests of the kind (falling back to the default limits)
+        """
+
+        override = self.limits.applications.get(application)
+        return (override and getattr(override, kind)) or getattr(self.limits, kind)
+
+    def acquire(self, application: str, kind: str) -> float:
+        """
+        Admit a request of the application, returning zero or the number of seconds to wait before retrying
+        """
+
+        limit = self.get_limit(application, kind)
+        key = (application, kind)
+        with self._lock:
+            wait = 0.0
+            if limit is not None:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = TokenBucket(limit.rate, limit.burst)
+                wait = bucket.acquire(time.monotonic())
+            counts = self.rejected if wait > 0 else self.admitted
+            counts[key] = counts.get(key, 0) + 1
+        return wait
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"admitted": sum(self.admitted.values()), "rejected": sum(self.rejected.values())}
+
+
+class ConcurrencyLimiter:
+    """
+    Counter of the requests handled concurrently, which admits at most ``limit`` requests (zero means no limit)
+
+    The counter is only used by the event loop of the worker process, so it doesn't need any locks.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.active = 0
+        self.peak = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        if 0 < self.limit <= self.active:
+            self.rejected += 1
+            return False
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        return True
+
+    def release(self):
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "peak": self.peak, "rejected": self.rejected}
+
+
+rate_limiter = RateLimiter()
+"""Rate limiter of all applications of the worker process, configured by ``ServerConfig.rate_limits``"""
+
+concurrency_limiter = ConcurrencyLimiter()
+"""Limiter of concurrent requests of the worker process, configured by ``ServerConfig.max_concurrent_requests``"""
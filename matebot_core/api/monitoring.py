@@ -0,0 +1,299 @@
+"""
+MateBot API library for the metrics of the worker process (see ``misc.metrics``)
+
+Requests are counted and timed per method and route template of the versioned
+API (e.g. ``/v1/users/{user_id}``) by the ``UnitOfWorkRoute``, together with
+the number and duration of their database queries. Optionally, the queries are
+added to the response headers and requests exceeding the configured budgets of
+database queries are logged (see ``DatabaseConfig``). The state of the database
+connection pool, the callback queue, caches and admission control is read only
+when the metrics are rendered by the metrics endpoint.
+"""
+
+import time
+import logging
+from typing import Dict, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError, StarletteHTTPException
+
+from . import limits
+from ..misc import cache, loop_monitor, metrics, notifier, tracing
+from ..persistence import database, slow_queries, statistics
+
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+SERVER_TIMING_HEADER = "Server-Timing"
+
+debug_query_headers: bool = False
+"""Switch to add the database queries to the response headers, see ``DatabaseConfig.debug_query_headers``"""
+
+query_count_budget: int = 0
+"""Number of database queries per request above which it's logged, see ``DatabaseConfig.query_count_budget``"""
+
+query_duration_budget: float = 0.0
+"""Duration of database queries per request above which it's logged, see ``DatabaseConfig.query_duration_budget``"""
+
+access_logger = logging.getLogger(f"{__name__}.access")
+"""Logger of the structured access log, whose records contain the fields of the entry in the attribute ``fields``"""
+# The entries must not end up in the general log, e.g. with logging configurations lacking a handler for them
+access_logger.propagate = False
+
+DB_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+"""Upper bounds of the buckets of the histogram of the number of database queries per request"""
+
+requests_total = metrics.registry.counter(
+    "matebot_http_requests_total",
+    "Number of handled requests per method, route and status code",
+    ("method", "route", "status")
+)
+request_duration = metrics.registry.histogram(
+    "matebot_http_request_duration_seconds",
+    "Duration of handling requests per method and route",
+    ("method", "route")
+)
+request_db_queries = metrics.registry.histogram(
+    "matebot_http_request_db_queries",
+    "Number of database queries per request and route",
+    ("route",),
+    buckets=DB_QUERY_BUCKETS
+)
+request_db_duration = metrics.registry.histogram(
+    "matebot_http_request_db_duration_seconds",
+    "Total duration of the database queries per request and route",
+    ("route",)
+)
+
+
+def get_status_code(exc: Exception) -> int:
+    """
+    Return the status code of the response the exception handlers will send for the exception
+    """
+
+    if isinstance(exc, StarletteHTTPException):
+        return exc.status_code
+    if isinstance(exc, (RequestValidationError, RuntimeError)):
+        return 400
+    return 500
+
+
+def observe_request(
+        method: str,
+        route: str,
+        status: int,
+        duration: float,
+        queries: Optional[statistics.QueryStatistics]
+):
+    requests_total.inc(method, route, str(status))
+    request_duration.observe(duration, method, route)
+    if queries is not None:
+        request_db_queries.observe(queries.count, route)
+        request_db_duration.observe(queries.duration, route)
+
+
+def _get_pool_connections() -> Dict[Tuple[str], float]:
+    pool = database.get_engine().pool
+    values = {}
+    # Only the queue pool of database servers tracks its connections, but not the pools used for sqlite
+    for state, attribute in [("idle", "checkedin"), ("used", "checkedout"), ("overflow", "overflow")]:
+        func = getattr(pool, attribute, None)
+        if func is not None:
+            values[(state,)] = func()
+    return values
+
+
+def _get_pool_size() -> Dict[Tuple, float]:
+    size = getattr(database.get_engine().pool, "size", None)
+    return {(): size()} if size is not None else {}
+
+
+def _get_rate_limited_requests() -> Dict[Tuple[str, str, str], float]:
+    values = {}
+    for result, counts in [("admitted", limits.rate_limiter.admitted), ("rejected", limits.rate_limiter.rejected)]:
+        for (application, kind), count in list(counts.items()):
+            values[(application, kind, result)] = count
+    return values
+
+
+def register_callback_metrics(
+        caches: Dict[str, Union[cache.LRUCache, cache.SQLiteFileCache]],
+        search_flights: cache.SingleFlight,
+        registry: metrics.Registry = metrics.registry
+):
+    """
+    Register the metrics which are read from other components of the worker process on demand
+
+    :param caches: mapping of names to the caches whose hits and misses should be exported
+    :param search_flights: group of coalesced search requests whose statistics should be exported
+    :param registry: registry of the metrics
+    """
+
+    def get_cache_lookups() -> Dict[Tuple[str, str], float]:
+        values = {}
+        for name, c in caches.items():
+            values[(name, "hit")] = c.hits
+            values[(name, "miss")] = c.misses
+        return values
+
+    for metric in [
+        metrics.CallbackMetric(
+            "matebot_db_pool_connections",
+            "Number of connections of the database connection pool per state",
+            _get_pool_connections,
+            ("state",)
+        ),
+        metrics.CallbackMetric(
+            "matebot_db_pool_size",
+            "Configured number of connections of the database connection pool",
+            _get_pool_size
+        ),
+        metrics.CallbackMetric(
+            "matebot_notifier_queue_depth",
+            "Number of callback events waiting to be published",
+            lambda: notifier.Callback.queue.qsize()
+        ),
+        metrics.CallbackMetric(
+            "matebot_cache_lookups_total",
+            "Number of cache lookups per cache and result",
+            get_cache_lookups,
+            ("cache", "result"),
+            "counter"
+        ),
+        metrics.CallbackMetric(
+            "matebot_search_calls_total",
+            "Number of searches which have been executed or shared with concurrent identical searches",
+            lambda: {("executed",): search_flights.calls, ("shared",): search_flights.shared},
+            ("result",),
+            "counter"
+        ),
+        metrics.CallbackMetric(
+            "matebot_rate_limited_requests_total",
+            "Number of requests checked by the rate limiter per application, kind and result",
+            _get_rate_limited_requests,
+            ("application", "kind", "result"),
+            "counter"
+        ),
+        metrics.CallbackMetric(
+            "matebot_slow_queries_total",
+            "Number of slow database queries which have been logged or suppressed",
+            lambda: {("logged",): slow_queries.logged, ("suppressed",): slow_queries.suppressed},
+            ("result",),
+            "counter"
+        ),
+        metrics.CallbackMetric(
+            "matebot_event_loop_lag_quantile_seconds",
+            "Scheduling lag of the event loop of the latest samples per quantile",
+            lambda: {(str(q),): lag for q, lag in loop_monitor.monitor.percentiles(0.5, 0.9, 0.99, 1.0).items()},
+            ("quantile",)
+        ),
+        metrics.CallbackMetric(
+            "matebot_event_loop_blocked_total",
+            "Number of times the event loop has been blocked for longer than the threshold",
+            lambda: loop_monitor.monitor.blocked,
+            metric_type="counter"
+        ),
+        metrics.CallbackMetric(
+            "matebot_concurrent_requests",
+            "Number of requests being handled concurrently",
+            lambda: limits.concurrency_limiter.active
+        ),
+        metrics.CallbackMetric(
+            "matebot_shed_requests_total",
+            "Number of requests rejected by the limit of concurrent requests",
+            lambda: limits.concurrency_limiter.rejected,
+            metric_type="counter"
+        )
+    ]:
+        registry.register(metric)
+
+
+class RequestTimer:
+    """
+    Measurement of the duration and database queries of a single request
+    """
+
+    __slots__ = ("start", "duration", "queries", "_token")
+
+    def __init__(self, route: Optional[str] = None):
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.queries, self._token = statistics.start(route)
+
+    def stop(self, method: str, route: str, status: int):
+        """
+        Stop the measurement, update the request metrics and log the request if it exceeded the query budgets
+        """
+
+        statistics.stop(self._token)
+        self.duration = time.perf_counter() - self.start
+        observe_request(method, route, status, self.duration, self.queries)
+        if (
+            0 < query_count_budget < self.queries.count
+            or 0 < query_duration_budget < self.queries.duration
+        ):
+            logging.getLogger(__name__).warning(
+                "Request %s %s (%d) exceeded the query budget: %d queries in %.1f ms (%.1f ms in total)",
+                method,
+                route,
+                status,
+                self.queries.count,
+                self.queries.duration * 1000,
+                self.duration * 1000
+            )
+
+    def add_headers(self, response: Response):
+        """
+        Add the number and duration of the database queries and the total duration to the response headers
+        """
+
+        response.headers[QUERY_COUNT_HEADER] = str(self.queries.count)
+        response.headers[SERVER_TIMING_HEADER] = (
+            f'db;dur={self.queries.duration * 1000:.2f};desc="{self.queries.count} queries", '
+            f"total;dur={self.duration * 1000:.2f}"
+        )
+
+
+def log_access(
+        request: Request,
+        route: str,
+        status: int,
+        timer: RequestTimer,
+        response: Optional[Response] = None
+):
+    """
+    Write the structured access log entry of the request, if the access logger is enabled and has a handler
+
+    The authenticated application is taken from the state of the request (see
+    ``LocalRequestData``) and the trace ID from the current context (see
+    ``misc.tracing``). The size of the response is the length of its body
+    before compression, which isn't known for streaming and failed responses.
+    """
+
+    if not access_logger.isEnabledFor(logging.INFO) or not access_logger.hasHandlers():
+        return
+    size = None
+    if response is not None:
+        body = getattr(response, "body", None)
+        if body is not None:
+            size = len(body)
+        elif "content-length" in response.headers:
+            size = int(response.headers["content-length"])
+    access_logger.info(
+        "%s %s %d",
+        request.method,
+        route,
+        status,
+        extra={"fields": {
+            "method": request.method,
+            "route": route,
+            "path": request.url.path,
+            "status": status,
+            "application": getattr(request.state, "application", None),
+            "client": request.client and request.client.host,
+            "duration_ms": round(timer.duration * 1000, 3),
+            "db_duration_ms": round(timer.queries.duration * 1000, 3),
+            "db_queries": timer.queries.count,
+            "response_size": size,
+            "trace_id": tracing.current_trace_id()
+        }}
+    )
@@ -0,0 +1,161 @@
+"""
+MateBot ASGI middleware for MessagePack content negotiation
+
+Clients which send ``Accept: application/msgpack`` receive the same data as
+with JSON, but encoded as MessagePack, which is smaller and faster to parse.
+Request bodies with ``Content-Type: application/msgpack`` are accepted as
+well. JSON stays the default, i.e. MessagePack is only used when a client
+prefers it explicitly. Every response therefore varies by the ``Accept``
+header, and the ``ETag`` validators depend on the representation as well
+(see ``representation``). The API itself only deals with JSON: this middleware
+transcodes request and response bodies, so that the same pydantic schemas
+are used for validation and serialization. This requires the optional
+``msgpack`` package to be installed.
+"""
+
+from typing import List, Optional
+
+import ujson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+
+def _media_type(content_type: str) -> str:
+    return content_type.split(";")[0].strip().lower()
+
+
+def prefers_msgpack(accept: str) -> bool:
+    """
+    Determine whether the ``Accept`` header prefers MessagePack over JSON (ties are resolved to JSON)
+    """
+
+    msgpack_quality = 0.0
+    json_quality = 0.0
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        media_type = media_type.lower()
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type in MSGPACK_MEDIA_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_quality = max(json_quality, quality)
+    return msgpack_quality > json_quality
+
+
+def representation(accept: str) -> str:
+    """
+    Return the name of the representation of responses for the given ``Accept`` header, i.e. ``json`` or ``msgpack``
+    """
+
+    if msgpack is not None and prefers_msgpack(accept):
+        return "msgpack"
+    return "json"
+
+
+def _replace_headers(raw_headers: List[tuple], content_type: str, content_length: int) -> List[tuple]:
+    headers = [(k, v) for k, v in raw_headers if k.lower() not in (b"content-type", b"content-length")]
+    headers.append((b"content-type", content_type.encode("latin-1")))
+    headers.append((b"content-length", str(content_length).encode("latin-1")))
+    return headers
+
+
+class MessagePackMiddleware:
+    """
+    Middleware transcoding MessagePack request bodies to JSON and JSON response bodies to MessagePack
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if _media_type(headers.get("Content-Type", "")) in MSGPACK_MEDIA_TYPES:
+            scope, receive = await self._transcode_request(scope, receive)
+        if not prefers_msgpack(headers.get("Accept", "")):
+            async def send_json(message: Message) -> None:
+                # Shared caches must not serve a JSON response to clients preferring MessagePack (and vice versa)
+                if message["type"] == "http.response.start":
+                    MutableHeaders(raw=message["headers"]).add_vary_header("Accept")
+                await send(message)
+
+            await self.app(scope, receive, send_json)
+            return
+
+        start_message: Optional[Message] = None
+        body_parts = []
+
+        async def send_msgpack(message: Message) -> None:
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                response_headers = Headers(raw=message["headers"])
+                if _media_type(response_headers.get("Content-Type", "")) == "application/json":
+                    start_message = message
+                    return
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept")
+                await send(message)
+            elif message["type"] == "http.response.body" and start_message is not None:
+                body_parts.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                body = b"".join(body_parts)
+                if body:
+                    body = msgpack.packb(ujson.loads(body))
+                start_message["headers"] = _replace_headers(start_message["headers"], MSGPACK_MEDIA_TYPE, len(body))
+                MutableHeaders(raw=start_message["headers"]).add_vary_header("Accept")
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_msgpack)
+
+    @staticmethod
+    async def _transcode_request(scope: Scope, receive: Receive):
+        body_parts = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return scope, receive
+            body_parts.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        body = b"".join(body_parts)
+        try:
+            body = ujson.dumps(msgpack.unpackb(body), ensure_ascii=False).encode("utf-8")
+        except (ValueError, TypeError, msgpack.UnpackException):
+            # The invalid body is passed on as it is, so that it's rejected like any other malformed JSON body
+            pass
+
+        scope = dict(scope)
+        scope["headers"] = _replace_headers(scope["headers"], "application/json", len(body))
+        sent = False
+
+        async def receive_json() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return scope, receive_json
@@ -9,3 +9,4 @@ from ._router import router
 
 # The order of the imports defines the order of the endpoints in the OpenAPI documentation
 from . import login, generic, searches, aliases, communisms, polls, refunds, transactions, users, callbacks
+from . import batch, profiler
@@ -3,4 +3,8 @@ MateBot API router instance
 """
 
 from fastapi import APIRouter
-router = APIRouter()
+from fastapi.responses import UJSONResponse
+
+from ..dependency import UnitOfWorkRoute
+
+router = APIRouter(route_class=UnitOfWorkRoute, default_response_class=UJSONResponse)
@@ -6,14 +6,15 @@ import logging
 from typing import List, Optional
 
 import pydantic
+import sqlalchemy
 from fastapi import Depends
 
 from ._router import router
 from ..base import BadRequest, Conflict
-from ..dependency import LocalRequestData
+from ..dependency import LocalRequestData, id_list
 from .. import helpers, versioning
 from ...misc.notifier import Callback
-from ...persistence import models
+from ...persistence import counters, models
 from ... import schemas
 
 
@@ -23,11 +24,13 @@ logger = logging.getLogger(__name__)
 @router.get("/aliases", tags=["Aliases"], response_model=List[schemas.Alias])
 @versioning.versions(minimal=1)
 async def search_for_aliases(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         user_id: Optional[pydantic.NonNegativeInt] = None,
         application_id: Optional[pydantic.NonNegativeInt] = None,
         username: Optional[pydantic.constr(max_length=255)] = None,
         confirmed: Optional[bool] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
@@ -35,6 +38,10 @@ async def search_for_aliases(
 ):
     """
     Return all aliases that fulfill *all* constraints given as query parameters
+
+    Use `created_since` or `modified_since` (UNIX timestamps) to only fetch aliases
+    which were created or modified since then. Deleted aliases can't be found this
+    way, but their users will be reported as modified by `GET /users`.
     """
 
     return helpers.search_models(
@@ -43,6 +50,8 @@ async def search_for_aliases(
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
         id=id,
         user_id=user_id,
         application_id=application_id,
@@ -96,11 +105,13 @@ async def create_new_alias(
         confirmed=alias.confirmed
     )
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
+    counters.bump_counter(local.session, counters.ALIASES)
 
     Callback.push(
         schemas.EventType.ALIAS_CONFIRMED if alias.confirmed else schemas.EventType.ALIAS_CONFIRMATION_REQUESTED,
-        {"id": model.id, "user": model.user_id, "app": model.application.name}
+        {"id": model.id, "user": model.user_id, "app": model.application.name},
+        local.session
     )
     return model.schema
 
@@ -132,18 +143,20 @@ async def confirm_existing_alias(
         raise Conflict("This user account has been disabled, therefore it can't get new aliases.")
     if user.special:
         raise Conflict("The community user can't handle aliases.")
-    if local.origin_app.id == model.application_id:
+    if local.origin_app_id == model.application_id:
         raise BadRequest("You can't confirm an alias with the same application, use another app.")
     if model.confirmed:
         return model.schema
 
     model.confirmed = True
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
+    counters.bump_counter(local.session, counters.ALIASES)
 
     Callback.push(
         schemas.EventType.ALIAS_CONFIRMED,
-        {"id": model.id, "user": model.user_id, "app": model.application.name}
+        {"id": model.id, "user": model.user_id, "app": model.application.name},
+        local.session
     )
     return model.schema
 
@@ -171,6 +184,8 @@ async def delete_existing_alias(
         raise BadRequest("You are not permitted to delete this alias, only the owner may do it.", str(issuer))
     logger.debug(f"Dropping alias ID {body.id}: {model!r} ...")
     local.session.delete(model)
-    local.session.commit()
-    user = await helpers.return_one(issuer.id, models.User, local.session)
-    return schemas.AliasDeletion(aliases=[a.schema for a in user.aliases], user_id=user.id)
+    issuer.modified = sqlalchemy.func.now()
+    local.session.flush()
+    counters.bump_counter(local.session, counters.ALIASES)
+    local.session.expire(issuer, ["aliases"])
+    return schemas.AliasDeletion(aliases=[a.schema for a in issuer.aliases], user_id=issuer.id)
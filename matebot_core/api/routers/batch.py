@@ -0,0 +1,145 @@
+"""
+MateBot router module for /batch requests
+"""
+
+import logging
+import urllib.parse
+from typing import List
+
+import ujson
+from fastapi import Depends
+from starlette.types import Message
+
+from ._router import router
+from ..base import BadRequest
+from ..dependency import BATCH_SESSION_SCOPE_KEY, LocalRequestData
+from .. import versioning
+from ... import schemas
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_batch_path(path: str) -> bool:
+    return urllib.parse.urlsplit(path).path.rstrip("/") == "/batch"
+
+
+async def _run_operation(operation: schemas.BatchOperation, local: LocalRequestData) -> schemas.BatchResult:
+    """
+    Run a single operation as sub-request of the batch request in-process, using its session and token
+    """
+
+    url = urllib.parse.urlsplit(operation.path)
+    body = b"" if operation.body is None else ujson.dumps(operation.body, ensure_ascii=False).encode("utf-8")
+    parent = local.request.scope
+    scope = {
+        "type": "http",
+        "asgi": parent.get("asgi", {"version": "3.0"}),
+        "http_version": parent.get("http_version", "1.1"),
+        "method": operation.method,
+        "scheme": parent.get("scheme", "http"),
+        "server": parent.get("server"),
+        "client": parent.get("client"),
+        "root_path": parent.get("root_path", ""),
+        "path": urllib.parse.unquote(url.path),
+        "raw_path": url.path.encode("latin-1"),
+        "query_string": url.query.encode("latin-1"),
+        "headers": [
+            (b"authorization", local.headers["Authorization"].encode("latin-1")),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1"))
+        ],
+        BATCH_SESSION_SCOPE_KEY: local.session
+    }
+
+    received = False
+    status = None
+    content_type = ""
+    body_parts: List[bytes] = []
+
+    async def receive() -> Message:
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: Message) -> None:
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for key, value in message.get("headers", []):
+                if key.lower() == b"content-type":
+                    content_type = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            body_parts.append(message.get("body", b""))
+
+    try:
+        await local.request.app(scope, receive, send)
+    except Exception:
+        # The server error middleware sends its error response before re-raising the exception
+        if status is None:
+            logger.exception(f"Unhandled exception in batch operation {operation.method} {operation.path}")
+            return schemas.BatchResult(status=500)
+
+    content = b"".join(body_parts)
+    if not content:
+        return schemas.BatchResult(status=status)
+    if content_type.split(";")[0].strip() == "application/json":
+        return schemas.BatchResult(status=status, body=ujson.loads(content))
+    return schemas.BatchResult(status=status, body=content.decode("utf-8", errors="replace"))
+
+
+@router.post(
+    "/batch",
+    tags=["Batch"],
+    response_model=schemas.BatchResponse,
+    responses={400: {"model": schemas.APIError}}
+)
+@versioning.versions(minimal=1)
+async def run_batch_request(
+        body: schemas.BatchRequest,
+        local: LocalRequestData = Depends(LocalRequestData)
+):
+    """
+    Run up to 100 operations of this API in one request, in order and in one database transaction
+
+    Every operation consists of the HTTP `method`, the `path` of the endpoint
+    relative to this API version (e.g. `/communisms/increaseParticipation`,
+    optionally including a query string) and the JSON `body`, if any. The
+    operations are executed in-process with the access token of the batch
+    request. The results contain the status code and the JSON body of the
+    response of every operation, in the same order as the operations.
+
+    In the `atomic` mode (default), the first failed operation (status code
+    `400` or above) rolls back all changes of the batch. Operations after it
+    are skipped and have the status code `424` (Failed Dependency) without a
+    body. In the `independent` mode, every operation runs in a savepoint, so
+    that only the changes of failed operations are rolled back. The field
+    `committed` shows whether the changes of the batch have been committed.
+    Callback events are published only for the committed changes.
+
+    * `400`: if any operation targets this endpoint itself
+    """
+
+    for operation in body.operations:
+        if _is_batch_path(operation.path):
+            raise BadRequest("Batch requests can't be nested.", detail=operation.path)
+
+    results = []
+    for i, operation in enumerate(body.operations):
+        savepoint = local.session.begin_nested() if body.mode == schemas.BatchMode.INDEPENDENT else None
+        result = await _run_operation(operation, local)
+        results.append(result)
+        if savepoint is not None:
+            if result.status < 400:
+                savepoint.commit()
+            else:
+                savepoint.rollback()
+        elif result.status >= 400:
+            logger.debug(f"Rolling back batch request after failed operation {i}: {operation.method} {operation.path}")
+            local.session.rollback()
+            results.extend(schemas.BatchResult(status=424) for _ in body.operations[i+1:])
+            return schemas.BatchResponse(committed=False, results=results)
+
+    return schemas.BatchResponse(committed=True, results=results)
@@ -10,7 +10,7 @@ from fastapi import APIRouter, Depends
 
 from ._router import router
 from ..base import Conflict
-from ..dependency import LocalRequestData
+from ..dependency import LocalRequestData, id_list
 from .. import helpers, versioning
 from ...persistence import models
 from ... import schemas
@@ -40,7 +40,7 @@ def send_callback_query(events: schemas.EventsNotification):  # noqa
 @router.get("/callbacks", tags=["Callbacks"], response_model=List[schemas.Callback], callbacks=callback_router.routes)
 @versioning.versions(minimal=1)
 async def search_for_callbacks(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         url: Optional[pydantic.constr(max_length=255)] = None,
         application_id: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
@@ -96,7 +96,7 @@ async def create_new_callback(
         shared_secret=callback.shared_secret
     )
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
     return model.schema
 
 
@@ -6,12 +6,13 @@ import logging
 from typing import List, Optional
 
 import pydantic
+import sqlalchemy
 from fastapi import Depends
 
 from ._router import router
 from ..base import BadRequest, Conflict
-from ..dependency import LocalRequestData
-from .. import helpers, versioning
+from ..dependency import LocalRequestData, id_list
+from .. import helpers, idempotency, versioning
 from ...persistence import models
 from ...misc.notifier import Callback
 from ...misc.transactions import create_many_to_one_transaction_by_total
@@ -55,12 +56,15 @@ async def _update_participation(
         else:
             raise BadRequest(f"You don't participate in this communism, you can't leave it.")
 
+    communism.modified = sqlalchemy.func.now()
     local.session.add(communism)
-    local.session.commit()
+    local.session.flush()
+    local.session.expire(communism, ["participants"])
 
     Callback.push(
         schemas.EventType.COMMUNISM_UPDATED,
-        {"id": communism.id, "participants": sum([p.quantity for p in communism.participants])}
+        {"id": communism.id, "participants": sum([p.quantity for p in communism.participants])},
+        local.session
     )
     return communism.schema
 
@@ -68,7 +72,7 @@ async def _update_participation(
 @router.get("/communisms", tags=["Communisms"], response_model=List[schemas.Communism])
 @versioning.versions(minimal=1)
 async def search_for_communisms(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         active: Optional[bool] = None,
         amount: Optional[pydantic.PositiveInt] = None,
         description: Optional[pydantic.constr(max_length=255)] = None,
@@ -76,13 +80,25 @@ async def search_for_communisms(
         participant_id: Optional[pydantic.NonNegativeInt] = None,
         total_participants: Optional[pydantic.NonNegativeInt] = None,
         unique_participants: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        fields: Optional[pydantic.constr(max_length=255)] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         local: LocalRequestData = Depends(LocalRequestData)
 ):
     """
     Return all communisms that fulfill *all* constraints given as query parameters
+
+    Use the UNIX timestamps `created_since` and `modified_since` to only fetch
+    communisms created or changed since then (joining or leaving a communism
+    changes it, too).
+
+    Use `fields` to select a comma-separated list of fields to be returned
+    (the `id` is always included). With `expand=none`, the multi transaction
+    is returned as `multi_transaction_id` instead of the nested object.
     """
 
     def extended_filter(communism: models.Communism) -> bool:
@@ -101,6 +117,10 @@ async def search_for_communisms(
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
+        fields=fields,
+        expand=expand,
         id=id,
         active=active,
         amount=amount,
@@ -147,10 +167,11 @@ async def create_new_communism(
         participants=[models.CommunismUsers(user_id=creator.id, quantity=1)]
     )
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
     Callback.push(
         schemas.EventType.COMMUNISM_CREATED,
-        {"id": model.id, "user": model.creator.id, "amount": model.amount, "participants": 1}
+        {"id": model.id, "user": model.creator.id, "amount": model.amount, "participants": 1},
+        local.session
     )
     return model.schema
 
@@ -184,12 +205,13 @@ async def abort_open_communism(
     model.active = False
     logger.debug(f"Aborting communism {model}")
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     total_participants = sum([p.quantity for p in model.participants])
     Callback.push(
         schemas.EventType.COMMUNISM_CLOSED,
-        {"id": model.id, "aborted": True, "transactions": 0, "participants": total_participants}
+        {"id": model.id, "aborted": True, "transactions": 0, "participants": total_participants},
+        local.session
     )
     return model.schema
 
@@ -201,6 +223,7 @@ async def abort_open_communism(
     responses={400: {"model": schemas.APIError}}
 )
 @versioning.versions(1)
+@idempotency.idempotent
 async def close_open_communism(
         body: schemas.IssuerIdBody,
         local: LocalRequestData = Depends(LocalRequestData)
@@ -208,6 +231,8 @@ async def close_open_communism(
     """
     Close an open communism (closing it with performing transactions)
 
+    This endpoint supports the `Idempotency-Key` header to safely retry requests.
+
     * `400`: if the communism is unknown or already closed or
         if the issuer is not permitted to perform the operation
     """
@@ -234,15 +259,16 @@ async def close_open_communism(
         )
 
     model.multi_transaction = m
-    logger.debug(f"Closing communism {model} (created multi transaction {m} with {len(ts)} parts)")
+    logger.debug("Closing communism %s (created multi transaction %s with %d parts)", model, m, len(ts))
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     transactions = (m and len(model.multi_transaction.transactions)) or 0
     total_participants = sum([p.quantity for p in model.participants])
     Callback.push(
         schemas.EventType.COMMUNISM_CLOSED,
-        {"id": model.id, "aborted": False, "transactions": transactions, "participants": total_participants}
+        {"id": model.id, "aborted": False, "transactions": transactions, "participants": total_participants},
+        local.session
     )
     return model.schema
 
@@ -4,7 +4,7 @@ MateBot router module for authentication
 
 import logging
 
-from fastapi import Depends
+from fastapi import Depends, Form
 from fastapi.security import OAuth2PasswordRequestForm
 from argon2.exceptions import VerifyMismatchError
 
@@ -36,7 +36,7 @@ async def login(
 
     logger.debug(f"Login request using username {data.username!r}...")
     try:
-        await auth.check_app_credentials(data.username, data.password, local.session)
+        application_id = await auth.check_app_credentials(data.username, data.password, local.session)
     except (ValueError, VerifyMismatchError) as exc:
         raise APIException(
             status_code=401,
@@ -53,5 +53,41 @@ async def login(
 
     return {
         "access_token": auth.create_access_token(data.username),
-        "token_type": "bearer"
+        "token_type": "bearer",
+        "refresh_token": auth.create_refresh_token(local.session, application_id, data.username)
+    }
+
+
+@router.post("/refresh", tags=["Authentication"], response_model=schemas.Token)
+@versioning.versions(1)
+async def refresh(
+        refresh_token: str = Form(),
+        local: MinimalRequestData = Depends(MinimalRequestData)
+):
+    """
+    Gather a new access token using the refresh token issued by `POST /login`
+
+    This avoids the expensive password verification of the login. Every
+    refresh token can be used only once: the response contains a new refresh
+    token, which replaces the used one and all other refresh tokens issued
+    to the application before. The application needs to login again once
+    the refresh token has expired. Like the login, this endpoint uses
+    URL-encoded form data.
+
+    See RFC 6749, section 6, for more details.
+
+    * `401`: if the refresh token is invalid, expired or has been used already
+        or if the application has been deleted in the meantime
+    """
+
+    try:
+        claims = auth.use_refresh_token(local.session, refresh_token)
+    except ValueError as exc:
+        raise APIException(status_code=401, detail=str(exc), message="Invalid refresh token") from exc
+    logger.debug(f"Refreshed access token of {claims.name!r}")
+
+    return {
+        "access_token": auth.create_access_token(claims.name),
+        "token_type": "bearer",
+        "refresh_token": auth.create_refresh_token(local.session, claims.application_id, claims.name)
     }
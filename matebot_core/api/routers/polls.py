@@ -10,7 +10,7 @@ from fastapi import Depends
 
 from ._router import router
 from ..base import BadRequest, Conflict
-from ..dependency import LocalRequestData
+from ..dependency import LocalRequestData, id_list
 from .. import helpers, versioning
 from ...misc.notifier import Callback
 from ...persistence import models
@@ -23,26 +23,46 @@ logger = logging.getLogger(__name__)
 @router.get("/polls", tags=["Polls"], response_model=List[schemas.Poll])
 @versioning.versions(minimal=1)
 async def search_for_polls(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         active: Optional[bool] = None,
         accepted: Optional[bool] = None,
         user_id: Optional[pydantic.NonNegativeInt] = None,
         ballot_id: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        fields: Optional[pydantic.constr(max_length=255)] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         local: LocalRequestData = Depends(LocalRequestData)
 ):
     """
     Return all polls that fulfill *all* constraints given as query parameters
+
+    The UNIX timestamps `created_since` and `modified_since` restrict the
+    results to polls created or changed since then, where a vote which has
+    been cast or changed counts as a change of its poll.
+
+    Use `fields` to select a comma-separated list of fields to be returned
+    (the `id` is always included). With `expand=none`, the user is returned as
+    `user_id` and the votes are omitted (search them via `GET /votes` instead).
+
+    The response carries an `ETag` header. Requests whose `If-None-Match`
+    header matches the current `ETag` are answered with `304` (Not Modified).
     """
 
-    return helpers.search_models(
+    return await helpers.search_models_cached(
         models.Poll,
         local,
+        dependencies=[models.Poll, models.User, models.Alias, models.Ballot, models.Vote],
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
+        fields=fields,
+        expand=expand,
         id=id,
         active=active,
         accepted=accepted,
@@ -130,11 +150,12 @@ async def create_new_membership_poll(
 
     model = models.Poll(user=user, creator=issuer, ballot=models.Ballot(), variant=poll.variant)
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     Callback.push(
         schemas.EventType.POLL_CREATED,
-        {"id": model.id, "user": model.user_id, "variant": str(poll.variant.value)}
+        {"id": model.id, "user": model.user_id, "variant": str(poll.variant.value)},
+        local.session
     )
     return model.schema
 
@@ -192,10 +213,11 @@ async def vote_for_membership_request(
 
     model = models.Vote(user=user, ballot=ballot, vote=vote.vote)
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
     Callback.push(
         schemas.EventType.POLL_UPDATED,
-        {"id": model.id, "last_vote": model.id, "current_result": ballot.result}
+        {"id": model.id, "last_vote": model.id, "current_result": ballot.result},
+        local.session
     )
 
     if ballot.result >= local.config.general.min_membership_approves:
@@ -223,13 +245,13 @@ async def vote_for_membership_request(
         poll.accepted = True
         local.session.add(poll)
         local.session.add(poll.user)
-        local.session.commit()
+        local.session.flush()
 
     elif -ballot.result >= local.config.general.min_membership_disapproves:
         poll.active = False
         poll.accepted = False
         local.session.add(poll)
-        local.session.commit()
+        local.session.flush()
 
     if not poll.active:
         Callback.push(
@@ -241,7 +263,8 @@ async def vote_for_membership_request(
                 "aborted": False,
                 "variant": str(poll.variant.value),  # noqa
                 "last_vote": model.id
-            }
+            },
+            local.session
         )
     return schemas.PollVoteResponse(poll=poll.schema, vote=model.schema)
 
@@ -275,7 +298,7 @@ async def abort_open_membership_poll(
     model.active = False
     logger.debug(f"Aborting poll {model}")
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     Callback.push(
         schemas.EventType.POLL_CLOSED,
@@ -286,6 +309,7 @@ async def abort_open_membership_poll(
             "aborted": True,
             "variant": str(model.variant.value),
             "last_vote": None
-        }
+        },
+        local.session
     )
     return model.schema
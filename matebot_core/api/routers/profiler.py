@@ -0,0 +1,99 @@
+"""
+MateBot router module for /profiler requests
+"""
+
+import os
+import logging
+from typing import Optional
+
+from fastapi import Depends
+
+from ._router import router
+from ..base import Conflict
+from ..dependency import AdminRequestData
+from .. import versioning
+from ... import schemas
+from ...misc.profiler import profiler
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_status(file: Optional[str] = None) -> schemas.ProfilerStatus:
+    return schemas.ProfilerStatus(
+        running=profiler.running,
+        process=os.getpid(),
+        interval=profiler.interval,
+        samples=profiler.samples,
+        started=profiler.started and int(profiler.started),
+        file=file
+    )
+
+
+@router.get(
+    "/profiler",
+    tags=["Profiler"],
+    response_model=schemas.ProfilerStatus,
+    responses={403: {"model": schemas.APIError}}
+)
+@versioning.versions(minimal=1)
+async def get_profiler_status(_: AdminRequestData = Depends(AdminRequestData)):
+    """
+    Return the state of the sampling profiler of the worker process which handles the request
+
+    * `403`: if the requesting application isn't the administrative application
+    """
+
+    return _get_status()
+
+
+@router.post(
+    "/profiler/start",
+    tags=["Profiler"],
+    response_model=schemas.ProfilerStatus,
+    responses={403: {"model": schemas.APIError}, 409: {"model": schemas.APIError}}
+)
+@versioning.versions(minimal=1)
+async def start_profiler(
+        body: schemas.ProfilerOptions,
+        _: AdminRequestData = Depends(AdminRequestData)
+):
+    """
+    Start the sampling profiler of the worker process which handles the request
+
+    The profiler samples the stacks of all threads of the worker process every
+    `interval` seconds until it's stopped via `POST /profiler/stop` or the server
+    shuts down. Note that every worker process has its own profiler.
+
+    * `403`: if the requesting application isn't the administrative application
+    * `409`: if the profiler is running already
+    """
+
+    if profiler.running:
+        raise Conflict("The profiler is running already.", detail=str(os.getpid()))
+    profiler.start(body.interval)
+    return _get_status()
+
+
+@router.post(
+    "/profiler/stop",
+    tags=["Profiler"],
+    response_model=schemas.ProfilerStatus,
+    responses={403: {"model": schemas.APIError}, 409: {"model": schemas.APIError}}
+)
+@versioning.versions(minimal=1)
+async def stop_profiler(local: AdminRequestData = Depends(AdminRequestData)):
+    """
+    Stop the sampling profiler of the worker process which handles the request
+
+    The sampled stacks are written in the collapsed format of `flamegraph.pl` to
+    a new file in the profile directory of the server, whose path is returned.
+
+    * `403`: if the requesting application isn't the administrative application
+    * `409`: if the profiler isn't running
+    """
+
+    if not profiler.running:
+        raise Conflict("The profiler isn't running.", detail=str(os.getpid()))
+    stacks = profiler.stop()
+    return _get_status(profiler.dump(stacks, local.config.server.profile_directory))
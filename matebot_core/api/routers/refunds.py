@@ -10,8 +10,8 @@ from fastapi import Depends
 
 from ._router import router
 from ..base import BadRequest, Conflict
-from ..dependency import LocalRequestData
-from .. import helpers, versioning
+from ..dependency import LocalRequestData, id_list
+from .. import helpers, idempotency, versioning
 from ...persistence import models
 from ...misc.notifier import Callback
 from ...misc.refunds import attempt_closing_refund
@@ -24,28 +24,49 @@ logger = logging.getLogger(__name__)
 @router.get("/refunds", tags=["Refunds"], response_model=List[schemas.Refund])
 @versioning.versions(minimal=1)
 async def search_for_refunds(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         amount: Optional[pydantic.PositiveInt] = None,
         description: Optional[pydantic.constr(max_length=255)] = None,
         active: Optional[bool] = None,
         creator_id: Optional[pydantic.NonNegativeInt] = None,
         ballot_id: Optional[pydantic.NonNegativeInt] = None,
         transaction_id: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        fields: Optional[pydantic.constr(max_length=255)] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         local: LocalRequestData = Depends(LocalRequestData)
 ):
     """
     Return all refunds that fulfill *all* constraints given as query parameters
+
+    The UNIX timestamps `created_since` and `modified_since` restrict the
+    results to refunds created or changed since then, including refunds
+    whose votes have been cast or changed since then.
+
+    Use `fields` to select a comma-separated list of fields to be returned
+    (the `id` is always included). With `expand=none`, the creator and the
+    transaction are returned as `creator_id` and `transaction_id` while the
+    votes are omitted (search them via `GET /votes` using the `ballot_id`).
+
+    The response carries an `ETag` header. Requests whose `If-None-Match`
+    header matches the current `ETag` are answered with `304` (Not Modified).
     """
 
-    return helpers.search_models(
+    return await helpers.search_models_cached(
         models.Refund,
         local,
+        dependencies=[models.Refund, models.User, models.Alias, models.Ballot, models.Vote, models.Transaction],
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
+        fields=fields,
+        expand=expand,
         id=id,
         amount=amount,
         description=description,
@@ -92,11 +113,12 @@ async def create_new_refund(
         ballot=models.Ballot()
     )
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     Callback.push(
         schemas.EventType.REFUND_CREATED,
-        {"id": model.id, "user": model.creator_id, "amount": model.amount}
+        {"id": model.id, "user": model.creator_id, "amount": model.amount},
+        local.session
     )
     return model.schema
 
@@ -108,6 +130,7 @@ async def create_new_refund(
     responses={k: {"model": schemas.APIError} for k in (400, 409)}
 )
 @versioning.versions(1)
+@idempotency.idempotent
 async def vote_for_refund_request(
         vote: schemas.VoteCreation,
         local: LocalRequestData = Depends(LocalRequestData)
@@ -121,6 +144,8 @@ async def vote_for_refund_request(
     be found in the refund's transaction attribute (if the refund
     request has been accepted, otherwise this attribute is null).
 
+    This endpoint supports the `Idempotency-Key` header to safely retry requests.
+
     * `400`: if the refund is not active anymore, the user has already voted
         in the specified ballot, the ballot wasn't found, the user is not active
         or unprivileged or if the voter's user specification couldn't be resolved
@@ -155,10 +180,11 @@ async def vote_for_refund_request(
 
     model = models.Vote(user=user, ballot=ballot, vote=vote.vote)
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
     Callback.push(
         schemas.EventType.REFUND_UPDATED,
-        {"id": refund.id, "last_vote": model.id, "current_result": ballot.result}
+        {"id": refund.id, "last_vote": model.id, "current_result": ballot.result},
+        local.session
     )
 
     attempt_closing_refund(
@@ -199,10 +225,11 @@ async def abort_open_refund_request(
     model.active = False
     logger.debug(f"Aborting refund {model}")
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
 
     Callback.push(
         schemas.EventType.REFUND_CLOSED,
-        {"id": model.id, "aborted": True, "accepted": False, "transaction": None}
+        {"id": model.id, "aborted": True, "accepted": False, "transaction": None},
+        local.session
     )
     return model.schema
@@ -8,7 +8,7 @@ import pydantic
 from fastapi import Depends
 
 from ._router import router
-from ..dependency import LocalRequestData
+from ..dependency import LocalRequestData, id_list
 from .. import helpers, versioning
 from ...persistence import models
 from ... import schemas
@@ -22,7 +22,7 @@ from ... import schemas
 @router.get("/applications", tags=["Searches"], response_model=List[schemas.Application])
 @versioning.versions(minimal=1)
 async def search_for_applications(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         name: Optional[pydantic.constr(max_length=255)] = None,
         callback_id: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
@@ -83,7 +83,7 @@ async def search_for_consumables(
 @router.get("/votes", tags=["Searches"], response_model=List[schemas.Vote])
 @versioning.versions(minimal=1)
 async def search_for_votes(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         vote: Optional[bool] = None,
         ballot_id: Optional[pydantic.NonNegativeInt] = None,
         user_id: Optional[pydantic.NonNegativeInt] = None,
@@ -7,12 +7,14 @@ from typing import List, Optional
 
 import pydantic
 from fastapi import Depends
+from fastapi.responses import StreamingResponse
 
 from ._router import router
 from ..base import BadRequest, Conflict, NotFound
-from ..dependency import LocalRequestData
-from .. import helpers, versioning
+from ..dependency import LocalRequestData, id_list
+from .. import helpers, idempotency, versioning
 from ...persistence import models
+from ...misc import export
 from ...misc.transactions import create_transaction
 from ... import schemas
 
@@ -23,7 +25,7 @@ logger = logging.getLogger(__name__)
 @router.get("/transactions", tags=["Transactions"], response_model=List[schemas.Transaction])
 @versioning.versions(minimal=1)
 async def search_for_transactions(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         sender_id: Optional[pydantic.NonNegativeInt] = None,
         receiver_id: Optional[pydantic.NonNegativeInt] = None,
         member_id: Optional[pydantic.NonNegativeInt] = None,
@@ -31,13 +33,25 @@ async def search_for_transactions(
         reason: Optional[pydantic.constr(max_length=255)] = None,
         has_multi_transaction: Optional[bool] = None,
         multi_transaction_id: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        fields: Optional[pydantic.constr(max_length=255)] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         local: LocalRequestData = Depends(LocalRequestData)
 ):
     """
     Return all transactions that fulfill *all* constraints given as query parameters
+
+    Since transactions can't be changed, both `created_since` and `modified_since`
+    (UNIX timestamps) only include transactions which were made since then.
+
+    A feed of transactions usually doesn't need the full sender and receiver.
+    Use `expand=none` to get their IDs as `sender_id` and `receiver_id` instead,
+    and/or `fields` to select a comma-separated list of fields to be returned
+    (the `id` is always included). Unused users aren't loaded at all then.
     """
 
     def extended_filter(transaction: models.Transaction) -> bool:
@@ -56,6 +70,10 @@ async def search_for_transactions(
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
+        fields=fields,
+        expand=expand,
         id=id,
         sender_id=sender_id,
         receiver_id=receiver_id,
@@ -64,6 +82,35 @@ async def search_for_transactions(
     )
 
 
+@router.get(
+    "/transactions/export",
+    tags=["Transactions"],
+    response_class=StreamingResponse,
+    responses={200: {"content": {media_type: {} for media_type in export.MEDIA_TYPES.values()}}}
+)
+@versioning.versions(minimal=1)
+async def export_transactions(
+        format: schemas.ExportFormat = schemas.ExportFormat.NDJSON,  # noqa
+        member_id: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        local: LocalRequestData = Depends(LocalRequestData)
+):
+    """
+    Stream all transactions ordered by their ID as newline-delimited JSON or CSV
+
+    In contrast to `GET /transactions`, the rows are read in batches and
+    sent while reading, so that the whole ledger can be exported without
+    building it in memory. Each row only contains the plain fields of a
+    transaction, i.e. the users are given by `sender_id` and `receiver_id`.
+    CSV exports start with a header row.
+    """
+
+    return StreamingResponse(
+        export.export_transactions(format, member_id=member_id, created_since=created_since),
+        media_type=export.MEDIA_TYPES[format]
+    )
+
+
 @router.post(
     "/transactions/send",
     tags=["Transactions"],
@@ -72,6 +119,7 @@ async def search_for_transactions(
     responses={k: {"model": schemas.APIError} for k in (400, 409)}
 )
 @versioning.versions(minimal=1)
+@idempotency.idempotent
 async def send_money_between_two_users(
         transaction: schemas.TransactionCreation,
         local: LocalRequestData = Depends(LocalRequestData)
@@ -83,6 +131,8 @@ async def send_money_between_two_users(
     endpoint by design, so take care doing that. The frontend application
     might want to request explicit user approval ahead of time.
 
+    This endpoint supports the `Idempotency-Key` header to safely retry requests.
+
     * `400`: if the transaction is not allowed for various reasons,
         e.g. sender equals receiver, the amount is too high, either of those
         users is disabled or is external but has no active voucher or if
@@ -124,6 +174,7 @@ async def send_money_between_two_users(
     responses={k: {"model": schemas.APIError} for k in (400, 404, 409)}
 )
 @versioning.versions(minimal=1)
+@idempotency.idempotent
 async def consume_consumables_by_sending_money_to_the_community(
         consumption: schemas.Consumption,
         local: LocalRequestData = Depends(LocalRequestData)
@@ -135,6 +186,8 @@ async def consume_consumables_by_sending_money_to_the_community(
     endpoint by design, so take care doing that. The frontend application
     might want to request explicit user approval ahead of time.
 
+    This endpoint supports the `Idempotency-Key` header to safely retry requests.
+
     * `400`: if the consuming user is disabled or has no rights to consume
         goods (being an external user without voucher), the amount is too high
         or the consumable or the user specification couldn't be resolved
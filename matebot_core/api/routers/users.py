@@ -10,11 +10,11 @@ from fastapi import Depends
 
 from ._router import router
 from ..base import BadRequest, Conflict
-from ..dependency import LocalRequestData
+from ..dependency import LocalRequestData, id_list
 from .. import helpers, versioning
 from ...misc import transactions
 from ...misc.notifier import Callback
-from ...persistence import models
+from ...persistence import counters, models
 from ... import schemas
 
 
@@ -24,7 +24,7 @@ logger = logging.getLogger(__name__)
 @router.get("/users", tags=["Users"], response_model=List[schemas.User])
 @versioning.versions(1)
 async def search_for_users(
-        id: Optional[pydantic.NonNegativeInt] = None,  # noqa
+        id: Optional[List[int]] = Depends(id_list),  # noqa
         name: Optional[pydantic.constr(max_length=255)] = None,
         community: Optional[bool] = None,
         permission: Optional[bool] = None,
@@ -36,9 +36,13 @@ async def search_for_users(
         alias_confirmed: Optional[bool] = None,
         alias_application: Optional[pydantic.constr(max_length=255)] = None,
         alias_application_id: Optional[pydantic.NonNegativeInt] = None,
+        created_since: Optional[pydantic.NonNegativeInt] = None,
+        modified_since: Optional[pydantic.NonNegativeInt] = None,
         limit: Optional[pydantic.NonNegativeInt] = None,
         page: Optional[pydantic.NonNegativeInt] = None,
         descending: Optional[bool] = False,
+        fields: Optional[pydantic.constr(max_length=255)] = None,
+        expand: schemas.Expansion = schemas.Expansion.ALL,
         local: LocalRequestData = Depends(LocalRequestData)
 ):
     """
@@ -49,6 +53,20 @@ async def search_for_users(
     model has no aliases at all, it will be filtered out if at least
     one `alias_` query parameter has been set. If no query parameters are
     given, this endpoint will just return all currently known user models.
+
+    The parameters `created_since` and `modified_since` accept UNIX timestamps
+    to only fetch users which changed since a previous sync, where any change of
+    an alias counts as a change of its user, too. Users which have been deleted
+    in the meantime are always part of the results of `modified_since` as
+    inactive users without aliases (even if only active users were requested),
+    so that clients can drop them from their local copy.
+
+    Use `fields` to select a comma-separated list of fields which should be
+    returned (the `id` is always included). With `expand=none`, the aliases
+    of the users are omitted, since they can be searched via `GET /aliases`.
+
+    The response carries an `ETag` header. Requests whose `If-None-Match`
+    header matches the current `ETag` are answered with `304` (Not Modified).
     """
 
     def extended_filter(user: models.User) -> bool:
@@ -70,18 +88,23 @@ async def search_for_users(
             obj is None for obj in [alias_username, alias_confirmed, alias_application, alias_application_id]
         )
 
-    return helpers.search_models(
+    return await helpers.search_models_cached(
         models.User,
         local,
+        dependencies=[models.User, models.Alias, models.Application],
         specialized_item_filter=extended_filter,
         limit=limit,
         page=page,
         descending=descending,
+        created_since=created_since,
+        modified_since=modified_since,
+        fields=fields,
+        expand=expand,
         id=id,
         name=name,
         special=community or None,
         permission=permission,
-        active=active,
+        active=None if modified_since is not None and active else active,
         external=external,
         voucher_id=voucher_id
     )
@@ -110,7 +133,7 @@ async def create_new_user(request: schemas.UserCreation, local: LocalRequestData
         voucher_id=None
     )
     local.session.add(model)
-    local.session.commit()
+    local.session.flush()
     return model.schema
 
 
@@ -141,7 +164,7 @@ async def drop_internal_privilege(
         return model
 
     user = await helpers.drop_user_privileges_impl(body.user, body.issuer, local, hook)
-    Callback.push(schemas.EventType.USER_UPDATED, {"id": user.id})
+    Callback.push(schemas.EventType.USER_UPDATED, {"id": user.id}, local.session)
     return user.schema
 
 
@@ -171,7 +194,7 @@ async def drop_permission_privilege(
         return model
 
     user = await helpers.drop_user_privileges_impl(body.user, body.issuer, local, hook)
-    Callback.push(schemas.EventType.USER_UPDATED, {"id": user.id})
+    Callback.push(schemas.EventType.USER_UPDATED, {"id": user.id}, local.session)
     return user.schema
 
 
@@ -199,8 +222,8 @@ async def set_global_username(
         raise BadRequest(f"Username {update.name!r} is not available.")
     issuer.name = update.name
     local.session.add(issuer)
-    local.session.commit()
-    Callback.push(schemas.EventType.USER_UPDATED, {"id": issuer.id})
+    local.session.flush()
+    Callback.push(schemas.EventType.USER_UPDATED, {"id": issuer.id}, local.session)
     return issuer.schema
 
 
@@ -279,10 +302,11 @@ async def set_voucher_of_user(
 
     debtor.voucher_user = voucher
     local.session.add(debtor)
-    local.session.commit()
+    local.session.flush()
     Callback.push(
         schemas.EventType.VOUCHER_UPDATED,
-        {"id": debtor.id, "voucher": voucher and voucher.id, "transaction": transaction and transaction.id}
+        {"id": debtor.id, "voucher": voucher and voucher.id, "transaction": transaction and transaction.id},
+        local.session
     )
     return schemas.VoucherUpdateResponse(
         debtor=debtor.schema,
@@ -376,10 +400,11 @@ async def softly_delete_user_permanently(
     # Deleting aliases using this helper method is preferred to trigger callbacks correctly
     for alias in model.aliases:
         await helpers.delete_one_of_model(alias.id, models.Alias, local, logger=logger)
+    local.session.expire(model, ["aliases"])
+    counters.bump_counter(local.session, counters.ALIASES)
 
-    model.aliases = []
     model.active = False
     local.session.add(model)
-    local.session.commit()
-    Callback.push(schemas.EventType.USER_SOFTLY_DELETED, {"id": model.id})
+    local.session.flush()
+    Callback.push(schemas.EventType.USER_SOFTLY_DELETED, {"id": model.id}, local.session)
     return model.schema
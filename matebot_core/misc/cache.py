@@ -0,0 +1,327 @@
+"""
+MateBot library providing small caches for the API server
+"""
+
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+from starlette.concurrency import run_in_threadpool
+
+from sqlalchemy.orm import Session
+
+from ..persistence import counters
+
+
+T = TypeVar("T")
+
+
+class LRUCache:
+    """
+    Thread-safe mapping of bounded size which evicts the least recently used entries first
+
+    The cache keeps track of its hits and misses to report its hit rate.
+    A maximum size of zero disables the cache, so nothing will be stored.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Ratio of successful lookups to all lookups (or zero if nothing has been looked up yet)
+        """
+
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4)
+        }
+
+
+class VersionedCache(LRUCache):
+    """
+    LRU cache whose entries are only valid for one value of a version counter in the database
+
+    Use ``validate`` once before accessing the cache with a session. It
+    compares the counter value visible to the session with the version of the
+    cached entries, dropping all entries if those don't match anymore. Sessions
+    which incremented the counter themselves must bypass the cache, since their
+    view of the data might never be committed. Storing a value requires the version
+    returned by ``validate``, so that entries which were computed from an outdated
+    view of the database won't be stored after the cache has moved on already.
+
+    A positive revalidation interval (in seconds) allows to skip reading the
+    counter if the cache has been validated recently. This trades an upper
+    bound of staleness for saving the counter lookup on every transaction.
+    """
+
+    def __init__(self, counter: str, maxsize: int = 1024, revalidation_interval: float = 0):
+        super().__init__(maxsize)
+        self.counter = counter
+        self.version: Optional[int] = None
+        self.revalidation_interval = revalidation_interval
+        self._validated_at: float = 0.0
+
+    def validate(self, session: Session) -> Optional[int]:
+        """
+        Synchronize the cache with the counter visible to the session, returning the valid version
+
+        :param session: database session which is used to read the version counter
+        :return: the version the session should use to access the cache
+            or None if the session must not use the cache at all
+        """
+
+        if self.maxsize <= 0 or counters.has_bumped(session, self.counter):
+            return None
+        if self.revalidation_interval > 0 and self.version is not None:
+            if time.monotonic() - self._validated_at < self.revalidation_interval:
+                return self.version
+        version = counters.get_counter(session, self.counter)
+        with self._lock:
+            if version != self.version:
+                self._data.clear()
+                self.version = version
+            self._validated_at = time.monotonic()
+        return version
+
+    def get_versioned(self, key: Hashable, version: Optional[int], default: Any = None) -> Any:
+        if version is None or version != self.version:
+            return default
+        return self.get(key, default)
+
+    def put_versioned(self, key: Hashable, value: Any, version: Optional[int]):
+        with self._lock:
+            if version is not None and version == self.version:
+                self._put(key, value)
+
+
+class BytesLRUCache(LRUCache):
+    """
+    LRU cache of byte strings whose maximum size refers to the total length of all values in bytes
+
+    Values larger than the maximum size of the cache won't be stored at all.
+    """
+
+    def __init__(self, maxsize: int = 2 ** 24):
+        super().__init__(maxsize)
+        self.total = 0
+
+    def _put(self, key: Hashable, value: bytes):
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.total -= len(old)
+        if len(value) > self.maxsize:
+            return
+        self._data[key] = value
+        self.total += len(value)
+        while self.total > self.maxsize:
+            self.total -= len(self._data.popitem(last=False)[1])
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.total -= len(old)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "total": self.total}
+
+
+class SQLiteFileCache:
+    """
+    LRU cache of byte strings stored in a sqlite database file, which can be shared by multiple processes
+
+    It provides the same interface as the ``BytesLRUCache``, but the hits
+    and misses are counted per process. The maximum size refers to the total
+    length of all values in bytes. Errors of the underlying database are
+    logged and treated like a cache miss, so that the cache never breaks
+    its users. Keys need to be strings, since they are stored in the file.
+    """
+
+    def __init__(self, filename: str, maxsize: int = 2 ** 24):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            with self._lock:
+                row = self._connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            self._logger.exception(f"Failed to read from the cache file {self.filename!r}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.maxsize:
+            return
+        try:
+            with self._lock, self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time())
+                )
+                total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+                if total > self.maxsize:
+                    evicted = []
+                    rows = self._connection.execute("SELECT key, size FROM cache ORDER BY accessed")
+                    for old_key, size in rows:
+                        if total <= self.maxsize:
+                            break
+                        evicted.append((old_key,))
+                        total -= size
+                    self._connection.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        except sqlite3.Error:
+            self._logger.exception(f"Failed to write to the cache file {self.filename!r}")
+
+    def discard(self, key: str):
+        try:
+            with self._lock:
+                self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error:
+            self._logger.exception(f"Failed to write to the cache file {self.filename!r}")
+
+    def clear(self):
+        try:
+            with self._lock:
+                self._connection.execute("DELETE FROM cache")
+        except sqlite3.Error:
+            self._logger.exception(f"Failed to write to the cache file {self.filename!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "filename": self.filename,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4)
+        }
+
+
+class SingleFlight:
+    """
+    Group of in-flight calls which are shared by all concurrent callers using the same key
+
+    The first caller of ``run`` for a key executes the function in the thread pool,
+    while all callers with the same key which arrive before it has finished wait
+    for its result instead of calling the function again. Exceptions are raised
+    for all callers alike. Cancelling a caller doesn't cancel the shared call: if
+    the first caller is cancelled, e.g. because its client disconnected, it waits
+    for the call to finish, since the function may still use its resources (e.g.
+    its database session), while the other callers receive the result as usual.
+    Nothing is stored after the call has finished, i.e. the key should identify
+    the data the function works with, e.g. by its version. The group must only
+    be used by the event loop of the worker process.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    async def run(self, key: Hashable, func: Callable[[], T]) -> T:
+        future = self._futures.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(run_in_threadpool(func))
+        # Mark the exception as retrieved, since there might be no other caller waiting for it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        future.add_done_callback(lambda _: self._futures.pop(key))
+        self._futures[key] = future
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The function may still use resources of this caller, so they must not be released before it finished
+            while not future.done():
+                try:
+                    await asyncio.wait({future})
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "shared": self.shared}
@@ -0,0 +1,122 @@
+"""
+MateBot library to export large result sets as streams of NDJSON or CSV chunks
+
+The rows are read with ``yield_per``, i.e. in batches from a server-side
+cursor where supported by the database driver, and are written as chunks
+of text while reading, so that the memory usage doesn't depend on the
+number of exported rows. Only plain columns are exported, without
+loading any ORM objects or nested schemas.
+"""
+
+import io
+import csv
+import datetime
+from typing import Iterable, Iterator, List, Optional
+
+import ujson
+import sqlalchemy
+from sqlalchemy.orm.session import Session
+
+from ..persistence import database, models
+from ..schemas import ExportFormat
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv"
+}
+
+TRANSACTION_COLUMNS = ["id", "sender_id", "receiver_id", "amount", "reason", "multi_transaction_id", "timestamp"]
+
+
+def _convert(value):
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return value
+
+
+def _ndjson_chunks(rows: Iterable[tuple], columns: List[str], batch_size: int) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(ujson.dumps(dict(zip(columns, map(_convert, row)))))
+        if len(lines) >= batch_size:
+            yield "\n".join(lines) + "\n"
+            lines.clear()
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _csv_chunks(rows: Iterable[tuple], columns: List[str], batch_size: int) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(map(_convert, row))
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
+def query_transactions(
+        session: Session,
+        member_id: Optional[int] = None,
+        created_since: Optional[int] = None
+) -> sqlalchemy.orm.Query:
+    """
+    Build the ordered query of the exported columns of all transactions matching the filters
+
+    :param session: database session which should be used by the query
+    :param member_id: optional ID of a user who must be sender or receiver of the transactions
+    :param created_since: optional UNIX timestamp to only include transactions made at or after it
+    :return: query of plain rows of the columns ``TRANSACTION_COLUMNS``
+    """
+
+    query = session.query(*[getattr(models.Transaction, column) for column in TRANSACTION_COLUMNS])
+    if member_id is not None:
+        query = query.filter(sqlalchemy.or_(
+            models.Transaction.sender_id == member_id,
+            models.Transaction.receiver_id == member_id
+        ))
+    if created_since is not None:
+        moment = datetime.datetime.fromtimestamp(created_since) - datetime.timedelta(microseconds=1)
+        query = query.filter(models.Transaction.timestamp > moment)
+    return query.order_by(models.Transaction.id)
+
+
+def export_transactions(
+        export_format: ExportFormat,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        session: Optional[Session] = None,
+        **filters
+) -> Iterator[str]:
+    """
+    Export the transactions matching the filters as chunks of text in the given format
+
+    Note that a new session will be created and closed again if no session is given.
+    That's required by the API, since the generator is consumed after the request's
+    session has been committed and closed already. CSV exports start with a header row.
+
+    :param export_format: format of the exported text, either NDJSON or CSV
+    :param batch_size: number of rows which are read at once and written per chunk
+    :param session: optional database session which should be used to read the rows
+    :param filters: filters passed to ``query_transactions``
+    :return: generator of chunks of text
+    """
+
+    own_session = session is None
+    if own_session:
+        session = database.get_new_session()
+    try:
+        rows = query_transactions(session, **filters).yield_per(batch_size)
+        if export_format == ExportFormat.CSV:
+            yield from _csv_chunks(rows, TRANSACTION_COLUMNS, batch_size)
+        else:
+            yield from _ndjson_chunks(rows, TRANSACTION_COLUMNS, batch_size)
+    finally:
+        if own_session:
+            session.close()
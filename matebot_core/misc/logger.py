@@ -2,8 +2,17 @@
 MateBot library containing logging helper functionality
 """
 
+import queue
 import logging
-from typing import Optional
+import datetime
+import logging.handlers
+from typing import Optional, Union
+
+import ujson
+
+
+PRIMITIVE_ARGUMENT_TYPES = (str, int, float, bool, type(None))
+"""Types of logging arguments which can safely be formatted by the background thread of a ``BackgroundHandler``"""
 
 
 def enforce_logger(logger: Optional[logging.Logger] = None) -> logging.Logger:
@@ -29,3 +38,104 @@ class NoDebugFilter(logging.Filter):
         if super().filter(record):
             return record.levelno > logging.DEBUG
         return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Logging formatter that formats every record as a single line of JSON
+
+    The object contains the timestamp (ISO 8601 in UTC) and the fields of the
+    dictionary in the ``fields`` attribute of the record, which can be given
+    via ``extra={"fields": {...}}``. Records without it contain their level,
+    logger name and message instead (and the traceback of an exception, if any).
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+        content = {"time": timestamp.isoformat(timespec="milliseconds")}
+        fields = getattr(record, "fields", None)
+        if fields is not None:
+            content.update(fields)
+        else:
+            content.update(level=record.levelname, logger=record.name, message=record.getMessage())
+            if record.exc_info:
+                content["exception"] = self.formatException(record.exc_info)
+        return ujson.dumps(content, ensure_ascii=False, escape_forward_slashes=False)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    Logging handler passing records to a wrapped handler, which is called by a background thread
+
+    Records are put into a bounded queue by the thread which logged them and
+    are formatted and written by the ``QueueListener`` of the handler, so that
+    slow file operations don't block requests. If the queue is full, further
+    records are dropped and counted instead of blocking the logging thread.
+    The formatter of this handler is used by the wrapped handler. Messages with
+    arguments other than primitive types (e.g. models) are merged already when
+    they are enqueued, since formatting them may not be thread-safe.
+    """
+
+    def __init__(self, handler: logging.Handler, queue_size: int = 10000):
+        super().__init__(queue.Queue(queue_size))
+        self.handler = handler
+        self.dropped = 0
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+        self.listener.start()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:  # noqa
+        self.handler.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not all(isinstance(arg, PRIMITIVE_ARGUMENT_TYPES) for arg in (
+                args.values() if isinstance(args, dict) else args
+        )):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.handler.close()
+        super().close()
+
+
+def create_background_file_handler(
+        filename: str,
+        max_bytes: Union[int, str] = 0,
+        backup_count: Union[int, str] = 0,
+        encoding: Optional[str] = "utf-8",
+        delay: Union[bool, str] = False,
+        queue_size: Union[int, str] = 10000
+) -> BackgroundHandler:
+    """
+    Create a file handler which writes records in a background thread, to be used as ``()`` factory in ``dictConfig``
+
+    If ``max_bytes`` is positive, the file is rotated as soon as it would exceed
+    that size, keeping ``backup_count`` old files, which bounds the used disk space.
+    Numbers and booleans may be given as strings, since the logging configuration
+    only stores strings.
+    """
+
+    max_bytes = int(max_bytes)
+    delay = delay if isinstance(delay, bool) else str(delay).lower() in ("1", "true", "yes")
+    if max_bytes > 0:
+        handler = logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=int(backup_count),
+            encoding=encoding,
+            delay=delay
+        )
+    else:
+        handler = logging.FileHandler(filename, encoding=encoding, delay=delay)
+    return BackgroundHandler(handler, int(queue_size))
@@ -0,0 +1,123 @@
+"""
+MateBot library to monitor how long the event loop is blocked by synchronous work
+
+A background task of the event loop sleeps for a short interval over and over
+again. The difference between the time it actually woke up and the time it
+should have woken up is the scheduling lag, i.e. the time every other callback
+of the loop had to wait as well. Additionally, a watchdog thread checks whether
+the background task is overdue. If the loop is blocked for longer than the
+threshold, the watchdog logs the current stack of the loop thread, which
+shows the handler blocking the loop while it's still blocking.
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import collections
+from typing import Deque, Dict, Optional
+
+from . import metrics
+
+
+lag_histogram = metrics.registry.histogram(
+    "matebot_event_loop_lag_seconds",
+    "Scheduling lag of the event loop, i.e. the delay of callbacks due to blocking work",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+class EventLoopMonitor:
+    """
+    Monitor of the scheduling lag of one event loop, which keeps the lags of a sliding window for percentiles
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5, window: int = 1000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = collections.deque(maxlen=window)
+        self.blocked = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        self._reported = 0.0
+        self._logger = logging.getLogger(__name__)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """
+        Start monitoring the running event loop (must be called from a coroutine or callback of the loop)
+        """
+
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="EventLoopWatchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopped.set()
+        self._watchdog.join()
+        self._watchdog = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.perf_counter()
+            lag = max(0.0, self._heartbeat - start - self.interval)
+            self.lags.append(lag)
+            lag_histogram.observe(lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.perf_counter() - heartbeat - self.interval
+            if blocked <= self.threshold or heartbeat == self._reported:
+                continue
+            self._reported = heartbeat
+            self.blocked += 1
+            frame = sys._current_frames().get(self._loop_thread_id)  # noqa
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "not available\n"
+            self._logger.warning(
+                "The event loop has been blocked for more than %.0f ms, current stack of the event loop thread:\n%s",
+                blocked * 1000,
+                stack.rstrip()
+            )
+
+    def percentiles(self, *quantiles: float) -> Dict[float, float]:
+        """
+        Return the lags of the given quantiles (between 0 and 1) of the sliding window in seconds
+        """
+
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        return {q: lags[min(len(lags) - 1, int(q * len(lags)))] for q in quantiles}
+
+    def stats(self) -> Dict[str, float]:
+        percentiles = self.percentiles(0.5, 0.99)
+        return {
+            "p50": round(percentiles.get(0.5, 0.0), 4),
+            "p99": round(percentiles.get(0.99, 0.0), 4),
+            "max": round(max(self.lags, default=0.0), 4),
+            "blocked": self.blocked
+        }
+
+
+monitor = EventLoopMonitor()
+"""Monitor of the event loop of the worker process, configured by ``ServerConfig.event_loop_monitor_interval``"""
@@ -0,0 +1,214 @@
+"""
+MateBot library for metrics in the Prometheus text exposition format
+
+Metrics are kept in the memory of the worker process, i.e. every worker
+process exposes its own values. Updating a counter or a histogram takes
+one lock and a few dictionary operations, so that it's cheap enough to be
+done for every request. Values which are known by other components anyways,
+e.g. the statistics of caches, are read by callback metrics only when the
+metrics are rendered. See the documentation of the format for details:
+https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+"""
+
+import math
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Default upper bounds of the buckets of histograms of durations in seconds"""
+
+Sample = Tuple[str, Tuple[str, ...], Tuple[str, ...], float]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    Base class of all metrics with a name, a documentation string and the names of its labels
+    """
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Sample]:
+        """
+        Yield the suffix of the name, the label names and label values and the value of every sample
+        """
+
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value per combination of label values
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            yield "", self.labelnames, labels, value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in buckets per combination of label values
+    """
+
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # One counter per bucket (including the implicit +Inf bucket) followed by the sum
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    def get_count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[:-1]) if entry else 0
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = [(labels, list(entry)) for labels, entry in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, entry in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                yield "_bucket", names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, entry[-1]
+            yield "_count", self.labelnames, labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """
+    Metric whose values are determined by calling a function whenever the metrics are rendered
+
+    The function returns either a single value (for metrics without labels)
+    or a mapping of tuples of label values to the values of the samples.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            func: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+            labelnames: Sequence[str] = (),
+            metric_type: str = "gauge"
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.func = func
+
+    def samples(self) -> Iterator[Sample]:
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield "", self.labelnames, labels, value
+
+
+class Registry:
+    """
+    Collection of metrics which are rendered together, at most one per name
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._logger = logging.getLogger(__name__)
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add the metric to the registry, replacing any previous metric with the same name
+        """
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text format, skipping callback metrics which failed
+        """
+
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                self._logger.exception(f"Failed to render the metric {metric.name!r}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+"""Registry of all metrics of the worker process"""
@@ -7,16 +7,21 @@ import logging
 import datetime
 import threading
 from queue import Empty, Queue
-from typing import ClassVar, List, Optional
+from typing import Callable, ClassVar, List, Optional
 
 import aiohttp
+import sqlalchemy.event
+from sqlalchemy.orm import Session, SessionTransaction
 
+from . import tracing
 from ..persistence import database, models
 from .. import schemas
 
 
 EVENT_QUEUE_WAIT_TIME = 2
 EVENT_QUEUE_BUFFER_TIME = 0.25
+PENDING_EVENTS_KEY = "matebot_pending_events"
+SAVEPOINTS_KEY = "matebot_pending_events_savepoints"
 
 
 class Callback:
@@ -29,6 +34,7 @@ class Callback:
     shutdown_event: ClassVar[threading.Event] = threading.Event()
     _thread: ClassVar[Optional[threading.Thread]] = None
     _session: ClassVar[Optional[aiohttp.ClientSession]] = None
+    _subscribers: ClassVar[List[Callable[[List[schemas.Event]], None]]] = []
 
     @classmethod
     def wait_stop(cls, timeout: float = None):
@@ -36,6 +42,17 @@ class Callback:
         if cls._thread:
             cls._thread.join(timeout=timeout)
 
+    @classmethod
+    def subscribe(cls, subscriber: Callable[[List[schemas.Event]], None]):
+        """
+        Register a function which is called with every batch of events before they are published
+
+        Subscribers are called synchronously by the thread which published the
+        events (e.g. right after committing a session), so they should be fast.
+        """
+
+        cls._subscribers.append(subscriber)
+
     @classmethod
     def created(cls, *args, **kwargs):
         cls.logger.warning(f"Backward-incompatibility in Callback.created; args={args}; kwargs={kwargs}")
@@ -93,7 +110,7 @@ class Callback:
                     (obj.application_id, obj.url, obj.shared_secret)
                     for obj in session.query(models.Callback).all()
                 ]
-            cls.logger.debug(f"Handling {len(events)} events '{events}' for {len(callbacks)} callbacks ...")
+            cls.logger.debug("Handling %d events '%s' for %d callbacks ...", len(events), events, len(callbacks))
             for c in callbacks:
                 await cls._publish_event(events, *c)
         await cls._session.close()
@@ -110,6 +127,66 @@ class Callback:
             cls.logger.debug(f"Enumerating threads: {threading.enumerate()}")
 
     @classmethod
-    def push(cls, event: schemas.EventType, data: Optional[dict] = None):
-        cls._run_thread()
-        cls.queue.put(schemas.Event(event=event, timestamp=int(datetime.datetime.now().timestamp()), data=data or {}))
+    def _enqueue(cls, events: List[schemas.Event]):
+        if not events:
+            return
+        with tracing.span("notifier.enqueue", events=len(events)):
+            for subscriber in cls._subscribers:
+                try:
+                    subscriber(events)
+                except Exception:
+                    cls.logger.exception(f"Event subscriber {subscriber!r} failed")
+            cls._run_thread()
+            for event in events:
+                cls.queue.put(event)
+
+    @classmethod
+    def push(cls, event: schemas.EventType, data: Optional[dict] = None, session: Optional[Session] = None):
+        """
+        Publish a new event to all registered callbacks
+
+        If a session is given, the event is bound to the unit of work of
+        that session: it will only be published after the session has been
+        committed successfully and will be discarded when it's rolled back.
+        Rolling back a savepoint only discards the events pushed after it.
+
+        The event carries the ID of the trace of the current context (if any),
+        so that receivers can correlate it with the request which caused it.
+        """
+
+        with tracing.span("notifier.push", event=schemas.EventType(event).value):
+            obj = schemas.Event(
+                event=event,
+                timestamp=int(datetime.datetime.now().timestamp()),
+                data=data or {},
+                trace_id=tracing.current_trace_id()
+            )
+            if session is None:
+                cls._enqueue([obj])
+            else:
+                session.info.setdefault(PENDING_EVENTS_KEY, []).append(obj)
+
+
+@sqlalchemy.event.listens_for(Session, "after_transaction_create")
+def _remember_savepoint(session: Session, transaction: SessionTransaction):
+    if transaction.nested:
+        session.info.setdefault(SAVEPOINTS_KEY, {})[transaction] = len(session.info.get(PENDING_EVENTS_KEY, []))
+
+
+@sqlalchemy.event.listens_for(Session, "after_commit")
+def _publish_pending_events(session: Session):
+    # Releasing a savepoint keeps its events pending until the outermost transaction is committed
+    if session.in_nested_transaction():
+        return
+    session.info.pop(SAVEPOINTS_KEY, None)
+    Callback._enqueue(session.info.pop(PENDING_EVENTS_KEY, []))
+
+
+@sqlalchemy.event.listens_for(Session, "after_soft_rollback")
+def _discard_pending_events(session: Session, previous_transaction: SessionTransaction):
+    if previous_transaction.nested:
+        position = session.info.get(SAVEPOINTS_KEY, {}).pop(previous_transaction, 0)
+        del session.info.get(PENDING_EVENTS_KEY, [])[position:]
+        return
+    session.info.pop(SAVEPOINTS_KEY, None)
+    session.info.pop(PENDING_EVENTS_KEY, None)
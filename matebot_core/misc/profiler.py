@@ -0,0 +1,123 @@
+"""
+MateBot library for sampling the stacks of all threads of the worker process
+
+The sampling profiler runs in a background thread, which periodically takes
+the current stack of every other thread via ``sys._current_frames`` and counts
+identical stacks. Since the profiled code isn't instrumented at all, the overhead
+only depends on the sampling interval and can be used in production. The counted
+stacks are written in the collapsed format (one line per stack with the frames
+separated by semicolons, followed by its number of samples), which can be
+converted to flame graphs by tools like ``flamegraph.pl`` or speedscope.
+"""
+
+import os
+import sys
+import time
+import logging
+import datetime
+import threading
+from typing import Dict, Optional, Tuple
+
+
+Stack = Tuple[str, ...]
+
+
+def _format_frame(frame) -> str:
+    code = frame.f_code
+    name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    Profiler counting the sampled stacks of all threads, which can be started and stopped at any time
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.stacks: Dict[Stack, int] = {}
+        self.samples = 0
+        self.interval = 0.0
+        self.started: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.01):
+        """
+        Start sampling the stacks of all threads every ``interval`` seconds, discarding previous samples
+
+        :raises RuntimeError: when the profiler is running already
+        """
+
+        with self._lock:
+            if self._thread is not None:
+                raise RuntimeError("The profiler is running already")
+            self.stacks = {}
+            self.samples = 0
+            self.interval = interval
+            self.started = time.time()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+            self._thread.start()
+        logging.getLogger(__name__).info("Started the sampling profiler with an interval of %s seconds", interval)
+
+    def stop(self) -> Dict[Stack, int]:
+        """
+        Stop the profiler and return the number of samples per stack
+
+        :raises RuntimeError: when the profiler isn't running
+        """
+
+        with self._lock:
+            if self._thread is None:
+                raise RuntimeError("The profiler isn't running")
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        logging.getLogger(__name__).info("Stopped the sampling profiler after %d samples", self.samples)
+        return self.stacks
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():  # noqa
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_format_frame(frame))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)).replace(";", ":"))
+                stack = tuple(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    @staticmethod
+    def format_collapsed(stacks: Dict[Stack, int]) -> str:
+        """
+        Format the stacks in the collapsed format of ``flamegraph.pl``, with the root frame (the thread name) first
+        """
+
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def dump(self, stacks: Dict[Stack, int], directory: str) -> str:
+        """
+        Write the stacks in the collapsed format to a new file in the directory, returning the path of the file
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.datetime.fromtimestamp(self.started or time.time()).strftime("%Y%m%d-%H%M%S")
+        path = os.path.abspath(os.path.join(directory, f"profile-{os.getpid()}-{timestamp}.folded"))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.format_collapsed(stacks))
+        logging.getLogger(__name__).info("Wrote %d sampled stacks to %r", len(stacks), path)
+        return path
+
+
+profiler = SamplingProfiler()
+"""Sampling profiler of the worker process, controlled by ``POST /profiler`` and ``run --profile``"""
@@ -59,11 +59,12 @@ def attempt_closing_refund(
         logger.debug(f"The refund {refund.id} will be closed without performing transactions.")
 
     session.add(refund)
-    session.commit()
+    session.flush()
     logger.debug(f"Successfully closed refund {refund.id}")
 
     Callback.push(
         EventType.REFUND_CLOSED,
-        {"id": refund.id, "aborted": False, "accepted": accepted, "transaction": refund.transaction_id}
+        {"id": refund.id, "aborted": False, "accepted": accepted, "transaction": refund.transaction_id},
+        session
     )
     return True
@@ -0,0 +1,319 @@
+"""
+MateBot library for lightweight tracing of requests with nested spans
+
+Every request gets a trace with a random trace ID (or the trace ID of its
+W3C ``traceparent`` header), whose root span covers the whole request. Nested
+spans are created by ``span`` or the ``traced`` decorator around interesting
+operations, e.g. database queries, transaction helpers or publishing events.
+The spans are kept in a context variable, which is inherited by the threads
+of the thread pool running synchronous dependencies and path operations.
+
+Only a sample of the traces is recorded (see ``sample_rate``), while the spans
+of other traces are skipped right away. Their root spans are created anyway,
+so that every request has a trace ID, e.g. for the access log and callbacks.
+Recorded traces are written by the logger of this module as one line of JSON
+per trace, which has the format of an OTLP ``ExportTraceServiceRequest``, i.e.
+the format of the file exporter of the OpenTelemetry collector, so that the
+files can be imported by tools supporting OTLP without running a collector
+in the meantime.
+"""
+
+import os
+import time
+import random
+import logging
+import functools
+import contextlib
+import contextvars
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import ujson
+
+
+sample_rate: float = 0.0
+"""Fraction of the requests whose traces are recorded (zero disables it), see ``ServerConfig.trace_sample_rate``"""
+
+MAX_SPANS_PER_TRACE = 1000
+"""Maximum number of spans recorded per trace, further spans are only counted"""
+
+SERVICE_NAME = "matebot_core"
+TRACEPARENT_HEADER = "traceparent"
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+_logger = logging.getLogger(__name__)
+# The traces must not end up in the general log, e.g. with logging configurations lacking a handler for them
+_logger.propagate = False
+
+
+class Trace:
+    """
+    Collection of the finished spans of one trace
+    """
+
+    __slots__ = ("trace_id", "sampled", "spans", "dropped")
+
+    def __init__(self, trace_id: Optional[str] = None, sampled: bool = True):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+
+class Span:
+    """
+    Single timed operation of a trace, which may be the parent of other spans
+    """
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error", "deferred")
+
+    def __init__(
+            self,
+            trace: Trace,
+            name: str,
+            parent_id: Optional[str] = None,
+            kind: int = SPAN_KIND_INTERNAL,
+            attributes: Optional[Dict[str, Any]] = None
+    ):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.deferred: List[Span] = []
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+
+    def set_error(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def finish(self):
+        # Deferred child spans which haven't been finished explicitly (e.g. due to an exception) end with their parent
+        for child in self.deferred:
+            child.finish()
+        self.deferred.clear()
+        self.end = time.time_ns()
+        if len(self.trace.spans) < MAX_SPANS_PER_TRACE:
+            self.trace.spans.append(self)
+        else:
+            self.trace.dropped += 1
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        Return the span in the JSON encoding of OTLP (with hex-encoded IDs and 64-bit integers as strings)
+        """
+
+        content = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or self.start),
+            "attributes": _format_attributes(self.attributes),
+            "status": {"code": STATUS_CODE_OK} if self.error is None else {
+                "code": STATUS_CODE_ERROR,
+                "message": self.error
+            }
+        }
+        if self.parent_id is not None:
+            content["parentSpanId"] = self.parent_id
+        return content
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("matebot_current_span", default=None)
+
+
+def _format_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            result.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            result.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            result.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            result.append({"key": key, "value": {"stringValue": str(value)}})
+    return result
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Return the trace ID, parent span ID and sampled flag of a W3C ``traceparent`` header (or None if it's invalid)
+    """
+
+    if not header:
+        return None
+    parts = header.strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+            return None
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    Return the ID of the trace of the current context, even if the trace isn't sampled
+    """
+
+    current = _current.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Optional[Span]:
+    """
+    Start a child span of the current span without activating it, which has to be finished by the caller
+
+    :return: the new span, or None if the current context has no sampled trace
+    """
+
+    parent = _current.get()
+    if parent is None or not parent.trace.sampled:
+        return None
+    return Span(parent.trace, name, parent.span_id, kind, attributes)
+
+
+def start_deferred_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """
+    Start a child span of the current span, which is finished by ``finish_deferred_spans`` in the parent's context
+
+    This allows spans to end in another context than they started, e.g. a span
+    starting in a thread of the thread pool and ending in the event loop.
+    """
+
+    child = start_span(name, kind, **attributes)
+    if child is not None:
+        _current.get().deferred.append(child)
+
+
+def finish_deferred_spans():
+    """
+    Finish all deferred spans of the current span (see ``start_deferred_span``)
+    """
+
+    parent = _current.get()
+    if parent is not None and parent.deferred:
+        for child in parent.deferred:
+            child.finish()
+        parent.deferred.clear()
+
+
+@contextlib.contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Run the block in a new child span of the current span (if the current context has a sampled trace)
+    """
+
+    child = start_span(name, kind, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.set_error(exc)
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    Decorator to run every call of a synchronous function in a span named after the function
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = _current.get()
+            if current is None or not current.trace.sampled:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def trace(name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Run the block, e.g. a request, in the root span of a new trace, which is exported afterwards if it's sampled
+
+    If the current context has a trace already (e.g. the batch request of a
+    sub-request), the block runs in a child span of that trace instead.
+    The ``traceparent`` header of a remote caller is continued if it's valid,
+    in which case its sampled flag decides whether the trace is recorded.
+    While recording is disabled, no trace is sampled, but every trace still
+    has its root span and trace ID (see ``current_trace_id``).
+    """
+
+    if _current.get() is not None:
+        with span(name, SPAN_KIND_SERVER, **attributes) as child:
+            yield child
+        return
+
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        root = Span(Trace(remote[0], remote[2] and sample_rate > 0), name, remote[1], SPAN_KIND_SERVER, attributes)
+    else:
+        root = Span(Trace(sampled=random.random() < sample_rate), name, None, SPAN_KIND_SERVER, attributes)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as exc:
+        root.set_error(exc)
+        raise
+    finally:
+        _current.reset(token)
+        if root.trace.sampled:
+            root.finish()
+            export(root.trace)
+
+
+def to_otlp(t: Trace) -> Dict[str, Any]:
+    """
+    Return the trace as OTLP ``ExportTraceServiceRequest`` in its JSON encoding
+    """
+
+    resource = {"service.name": SERVICE_NAME, "process.pid": os.getpid()}
+    if t.dropped:
+        resource["matebot.dropped_spans"] = t.dropped
+    return {"resourceSpans": [{
+        "resource": {"attributes": _format_attributes(resource)},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [s.to_otlp() for s in t.spans]
+        }]
+    }]}
+
+
+def export(t: Trace):
+    """
+    Write the trace as a line of JSON to the handlers of the logger of this module (if it's enabled and has any)
+    """
+
+    if _logger.isEnabledFor(logging.INFO) and _logger.hasHandlers():
+        _logger.info(ujson.dumps(to_otlp(t), ensure_ascii=False, escape_forward_slashes=False))
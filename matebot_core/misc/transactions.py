@@ -9,6 +9,7 @@ from typing import List, Optional, Tuple
 
 from sqlalchemy.orm.session import Session
 
+from . import tracing
 from .logger import enforce_logger
 from .notifier import Callback
 from ..persistence import models
@@ -25,6 +26,7 @@ class _SimpleMultiTransactionAmount(enum.Enum):
     TOTAL = "total"
 
 
+@tracing.traced()
 def create_transaction(
         sender: models.User,
         receiver: models.User,
@@ -42,14 +44,14 @@ def create_transaction(
     :param reason: textual description of the transaction
     :param session: SQLAlchemy session used to perform database operations
     :param logger: logger that should be used for INFO and ERROR messages
-    :return: the newly created and committed Transaction object
+    :return: the newly created and flushed Transaction object (committing it is up to the caller)
     :raises ValueError: in case the amount is not positive or some user ID is not set
     :raises RuntimeError: in case the target amount of a user is out of range
-    :raises sqlalchemy.exc.DBAPIError: in case committing to the database fails
+    :raises sqlalchemy.exc.DBAPIError: in case flushing to the database fails
     """
 
     logger = enforce_logger(logger)
-    logger.info(f"Incoming transaction from {sender} to {receiver} about {amount} for {reason!r}.")
+    logger.info("Incoming transaction from %s to %s about %s for %r.", sender, receiver, amount, reason)
 
     amount = int(amount)
     if amount <= 0:
@@ -74,12 +76,13 @@ def create_transaction(
     session.add(sender)
     session.add(receiver)
     session.add(model)
-    session.commit()
-    logger.debug(f"Successfully committed new transaction {model.id}")
+    session.flush()
+    logger.debug("Successfully flushed new transaction %d", model.id)
 
     Callback.push(
         EventType.TRANSACTION_CREATED,
-        {"id": model.id, "sender": sender.id, "receiver": receiver.id, "amount": model.amount}
+        {"id": model.id, "sender": sender.id, "receiver": receiver.id, "amount": model.amount},
+        session
     )
 
     return model
@@ -102,8 +105,11 @@ def _make_simple_multi_transaction(
 
     logger = enforce_logger(logger)
     logger.debug(
-        f"Incoming simple multi transaction {direction.name} about "
-        f"{pre_amount} ({amount_type.name}) for {reason!r}"
+        "Incoming simple multi transaction %s about %s (%s) for %r",
+        direction.name,
+        pre_amount,
+        amount_type.name,
+        reason
     )
 
     if amount_type == _SimpleMultiTransactionAmount.TOTAL:
@@ -166,7 +172,7 @@ def _make_simple_multi_transaction(
             ))
             sender.balance -= amount
             receiver_users[user_id].balance += amount
-            logger.debug(f"Creating single transaction {sender.id} -> {user_id} of {amount}")
+            logger.debug("Creating single transaction %d -> %d of %d", sender.id, user_id, amount)
 
         elif direction == _SimpleMultiTransactionMode.MANY_TO_ONE:
             transactions.append(models.Transaction(
@@ -178,27 +184,31 @@ def _make_simple_multi_transaction(
             ))
             receiver_users[user_id].balance -= amount
             sender.balance += amount
-            logger.debug(f"Creating single transaction {user_id} -> {sender.id} of {amount}")
+            logger.debug("Creating single transaction %d -> %d of %d", user_id, sender.id, amount)
 
     session.add(sender)
     session.add_all(list(receiver_users.values()))
     session.add_all(transactions)
     session.add(multi)
-    session.commit()
-    logger.debug(
-        f"Successfully committed new multi transaction {multi.id} and "
-        f"transactions: {[t.id for t in transactions]}"
-    )
+    session.flush()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Successfully flushed new multi transaction %d and transactions: %s",
+            multi.id,
+            [t.id for t in transactions]
+        )
 
     for t in transactions:
         Callback.push(
             EventType.TRANSACTION_CREATED,
-            {"id": t.id, "sender": t.sender.id, "receiver": t.receiver.id, "amount": t.amount}
+            {"id": t.id, "sender": t.sender_id, "receiver": t.receiver_id, "amount": t.amount},
+            session
         )
 
     return multi, transactions
 
 
+@tracing.traced()
 def create_one_to_many_transaction_by_base(
         sender: models.User,
         receivers: List[Tuple[models.User, int]],
@@ -229,12 +239,12 @@ def create_one_to_many_transaction_by_base(
     :param logger: logger that should be used for INFO and ERROR messages
     :param indicator: optional format string that transforms the reason before creating the
         transaction to allow customization with the two possible keys being `reason` and `n`
-    :return: both the newly created and committed MultiTransaction
+    :return: both the newly created and flushed MultiTransaction
         object and the list of new transactions
     :raises ValueError: in case no receivers have been given, the amount is
         negative, the quantity of any user is negative or any user has no ID
     :raises KeyError: in case the custom indicator string is somehow broken
-    :raises sqlalchemy.exc.DBAPIError: in case committing to the database fails
+    :raises sqlalchemy.exc.DBAPIError: in case flushing to the database fails
     """
 
     return _make_simple_multi_transaction(
@@ -250,6 +260,7 @@ def create_one_to_many_transaction_by_base(
     )
 
 
+@tracing.traced()
 def create_one_to_many_transaction_by_total(
         sender: models.User,
         receivers: List[Tuple[models.User, int]],
@@ -283,12 +294,12 @@ def create_one_to_many_transaction_by_total(
     :param logger: logger that should be used for INFO and ERROR messages
     :param indicator: optional format string that transforms the reason before creating the
         transaction to allow customization with the two possible keys being `reason` and `n`
-    :return: both the newly created and committed MultiTransaction
+    :return: both the newly created and flushed MultiTransaction
         object and the list of new transactions
     :raises ValueError: in case no receivers have been given, the amount is
         negative, the quantity of any user is negative or any user has no ID
     :raises KeyError: in case the custom indicator string is somehow broken
-    :raises sqlalchemy.exc.DBAPIError: in case committing to the database fails
+    :raises sqlalchemy.exc.DBAPIError: in case flushing to the database fails
     """
 
     return _make_simple_multi_transaction(
@@ -304,6 +315,7 @@ def create_one_to_many_transaction_by_total(
     )
 
 
+@tracing.traced()
 def create_many_to_one_transaction_by_base(
         senders: List[Tuple[models.User, int]],
         receiver: models.User,
@@ -334,12 +346,12 @@ def create_many_to_one_transaction_by_base(
     :param logger: logger that should be used for INFO and ERROR messages
     :param indicator: optional format string that transforms the reason before creating the
         transaction to allow customization with the two possible keys being `reason` and `n`
-    :return: both the newly created and committed MultiTransaction
+    :return: both the newly created and flushed MultiTransaction
         object and the list of new transactions
     :raises ValueError: in case no senders have been given, the amount is
         negative, the quantity of any user is negative or any user has no ID
     :raises KeyError: in case the custom indicator string is somehow broken
-    :raises sqlalchemy.exc.DBAPIError: in case committing to the database fails
+    :raises sqlalchemy.exc.DBAPIError: in case flushing to the database fails
     """
 
     return _make_simple_multi_transaction(
@@ -355,6 +367,7 @@ def create_many_to_one_transaction_by_base(
     )
 
 
+@tracing.traced()
 def create_many_to_one_transaction_by_total(
         senders: List[Tuple[models.User, int]],
         receiver: models.User,
@@ -388,12 +401,12 @@ def create_many_to_one_transaction_by_total(
     :param logger: logger that should be used for INFO and ERROR messages
     :param indicator: optional format string that transforms the reason before creating the
         transaction to allow customization with the two possible keys being `reason` and `n`
-    :return: both the newly created and committed MultiTransaction
+    :return: both the newly created and flushed MultiTransaction
         object and the list of new transactions
     :raises ValueError: in case no senders have been given, the amount is
         negative, the quantity of any user is negative or any user has no ID
     :raises KeyError: in case the custom indicator string is somehow broken
-    :raises sqlalchemy.exc.DBAPIError: in case committing to the database fails
+    :raises sqlalchemy.exc.DBAPIError: in case flushing to the database fails
     """
 
     return _make_simple_multi_transaction(
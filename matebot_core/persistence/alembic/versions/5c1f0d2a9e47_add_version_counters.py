@@ -0,0 +1,28 @@
+"""add version counters
+
+Revision ID: 5c1f0d2a9e47
+Revises: 1ae7ae3dfe83
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '5c1f0d2a9e47'
+down_revision = '1ae7ae3dfe83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'version_counters',
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('version_counters')
@@ -0,0 +1,24 @@
+"""add modification time to version counters
+
+Revision ID: 9b3e6c41d7a2
+Revises: 5c1f0d2a9e47
+Create Date: 2026-10-18 14:03:47.718350
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '9b3e6c41d7a2'
+down_revision = '5c1f0d2a9e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('version_counters', sa.Column('modified', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('version_counters') as batch_op:
+        batch_op.drop_column('modified')
@@ -0,0 +1,35 @@
+"""add idempotency keys
+
+Revision ID: c7d2e9f4a1b8
+Revises: e4a7c2b95f13
+Create Date: 2026-10-18 19:27:45.318042
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'c7d2e9f4a1b8'
+down_revision = 'e4a7c2b95f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('application_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.Integer(), nullable=False),
+        sa.Column('body', sa.LargeBinary(), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['application_id'], ['applications.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('application_id', 'key')
+    )
+    op.create_index(op.f('ix_idempotency_keys_expires'), 'idempotency_keys', ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_idempotency_keys_expires'), table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,52 @@
+"""add timestamp indexes and alias timestamps
+
+Revision ID: e4a7c2b95f13
+Revises: 9b3e6c41d7a2
+Create Date: 2026-10-18 16:41:09.529114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'e4a7c2b95f13'
+down_revision = '9b3e6c41d7a2'
+branch_labels = None
+depends_on = None
+
+
+_INDEXED_COLUMNS = [
+    ('users', 'created'),
+    ('users', 'modified'),
+    ('aliases', 'created'),
+    ('aliases', 'modified'),
+    ('transactions', 'timestamp'),
+    ('refunds', 'created'),
+    ('refunds', 'modified'),
+    ('polls', 'created'),
+    ('polls', 'modified'),
+    ('votes', 'modified'),
+    ('communisms', 'created'),
+    ('communisms', 'modified')
+]
+
+
+def upgrade():
+    # SQLite doesn't allow adding columns with non-constant defaults, so the table is re-created
+    with op.batch_alter_table('aliases', recreate='always') as batch_op:
+        batch_op.add_column(
+            sa.Column('created', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False)
+        )
+        batch_op.add_column(
+            sa.Column('modified', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False)
+        )
+    for table, column in _INDEXED_COLUMNS:
+        op.create_index(op.f(f'ix_{table}_{column}'), table, [column], unique=False)
+
+
+def downgrade():
+    for table, column in reversed(_INDEXED_COLUMNS):
+        op.drop_index(op.f(f'ix_{table}_{column}'), table_name=table)
+    with op.batch_alter_table('aliases') as batch_op:
+        batch_op.drop_column('modified')
+        batch_op.drop_column('created')
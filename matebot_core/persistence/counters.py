@@ -0,0 +1,239 @@
+"""
+MateBot database-backed version counters
+
+A version counter is a named integer in the database which is incremented
+whenever a certain kind of data changes. Process-local caches use those
+counters to detect changes made by other worker processes (or by the CLI).
+Incrementing a counter is part of the session's unit of work, i.e. other
+processes only observe the new value after the session has been committed.
+
+Counter values are read at most once per transaction of a session.
+
+Besides the explicitly named counters, every table of the ORM models has its
+own counter (see ``table_counter``), which is incremented automatically when
+a session commits changes of that table. The changed tables are collected
+from the objects of all flushes and from the statements executed by the
+session (e.g. bulk updates, deletes or inserts using Core constructs), where
+deletions also affect the tables referencing the deleted table by foreign
+keys with ``ON DELETE`` actions. Every counter is incremented only once per
+transaction, right before the commit, to keep the locks on them short.
+"""
+
+import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import sqlalchemy.event
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import ORMExecuteState, Session, SessionTransaction
+
+from .models import version_counters
+
+
+ALIASES = "aliases"
+"""Counter of changes affecting the resolution of confirmed aliases to users"""
+
+APPLICATIONS = "applications"
+"""Counter of changes revoking the access of applications, e.g. deletions"""
+
+_TABLE_PREFIX = "table:"
+_VALUES_KEY = "matebot_counter_values"
+_BUMPED_KEY = "matebot_bumped_counters"
+_PENDING_KEY = "matebot_pending_counters"
+
+_referencing_tables: Optional[Dict[str, Set[str]]] = None
+
+
+def get_counter(session: Session, name: str) -> int:
+    """
+    Return the current value of the named counter (which is zero if it has never been incremented)
+    """
+
+    values: Dict[str, int] = session.info.setdefault(_VALUES_KEY, {})
+    if name not in values:
+        query = select(version_counters.c.value).where(version_counters.c.name == name)
+        values[name] = session.execute(query).scalar() or 0
+    return values[name]
+
+
+def table_counter(table_name: str) -> str:
+    """
+    Return the name of the counter which is incremented on every change of the given table
+    """
+
+    return _TABLE_PREFIX + table_name
+
+
+def get_versions(session: Session, names: Iterable[str]) -> Tuple[Dict[str, int], Optional[datetime.datetime]]:
+    """
+    Return the values of the named counters and the time they've been incremented last, using a single query
+
+    :param session: database session which is used to read the version counters
+    :param names: collection of names of the counters
+    :return: tuple of the mapping of all names to their values and the time of the
+        latest increment of any of those counters (or None if none was incremented yet)
+    """
+
+    names = set(names)
+    query = (
+        select(version_counters.c.name, version_counters.c.value, version_counters.c.modified)
+        .where(version_counters.c.name.in_(names))
+    )
+    versions = {name: 0 for name in names}
+    last_modified = None
+    for name, value, modified in session.execute(query):
+        versions[name] = value
+        if modified is not None and (last_modified is None or modified > last_modified):
+            last_modified = modified
+    session.info.setdefault(_VALUES_KEY, {}).update(versions)
+    return versions, last_modified
+
+
+def bump_counter(session: Session, name: str):
+    """
+    Increment the named counter in the session's unit of work
+
+    The counter is created if it doesn't exist yet. The supported databases do
+    this with a single upsert statement, so that concurrent transactions creating
+    the same counter don't fail, but wait for each other like for any other row.
+    """
+
+    dialect = session.get_bind().dialect.name
+    increment = {"value": version_counters.c.value + 1, "modified": func.now()}
+    if dialect in ("sqlite", "postgresql"):
+        upsert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        session.execute(
+            upsert(version_counters)
+            .values(name=name, value=1, modified=func.now())
+            .on_conflict_do_update(index_elements=[version_counters.c.name], set_=increment)
+        )
+    elif dialect in ("mysql", "mariadb"):
+        session.execute(
+            mysql.insert(version_counters)
+            .values(name=name, value=1, modified=func.now())
+            .on_duplicate_key_update(**increment)
+        )
+    else:
+        result = session.execute(update(version_counters).where(version_counters.c.name == name).values(**increment))
+        if result.rowcount == 0:
+            session.execute(insert(version_counters).values(name=name, value=1, modified=func.now()))
+    session.info.setdefault(_VALUES_KEY, {}).pop(name, None)
+    session.info.setdefault(_BUMPED_KEY, set()).add(name)
+
+
+def compare_and_bump(session: Session, name: str, expected: int) -> bool:
+    """
+    Increment the named counter in the session's unit of work only if it currently has the expected value
+
+    Concurrent transactions trying to increment the counter from the same value
+    are serialized by the database, so that only the first one succeeds. If the
+    counter doesn't exist yet (i.e. it's zero), the concurrent transactions race
+    to insert it instead, where all but the first raise an ``IntegrityError``.
+
+    :return: whether the counter had the expected value and has been incremented
+    """
+
+    result = session.execute(
+        update(version_counters)
+        .where(version_counters.c.name == name, version_counters.c.value == expected)
+        .values(value=version_counters.c.value + 1, modified=func.now())
+    )
+    if result.rowcount == 0:
+        if expected != 0 or get_counter(session, name) != 0:
+            return False
+        session.execute(insert(version_counters).values(name=name, value=1, modified=func.now()))
+    session.info.setdefault(_VALUES_KEY, {}).pop(name, None)
+    session.info.setdefault(_BUMPED_KEY, set()).add(name)
+    return True
+
+
+def has_bumped(session: Session, name: str) -> bool:
+    """
+    Determine whether the named counter has been incremented in the current unit of work of the session
+    """
+
+    bumped: Set[str] = session.info.get(_BUMPED_KEY, set())
+    pending: Set[str] = session.info.get(_PENDING_KEY, set())
+    return name in bumped or name in pending
+
+
+def _get_referencing_tables(table_name: str) -> Set[str]:
+    """
+    Return the names of all tables which are changed by the database when rows of the given table are deleted
+    """
+
+    global _referencing_tables
+    if _referencing_tables is None:
+        references = {}
+        for table in version_counters.metadata.tables.values():
+            for foreign_key in table.foreign_keys:
+                if foreign_key.ondelete is not None:
+                    references.setdefault(foreign_key.column.table.name, set()).add(table.name)
+        _referencing_tables = references
+
+    result = set()
+    remaining = [table_name]
+    while remaining:
+        for name in _referencing_tables.get(remaining.pop(), set()):
+            if name not in result:
+                result.add(name)
+                remaining.append(name)
+    return result
+
+
+def mark_changed(session: Session, *table_names: str, deleted: bool = False):
+    """
+    Increment the counters of the given tables when the current transaction of the session is committed
+
+    :param session: database session which changes the tables
+    :param table_names: names of the changed tables
+    :param deleted: whether rows of the tables have been deleted, which also
+        changes the tables referencing them with ``ON DELETE`` actions
+    """
+
+    tables = set(table_names)
+    if deleted:
+        for name in table_names:
+            tables.update(_get_referencing_tables(name))
+    tables.discard(version_counters.name)
+    session.info.setdefault(_PENDING_KEY, set()).update(table_counter(name) for name in tables)
+
+
+@sqlalchemy.event.listens_for(Session, "after_commit")
+@sqlalchemy.event.listens_for(Session, "after_soft_rollback")
+def _forget_counters(session: Session, previous_transaction: Optional[SessionTransaction] = None):
+    if previous_transaction is not None and previous_transaction.nested:
+        # Counters bumped in a rolled back savepoint stay marked, which only disables caching for the session
+        session.info.pop(_VALUES_KEY, None)
+    elif not session.in_nested_transaction():
+        session.info.pop(_VALUES_KEY, None)
+        session.info.pop(_BUMPED_KEY, None)
+        session.info.pop(_PENDING_KEY, None)
+
+
+@sqlalchemy.event.listens_for(Session, "before_flush")
+def _collect_changed_tables(session: Session, *_):
+    mark_changed(session, *{obj.__table__.name for obj in session.new})
+    mark_changed(session, *{obj.__table__.name for obj in session.deleted}, deleted=True)
+    mark_changed(session, *{
+        obj.__table__.name for obj in session.dirty
+        if session.is_modified(obj, include_collections=False)
+    })
+
+
+@sqlalchemy.event.listens_for(Session, "do_orm_execute")
+def _collect_executed_tables(state: ORMExecuteState):
+    if state.is_insert or state.is_update or state.is_delete:
+        mark_changed(state.session, state.statement.table.name, deleted=state.is_delete)
+
+
+@sqlalchemy.event.listens_for(Session, "before_commit")
+def _bump_table_counters(session: Session):
+    if session.in_nested_transaction():
+        return
+    # The objects of the last flush have to be collected before the counters are incremented
+    session.flush()
+    pending: Set[str] = session.info.pop(_PENDING_KEY, set())
+    # Sorting the tables ensures that concurrent transactions lock the counters in the same order
+    for name in sorted(pending):
+        bump_counter(session, name)
@@ -1,13 +1,18 @@
 """
 MateBot core database models
+
+The ``schema`` properties of the models build their pydantic schemas without
+validation (using ``construct``), since the values originate from the database
+whose constraints already match the schemas. Therefore, any value passed to a
+schema needs to have the exact type of the schema's field already.
 """
 
 import datetime
 from typing import List
 
 from sqlalchemy import (
-    Boolean, DateTime, Enum, Integer, String,
-    CheckConstraint, Column, FetchedValue, ForeignKey, UniqueConstraint
+    Boolean, DateTime, Enum, Integer, LargeBinary, String,
+    CheckConstraint, Column, FetchedValue, ForeignKey, Table, UniqueConstraint
 )
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql import func
@@ -35,8 +40,10 @@ class User(Base):
     """Unique flag determining the special community user in the set of users"""
     external: bool = Column(Boolean, nullable=False)
     voucher_id: int = Column(Integer, ForeignKey("users.id"), nullable=True)
-    created: datetime.datetime = Column(DateTime, server_default=func.now())
-    modified: datetime.datetime = Column(DateTime, server_onupdate=FetchedValue(), server_default=func.now(), onupdate=func.now())
+    created: datetime.datetime = Column(DateTime, server_default=func.now(), index=True)
+    modified: datetime.datetime = Column(
+        DateTime, server_onupdate=FetchedValue(), server_default=func.now(), onupdate=func.now(), index=True
+    )
 
     aliases: List["Alias"] = relationship("Alias", cascade="all,delete", backref="user")
     vouching_for: List["User"] = relationship("User", backref=backref("voucher_user", remote_side=[id]))
@@ -51,7 +58,7 @@ class User(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.User(
+        return schemas.User.construct(
             id=self.id,
             balance=self.balance,
             name=self.name,
@@ -60,8 +67,8 @@ class User(Base):
             external=self.external,
             voucher_id=self.voucher_id,
             aliases=[alias.schema for alias in self.aliases],
-            created=self.created.timestamp(),
-            modified=self.modified.timestamp()
+            created=int(self.created.timestamp()),
+            modified=int(self.modified.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -88,10 +95,10 @@ class Application(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Application(
+        return schemas.Application.construct(
             id=self.id,
             name=self.name,
-            created=self.created.timestamp()
+            created=int(self.created.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -112,6 +119,10 @@ class Alias(Base):
     """User's unique username in the client application (may also be a user ID)"""
     confirmed: bool = Column(Boolean, nullable=False, default=False)
     """Flag indicating whether the alias was confirmed by the user via another application"""
+    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+    modified: datetime.datetime = Column(
+        DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True
+    )
 
     application: Application = relationship("Application", foreign_keys=[application_id])
 
@@ -125,7 +136,7 @@ class Alias(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Alias(
+        return schemas.Alias.construct(
             id=self.id,
             user_id=self.user_id,
             application_id=self.application_id,
@@ -152,7 +163,7 @@ class Transaction(Base):
     amount: int = Column(Integer, nullable=False)
     reason: str = Column(String(255), nullable=True)
     """Reason for the transaction which may be used as its description"""
-    timestamp: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now())
+    timestamp: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), index=True)
     multi_transaction_id: int = Column(Integer, ForeignKey("multi_transactions.id"), nullable=True, default=None)
 
     sender: User = relationship("User", foreign_keys=[sender_id])
@@ -170,14 +181,14 @@ class Transaction(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Transaction(
+        return schemas.Transaction.construct(
             id=self.id,
             sender=self.sender.schema,
             receiver=self.receiver.schema,
             amount=self.amount,
             reason=self.reason,
             multi_transaction_id=self.multi_transaction_id,
-            timestamp=self.timestamp.timestamp()
+            timestamp=int(self.timestamp.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -203,12 +214,12 @@ class MultiTransaction(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.MultiTransaction(
+        return schemas.MultiTransaction.construct(
             id=self.id,
             base_amount=self.base_amount,
             total_amount=sum(t.amount for t in self.transactions),
             transactions=list(map(lambda x: x.schema, self.transactions)),
-            timestamp=self.registered.timestamp()
+            timestamp=int(self.registered.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -228,8 +239,10 @@ class Refund(Base):
     amount: int = Column(Integer, nullable=False)
     description: str = Column(String(255), nullable=False)
     active: bool = Column(Boolean, nullable=False, default=True)
-    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now())
-    modified: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+    modified: datetime.datetime = Column(
+        DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True
+    )
 
     creator_id: int = Column(Integer, ForeignKey("users.id"), nullable=False)
     ballot_id: int = Column(Integer, ForeignKey("ballots.id"), nullable=False)
@@ -249,7 +262,7 @@ class Refund(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Refund(
+        return schemas.Refund.construct(
             id=self.id,
             amount=self.amount,
             description=self.description,
@@ -259,8 +272,8 @@ class Refund(Base):
             ballot_id=self.ballot_id,
             votes=[vote.schema for vote in self.ballot.votes],
             transaction=self.transaction and self.transaction.schema,
-            created=self.created.timestamp(),
-            modified=self.modified.timestamp()
+            created=int(self.created.timestamp()),
+            modified=int(self.modified.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -285,8 +298,10 @@ class Poll(Base):
     user_id: int = Column(Integer, ForeignKey("users.id"), nullable=False)
     creator_id: int = Column(Integer, ForeignKey("users.id"), nullable=False)
     ballot_id: int = Column(Integer, ForeignKey("ballots.id"), nullable=False)
-    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now())
-    modified: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+    modified: datetime.datetime = Column(
+        DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True
+    )
 
     user: User = relationship("User", backref="polls", foreign_keys=[user_id])
     creator: User = relationship("User", foreign_keys=[creator_id])
@@ -298,13 +313,13 @@ class Poll(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Poll(
+        return schemas.Poll.construct(
             id=self.id,
             active=self.active,
             accepted=self.accepted,
             variant=self.variant,
-            created=self.created.timestamp(),
-            modified=self.modified.timestamp(),
+            created=int(self.created.timestamp()),
+            modified=int(self.modified.timestamp()),
             user=self.user.schema,
             creator_id=self.creator_id,
             ballot_id=self.ballot_id,
@@ -339,9 +354,9 @@ class Ballot(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Ballot(
+        return schemas.Ballot.construct(
             id=self.id,
-            modified=self.modified.timestamp(),
+            modified=int(self.modified.timestamp()),
             votes=[v.schema for v in self.votes]
         )
 
@@ -360,7 +375,9 @@ class Vote(Base):
     vote: bool = Column(Boolean, nullable=False)
     ballot_id: int = Column(Integer, ForeignKey("ballots.id", ondelete="CASCADE"), nullable=False)
     user_id: int = Column(Integer, ForeignKey("users.id"), nullable=False)
-    modified: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    modified: datetime.datetime = Column(
+        DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True
+    )
 
     ballot: Ballot = relationship("Ballot", backref="votes")
     user: User = relationship("User", backref="votes")
@@ -375,13 +392,13 @@ class Vote(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Vote(
+        return schemas.Vote.construct(
             id=self.id,
             user_id=self.user_id,
             user_name=self.user.name,
             ballot_id=self.ballot_id,
             vote=self.vote,
-            modified=self.modified.timestamp()
+            modified=int(self.modified.timestamp())
         )
 
     def __repr__(self) -> str:
@@ -401,8 +418,10 @@ class Communism(Base):
     active: bool = Column(Boolean, nullable=False, default=True)
     amount: int = Column(Integer, nullable=False)
     description: str = Column(String(255), nullable=False)
-    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now())
-    modified: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    created: datetime.datetime = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+    modified: datetime.datetime = Column(
+        DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True
+    )
     creator_id: int = Column(Integer, ForeignKey("users.id"), nullable=False)
     multi_transaction_id: int = Column(Integer, ForeignKey("multi_transactions.id"), nullable=True, default=None)
 
@@ -420,18 +439,15 @@ class Communism(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Communism(
+        return schemas.Communism.construct(
             id=self.id,
             amount=self.amount,
             description=self.description,
             creator_id=self.creator_id,
             active=self.active,
-            created=self.created.timestamp(),
-            modified=self.modified.timestamp(),
-            participants=[
-                schemas.CommunismUserBinding(user_id=p.user_id, user_name=p.user.name, quantity=p.quantity)
-                for p in self.participants
-            ],
+            created=int(self.created.timestamp()),
+            modified=int(self.modified.timestamp()),
+            participants=[p.binding for p in self.participants],
             multi_transaction=self.multi_transaction and self.multi_transaction.schema
         )
 
@@ -465,12 +481,24 @@ class CommunismUsers(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.CommunismUser(
+        return schemas.CommunismUser.construct(
             communism=self.communism.schema,
             user=self.user.schema,
             quantity=self.quantity
         )
 
+    @property
+    def binding(self) -> schemas.CommunismUserBinding:
+        """
+        Pydantic schema representation of the participation as part of its communism's schema
+        """
+
+        return schemas.CommunismUserBinding.construct(
+            user_id=self.user_id,
+            user_name=self.user.name,
+            quantity=self.quantity
+        )
+
     def __repr__(self) -> str:
         return f"CommunismUsers(id={self.id}, user={self.user}, quantity={self.quantity})"
 
@@ -497,7 +525,7 @@ class Callback(Base):
         Pydantic schema representation of the database model that can be sent to clients
         """
 
-        return schemas.Callback(
+        return schemas.Callback.construct(
             id=self.id,
             url=self.url,
             application_id=self.application_id
@@ -507,5 +535,28 @@ class Callback(Base):
         return f"Callback(id={self.id}, url={self.url}, application_id={self.application_id})"
 
 
+version_counters = Table(
+    "version_counters",
+    Base.metadata,
+    Column("name", String(255), nullable=False, primary_key=True),
+    Column("value", Integer, nullable=False, default=0),
+    Column("modified", DateTime, nullable=True)
+)
+"""Named counters which are incremented whenever some (cached) data changes; see the ``counters`` module"""
+
+
+idempotency_keys = Table(
+    "idempotency_keys",
+    Base.metadata,
+    Column("application_id", Integer, ForeignKey("applications.id", ondelete="CASCADE"), primary_key=True),
+    Column("key", String(255), nullable=False, primary_key=True),
+    Column("fingerprint", String(64), nullable=False),
+    Column("status", Integer, nullable=False),
+    Column("body", LargeBinary, nullable=False),
+    Column("expires", DateTime, nullable=False, index=True)
+)
+"""Stored responses of idempotent requests per application and key; see the ``idempotency`` module of the API"""
+
+
 # Asserting that every database model has a `schema` attribute
 assert not any(True for mapper in Base.registry.mappers if not hasattr(mapper.class_, "schema"))
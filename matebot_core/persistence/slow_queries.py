@@ -0,0 +1,140 @@
+"""
+MateBot library to log slow database queries together with their query plans
+
+Queries taking longer than the configured threshold are logged by the logger
+of this module, which has its own handler in the default logging configuration.
+Each entry contains the statement, its parameters with all strings and bytes
+redacted, the route of the request which executed it and the output of
+``EXPLAIN`` for ``SELECT`` statements. Slow queries are sampled and the
+number of entries per minute is limited, so that a slow database doesn't
+flood the log or slow down the server even more by explaining every query.
+"""
+
+import time
+import random
+import logging
+import threading
+from typing import Any, Optional
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.pool import QueuePool
+
+
+threshold: float = 0.0
+"""Minimal duration of logged queries in seconds (zero disables it), see ``DatabaseConfig.slow_query_threshold``"""
+
+sample_rate: float = 1.0
+"""Fraction of the slow queries which are logged, see ``DatabaseConfig.slow_query_sample_rate``"""
+
+max_entries_per_minute: int = 10
+"""Maximum number of slow queries logged per minute, see ``DatabaseConfig.slow_query_log_limit``"""
+
+explain: bool = True
+"""Switch to add the query plan to the log entries, see ``DatabaseConfig.slow_query_explain``"""
+
+REDACTED = "<redacted>"
+
+_logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+_window_start = 0.0
+_window_entries = 0
+
+logged = 0
+"""Number of slow queries which have been logged by the worker process"""
+
+suppressed = 0
+"""Number of slow queries which haven't been logged due to sampling or the limit of entries"""
+
+
+def redact(parameters: Any) -> Any:
+    """
+    Replace all strings and bytes in the (possibly nested) query parameters, which may contain personal data
+    """
+
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return type(parameters)(redact(value) for value in parameters)
+    if isinstance(parameters, (str, bytes, bytearray, memoryview)):
+        return REDACTED
+    return parameters
+
+
+def _admit() -> bool:
+    global _window_start, _window_entries, logged, suppressed
+    now = time.monotonic()
+    with _lock:
+        if now - _window_start >= 60:
+            _window_start = now
+            _window_entries = 0
+        if _window_entries >= max_entries_per_minute or random.random() >= sample_rate:
+            suppressed += 1
+            return False
+        _window_entries += 1
+        logged += 1
+        return True
+
+
+def get_query_plan(connection: Connection, statement: str, parameters: Any) -> Optional[str]:
+    """
+    Return the query plan of the SELECT statement as determined by ``EXPLAIN`` (or None for other statements)
+
+    The plan is determined with a cursor of another DBAPI connection of the pool,
+    which doesn't emit any events, so that explaining a query isn't a query of its own.
+    The connection of the query must not be used, since a failing ``EXPLAIN`` would
+    abort its transaction (e.g. on PostgreSQL) and it may still be streaming the
+    results of the query (e.g. with server-side cursors on MySQL). To never wait
+    for a connection, the plan isn't determined if the pool has no idle connection.
+
+    :raises RuntimeError: when there's no idle connection in the pool
+    """
+
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    pool = connection.engine.pool
+    if isinstance(pool, QueuePool) and pool.checkedin() == 0:
+        raise RuntimeError("no idle database connection")
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    dbapi_connection = connection.engine.raw_connection()
+    try:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return "\n".join(" | ".join(str(column) for column in row) for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    finally:
+        # The pool rolls back the transaction of the connection when it's returned
+        dbapi_connection.close()
+
+
+def report(
+        connection: Connection,
+        statement: str,
+        parameters: Any,
+        executemany: bool,
+        duration: float,
+        route: Optional[str] = None
+):
+    """
+    Log the slow query, unless it's not sampled or too many slow queries have been logged recently
+    """
+
+    if not _admit():
+        return
+
+    plan = None
+    if explain and not executemany:
+        try:
+            plan = get_query_plan(connection, statement, parameters)
+        except Exception as exc:
+            plan = f"not available ({type(exc).__name__}: {exc})"
+
+    statement = " ".join(statement.split())
+    message = (
+        f"Slow query ({duration * 1000:.1f} ms) in {route or 'no route'}: "
+        f"{statement!r} with parameters {redact(parameters)!r}"
+    )
+    if plan is not None:
+        message += f"\nQuery plan:\n{plan}"
+    _logger.warning(message)
@@ -0,0 +1,124 @@
+"""
+MateBot library to count and time the database queries of units of work, e.g. requests
+
+A unit of work calls ``start`` to collect the statistics of all queries which are
+executed in its context until it calls ``stop``. The statistics are kept in a
+context variable, which is inherited by the threads of the thread pool running
+synchronous dependencies and path operations, so that their queries are counted
+as well. Queries executed outside any tracked context aren't counted at all.
+
+The same events are used to find slow queries (see ``slow_queries``), which
+are reported together with the route of the statistics of their context, and
+to record a span for every query of a sampled trace (see ``misc.tracing``).
+"""
+
+import time
+import contextvars
+from typing import Optional, Tuple
+
+import sqlalchemy.event
+from sqlalchemy.engine import Engine
+
+from . import slow_queries
+from ..misc import tracing
+
+
+_START_TIMES_KEY = "matebot_query_start_times"
+_SPANS_KEY = "matebot_query_spans"
+
+
+class QueryStatistics:
+    """
+    Number and total duration (in seconds) of the queries of a unit of work, e.g. the request of a route
+    """
+
+    __slots__ = ("count", "duration", "route")
+
+    def __init__(self, route: Optional[str] = None):
+        self.count = 0
+        self.duration = 0.0
+        self.route = route
+
+
+_current: contextvars.ContextVar[Optional[QueryStatistics]] = contextvars.ContextVar(
+    "matebot_query_statistics",
+    default=None
+)
+
+
+def start(route: Optional[str] = None) -> Tuple[QueryStatistics, contextvars.Token]:
+    """
+    Start collecting the statistics of the queries of the current context
+
+    :param route: optional route of the request of the current context, which is used to report slow queries
+    :return: tuple of the new statistics and the token to be passed to ``stop``
+    """
+
+    statistics = QueryStatistics(route)
+    return statistics, _current.set(statistics)
+
+
+def stop(token: contextvars.Token):
+    """
+    Stop collecting statistics in the current context, restoring the previous statistics (if any)
+
+    The queries of the stopped statistics are added to the previous statistics,
+    e.g. the queries of the operations of a batch request to the batch request.
+    """
+
+    statistics = _current.get()
+    _current.reset(token)
+    parent = _current.get()
+    if parent is not None and statistics is not None:
+        parent.count += statistics.count
+        parent.duration += statistics.duration
+
+
+def current() -> Optional[QueryStatistics]:
+    return _current.get()
+
+
+@sqlalchemy.event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(connection, cursor, statement, *_):  # noqa
+    if _current.get() is not None or slow_queries.threshold > 0:
+        connection.info.setdefault(_START_TIMES_KEY, []).append(time.perf_counter())
+    span = tracing.start_span(
+        "db.query",
+        tracing.SPAN_KIND_CLIENT,
+        **{"db.system": connection.dialect.name, "db.statement": statement}
+    )
+    if span is not None:
+        connection.info.setdefault(_SPANS_KEY, []).append(span)
+
+
+@sqlalchemy.event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):  # noqa
+    spans = connection.info.get(_SPANS_KEY)
+    if spans:
+        spans.pop().finish()
+    start_times = connection.info.get(_START_TIMES_KEY)
+    if not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    statistics = _current.get()
+    if statistics is not None:
+        statistics.count += 1
+        statistics.duration += duration
+    if 0 < slow_queries.threshold <= duration:
+        route = statistics.route if statistics is not None else None
+        slow_queries.report(connection, statement, parameters, executemany, duration, route)
+
+
+@sqlalchemy.event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # The cursor execution failed, so there's no matching 'after_cursor_execute' event
+    if context.connection is None:
+        return
+    start_times = context.connection.info.get(_START_TIMES_KEY)
+    if start_times:
+        start_times.pop()
+    spans = context.connection.info.get(_SPANS_KEY)
+    if spans:
+        span = spans.pop()
+        span.set_error(context.original_exception)
+        span.finish()
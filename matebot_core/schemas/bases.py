@@ -6,6 +6,7 @@ applications and the transactions between the users as
 well as the schemas needed for managing and consuming goods.
 """
 
+import enum
 from typing import List, Optional, Union
 
 import pydantic
@@ -14,6 +15,16 @@ import pydantic
 user_spec = Union[pydantic.NonNegativeInt, pydantic.constr(max_length=255)]
 
 
+class Expansion(str, enum.Enum):
+    ALL = "all"
+    NONE = "none"
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
 class IdBody(pydantic.BaseModel):
     id: pydantic.NonNegativeInt
 
@@ -26,6 +37,7 @@ class IssuerIdBody(pydantic.BaseModel):
 class Token(pydantic.BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 
 class Alias(pydantic.BaseModel):
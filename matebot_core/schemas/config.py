@@ -9,6 +9,9 @@ import pydantic
 from .bases import Consumable
 
 
+MetricsPath = pydantic.constr(regex=r"^/")
+
+
 class GeneralConfig(pydantic.BaseModel):
     min_refund_approves: pydantic.PositiveInt = 2
     min_refund_disapproves: pydantic.PositiveInt = 2
@@ -19,16 +22,57 @@ class GeneralConfig(pydantic.BaseModel):
     max_transaction_amount: pydantic.conint(gt=100) = 50000
 
 
+class RateLimit(pydantic.BaseModel):
+    rate: pydantic.confloat(gt=0)
+    burst: pydantic.PositiveInt
+
+
+class ApplicationRateLimits(pydantic.BaseModel):
+    read: Optional[RateLimit] = None
+    write: Optional[RateLimit] = None
+
+
+class RateLimitConfig(ApplicationRateLimits):
+    applications: Dict[str, ApplicationRateLimits] = {}
+
+
 class ServerConfig(pydantic.BaseModel):
     allow_weak_insecure_password_hashes: bool = False
     host: str = "127.0.0.1"
     port: pydantic.conint(gt=0, lt=65536) = 8000
     public_base_url: Optional[pydantic.AnyHttpUrl] = None
+    alias_cache_size: pydantic.NonNegativeInt = 1024
+    token_revalidation_interval: pydantic.confloat(ge=0) = 0.0
+    password_hashing_workers: pydantic.PositiveInt = 2
+    refresh_token_lifetime: pydantic.PositiveInt = 10080
+    token_secret: Optional[pydantic.constr(min_length=32)] = None
+    validate_responses: bool = False
+    response_cache_size: pydantic.NonNegativeInt = 2 ** 24
+    response_cache_file: Optional[str] = None
+    compression_level: pydantic.conint(ge=0, le=9) = 6
+    compression_minimum_size: pydantic.NonNegativeInt = 1024
+    idempotency_key_lifetime: pydantic.PositiveInt = 1440
+    rate_limits: RateLimitConfig = RateLimitConfig()
+    max_concurrent_requests: pydantic.NonNegativeInt = 0
+    metrics_path: Optional[MetricsPath] = "/metrics"
+    metrics_authentication: bool = True
+    admin_application: Optional[str] = None
+    profile_directory: str = "./profiles"
+    event_loop_monitor_interval: pydantic.confloat(ge=0) = 0.1
+    event_loop_block_threshold: pydantic.confloat(gt=0) = 0.5
+    trace_sample_rate: pydantic.confloat(ge=0, le=1) = 0.0
 
 
 class DatabaseConfig(pydantic.BaseModel):
     connection: str = "sqlite://"
     debug_sql: bool = False
+    debug_query_headers: bool = False
+    query_count_budget: pydantic.NonNegativeInt = 0
+    query_duration_budget: pydantic.confloat(ge=0) = 0.0
+    slow_query_threshold: pydantic.confloat(ge=0) = 0.0
+    slow_query_sample_rate: pydantic.confloat(ge=0, le=1) = 1.0
+    slow_query_log_limit: pydantic.PositiveInt = 10
+    slow_query_explain: bool = True
 
 
 class LoggingConfig(pydantic.BaseModel):
@@ -55,9 +99,28 @@ class LoggingConfig(pydantic.BaseModel):
         "access": {
             "()": "uvicorn.logging.AccessFormatter",
             "fmt": "%(asctime)s %(client_addr)s - \"%(request_line)s\" %(status_code)s"
+        },
+        "json": {
+            "()": "matebot_core.misc.logger.JSONFormatter"
+        },
+        "message": {
+            "format": "%(message)s"
+        }
+    }
+    loggers: Dict[str, dict] = {
+        "matebot_core.persistence.slow_queries": {
+            "handlers": ["slow_queries"],
+            "propagate": False
+        },
+        "matebot_core.api.monitoring.access": {
+            "handlers": ["access_json"],
+            "propagate": False
+        },
+        "matebot_core.misc.tracing": {
+            "handlers": ["traces"],
+            "propagate": False
         }
     }
-    loggers: Dict[str, dict] = {}
     handlers: Dict[str, Dict[str, Union[str, list]]] = {
         "default": {
             "level": "INFO",
@@ -67,15 +130,35 @@ class LoggingConfig(pydantic.BaseModel):
         },
         "file": {
             "level": "DEBUG",
-            "class": "logging.FileHandler",
+            "()": "matebot_core.misc.logger.create_background_file_handler",
             "filename": "./matebot.log",
             "formatter": "file"
         },
         "access": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "()": "matebot_core.misc.logger.create_background_file_handler",
             "filename": "./access.log",
             "formatter": "access"
+        },
+        "slow_queries": {
+            "level": "INFO",
+            "()": "matebot_core.misc.logger.create_background_file_handler",
+            "filename": "./slow_queries.log",
+            "formatter": "file",
+            "delay": "true"
+        },
+        "access_json": {
+            "level": "INFO",
+            "()": "matebot_core.misc.logger.create_background_file_handler",
+            "filename": "./access.jsonl",
+            "formatter": "json"
+        },
+        "traces": {
+            "level": "INFO",
+            "()": "matebot_core.misc.logger.create_background_file_handler",
+            "filename": "./traces.jsonl",
+            "formatter": "message",
+            "delay": "true"
         }
     }
     root: dict = {
@@ -6,7 +6,7 @@ well as an enum of the different known event types.
 """
 
 import enum
-from typing import List
+from typing import List, Optional
 
 import pydantic
 
@@ -35,6 +35,7 @@ class Event(pydantic.BaseModel):
     event: EventType
     timestamp: pydantic.NonNegativeInt
     data: dict
+    trace_id: Optional[pydantic.constr(min_length=32, max_length=32)] = None
 
 
 class EventsNotification(pydantic.BaseModel):
@@ -1,18 +1,22 @@
 """
 MateBot extra schemas
 
-This module contains the special schemas for updates and the status.
+This module contains the special schemas for updates, the status and batch requests.
 """
 
+import enum
 import time
 import datetime
-from typing import List, Optional
+from typing import Any, List, Optional
 
 import pydantic
 
 
 _URL_SCHEMES = {"http", "https"}
 
+BatchMethod = pydantic.constr(regex=r"^(GET|POST|PUT|DELETE)$")
+BatchPath = pydantic.constr(min_length=1, max_length=2048, regex=r"^/")
+
 
 class Versions(pydantic.BaseModel):
     class Version(pydantic.BaseModel):
@@ -23,6 +27,45 @@ class Versions(pydantic.BaseModel):
     versions: List[Version]
 
 
+class BatchMode(str, enum.Enum):
+    ATOMIC = "atomic"
+    INDEPENDENT = "independent"
+
+
+class BatchOperation(pydantic.BaseModel):
+    method: BatchMethod
+    path: BatchPath
+    body: Optional[Any] = None
+
+
+class BatchRequest(pydantic.BaseModel):
+    mode: BatchMode = BatchMode.ATOMIC
+    operations: pydantic.conlist(BatchOperation, min_items=1, max_items=100)
+
+
+class BatchResult(pydantic.BaseModel):
+    status: int
+    body: Optional[Any] = None
+
+
+class BatchResponse(pydantic.BaseModel):
+    committed: bool
+    results: List[BatchResult]
+
+
+class ProfilerOptions(pydantic.BaseModel):
+    interval: pydantic.confloat(ge=0.001, le=1) = 0.01
+
+
+class ProfilerStatus(pydantic.BaseModel):
+    running: bool
+    process: pydantic.NonNegativeInt
+    interval: float
+    samples: pydantic.NonNegativeInt
+    started: Optional[pydantic.NonNegativeInt] = None
+    file: Optional[str] = None
+
+
 class VersionInfo(pydantic.BaseModel):
     major: pydantic.NonNegativeInt
     minor: pydantic.NonNegativeInt
@@ -4,6 +4,7 @@ MateBot core settings provider
 
 import os
 import sys
+import secrets
 import functools
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
@@ -81,6 +82,8 @@ class Settings(pydantic.BaseSettings, config.CoreConfig):
 def store_configuration(conf: Optional[config.CoreConfig] = None, path: Optional[str] = None) -> config.CoreConfig:
     p = path or os.path.abspath(CONFIG_PATHS[0])
     conf = conf or get_default_core_config(get_db_from_env())
+    if conf.server.token_secret is None:
+        conf.server.token_secret = secrets.token_hex(32)
     with open(p, "w") as f:
         json.dump(conf.dict(), f, indent=4)
     SETTINGS_LOG_INFO_FUNCTION and SETTINGS_LOG_INFO_FUNCTION(f"A new config file has been created as {p!r}.")
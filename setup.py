@@ -46,6 +46,8 @@ setuptools.setup(
     extra_requires={
         "full": [
             "aiofiles>=0.8.0,<1.0",
+            "brotli>=1.0,<2.0",
+            "msgpack>=1.0,<2.0",
             "ujson>=5.2,<6.0"
         ]
     },
@@ -5,16 +5,21 @@ MateBot core unit tests
 import unittest
 from .api import APITests, UninitializedAPITests
 from .cli import StandaloneCLITests
-from .load import LoadTests
-from .misc import TransactionTests
+from .load import AdmissionControlTests, LoadTests
+from .misc import AuthTests, CacheTests, LoggingTests, MonitoringTests, TransactionTests
 from .persistence import DatabaseRestrictionTests, DatabaseUsabilityTests
 
 
 TEST_CLASSES = [
+    AdmissionControlTests,
     APITests,
+    AuthTests,
+    CacheTests,
     DatabaseRestrictionTests,
     DatabaseUsabilityTests,
     LoadTests,
+    LoggingTests,
+    MonitoringTests,
     StandaloneCLITests,
     TransactionTests,
     UninitializedAPITests,
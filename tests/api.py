@@ -2,11 +2,22 @@
 MateBot unit tests for the whole API in certain user actions
 """
 
+import io
+import os
+import csv
+import json
 import time
+import tempfile
+import concurrent.futures
 import urllib.parse
 import unittest as _unittest
 from typing import List
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from matebot_core import schemas as _schemas
 from matebot_core.api.auth import hash_password
 from matebot_core.persistence import models
@@ -15,6 +26,12 @@ from . import utils
 
 
 class APITests(utils.BaseAPITests):
+    EXTRA_API_SERVER_ENV_VARS = {
+        "DATABASE__DEBUG_QUERY_HEADERS": "true",
+        "SERVER__ADMIN_APPLICATION": "application",
+        "SERVER__PROFILE_DIRECTORY": os.path.join(tempfile.gettempdir(), "matebot_test_profiles")
+    }
+
     def test_basic_endpoints_and_redirects_to_docs(self):
         for _ in range(64):
             self.assertEqual({}, self.assertQuery(("GET", "/health"), 200).json())
@@ -37,6 +54,28 @@ class APITests(utils.BaseAPITests):
         self.assertQuery(("GET", "/status"), 404)
         self.assertQuery(("POST", "/status"), 404)
 
+    def test_token_refresh(self):
+        self.login()
+        token = self.assertQuery(
+            ("POST", "/refresh"),
+            data={"refresh_token": self.refresh_token},
+            r_schema=_schemas.Token
+        ).json()
+        self.assertNotEqual(self.refresh_token, token["refresh_token"])
+        self.token = token["access_token"]
+        self.assertQuery(("GET", "/users"))
+
+        # Refresh tokens are rotated, so every refresh token can be used only once
+        self.assertQuery(("POST", "/refresh"), 401, data={"refresh_token": self.refresh_token})
+        token = self.assertQuery(("POST", "/refresh"), data={"refresh_token": token["refresh_token"]}).json()
+        self.refresh_token = token["refresh_token"]
+
+        # Access and refresh tokens can't be used interchangeably
+        self.assertQuery(("POST", "/refresh"), 401, data={"refresh_token": self.token})
+        self.assertQuery(("POST", "/refresh"), 400)
+        self.token = self.refresh_token
+        self.assertQuery(("GET", "/users"), 401)
+
     def test_pagination(self):
         def _test(**kwargs) -> List[int]:
             path = "/users"
@@ -101,6 +140,452 @@ class APITests(utils.BaseAPITests):
         self.assertListEqual([19, 18, 17, 16, 15, 14, 13, 12, 11, 1], _test(page=1, external=False, descending=True))
         self.assertListEqual([17, 16], _test(limit=2, page=1, external=False, descending=True))
 
+    def test_conditional_requests(self):
+        self.login()
+        self.assertQuery(("POST", "/users"), 201, json={"name": "user1"})
+        users = self.assertQuery(("GET", "/users"), r_headers=["ETag", "Last-Modified"])
+        etag = users.headers["ETag"]
+        self.assertEqual(users.json(), self.assertQuery(("GET", "/users")).json())
+        self.assertEqual(etag, self.assertQuery(("GET", "/users?limit=1")).headers["ETag"])
+        not_modified = self.assertQuery(("GET", "/users"), 304, headers={"If-None-Match": etag}, r_none=True)
+        self.assertEqual(etag, not_modified.headers["ETag"])
+        self.assertQuery(("GET", "/users"), 304, headers={"If-None-Match": f'"foo", {etag[2:]}'}, r_none=True)
+        self.assertQuery(("GET", "/users"), 200, headers={"If-None-Match": '"foo"'})
+
+        # Both changes of the models and their relationships change the ETag
+        self.assertQuery(("POST", "/users"), 201, json={"name": "user2"})
+        users = self.assertQuery(("GET", "/users"), 200, headers={"If-None-Match": etag})
+        self.assertNotEqual(etag, users.headers["ETag"])
+        self.assertEqual(3, len(users.json()))
+        etag = users.headers["ETag"]
+        self.assertQuery(
+            ("POST", "/aliases"), 201,
+            json={"user_id": 2, "application_id": 1, "username": "alias", "confirmed": True}
+        )
+        users = self.assertQuery(("GET", "/users"), 200, headers={"If-None-Match": etag})
+        self.assertNotEqual(etag, users.headers["ETag"])
+
+        for endpoint in ("/polls", "/refunds"):
+            etag = self.assertQuery(("GET", endpoint)).headers["ETag"]
+            self.assertQuery(("GET", endpoint), 304, headers={"If-None-Match": etag}, r_none=True)
+
+    def test_delta_sync(self):
+        self.login()
+        user1 = self.assertQuery(("POST", "/users"), 201, json={"name": "user1"}).json()
+        self.assertQuery(("POST", "/users"), 201, json={"name": "user2"})
+        since = user1["created"]
+        self.assertEqual(2, len(self.assertQuery(("GET", f"/users?created_since={since}&community=false")).json()))
+        self.assertEqual([], self.assertQuery(("GET", f"/users?created_since={since + 60}")).json())
+        self.assertEqual([], self.assertQuery(("GET", f"/transactions?modified_since={since}")).json())
+        self.assertEqual([], self.assertQuery(("GET", f"/aliases?created_since={since}")).json())
+
+        time.sleep(1.5)
+        since = int(time.time())
+        self.assertEqual([], self.assertQuery(("GET", f"/users?modified_since={since}")).json())
+        alias = self.assertQuery(
+            ("POST", "/aliases"), 201,
+            json={"user_id": user1["id"], "application_id": 1, "username": "alias", "confirmed": True}
+        ).json()
+        self.assertEqual([alias], self.assertQuery(("GET", f"/aliases?modified_since={since}")).json())
+        users = self.assertQuery(("GET", f"/users?modified_since={since}")).json()
+        self.assertEqual([user1["id"]], [u["id"] for u in users])
+
+        # Soft-deleted users are reported as tombstones, even when searching for active users
+        time.sleep(1.5)
+        since = int(time.time())
+        self.assertQuery(("POST", "/users/delete"), 200, json={"id": user1["id"], "issuer": user1["id"]})
+        for query in ("", "&active=true"):
+            users = self.assertQuery(("GET", f"/users?modified_since={since}{query}")).json()
+            self.assertEqual(1, len(users))
+            self.assertEqual(user1["id"], users[0]["id"])
+            self.assertFalse(users[0]["active"])
+            self.assertEqual([], users[0]["aliases"])
+        self.assertEqual([], self.assertQuery(("GET", f"/aliases?modified_since={since}")).json())
+        self.assertEqual(1, len(self.assertQuery(("GET", f"/users?active=true&community=false")).json()))
+
+    def test_sparse_fieldsets(self):
+        self.login()
+        with self.get_db_session() as session:
+            user1 = models.User(name="user1", external=False, permission=True)
+            user2 = models.User(name="user2", external=False, permission=True)
+            session.add_all([user1, user2])
+            session.commit()
+            session.add(models.Transaction(sender_id=user1.id, receiver_id=user2.id, amount=42, reason="foo"))
+            session.commit()
+            user_ids = [user1.id, user2.id]
+        self.assertQuery(
+            ("POST", "/aliases"), 201,
+            json={"user_id": user_ids[0], "application_id": 1, "username": "alias", "confirmed": True}
+        )
+
+        full = self.assertQuery(("GET", "/transactions")).json()[0]
+        shallow = self.assertQuery(("GET", "/transactions?expand=none")).json()[0]
+        self.assertEqual(
+            {"id", "sender_id", "receiver_id", "amount", "reason", "multi_transaction_id", "timestamp"},
+            set(shallow)
+        )
+        self.assertEqual((full["sender"]["id"], full["receiver"]["id"]), (shallow["sender_id"], shallow["receiver_id"]))
+        self.assertEqual(full["timestamp"], shallow["timestamp"])
+        self.assertEqual(
+            [{"id": full["id"], "amount": 42, "sender": full["sender"]}],
+            self.assertQuery(("GET", "/transactions?fields=amount,sender")).json()
+        )
+        self.assertEqual(
+            [{"id": full["id"], "sender_id": user_ids[0]}],
+            self.assertQuery(("GET", "/transactions?fields=sender&expand=none")).json()
+        )
+
+        users = self.assertQuery(("GET", "/users?fields=name,aliases&community=false")).json()
+        self.assertEqual(["user1", "user2"], [u["name"] for u in users])
+        self.assertEqual(["alias"], [a["username"] for a in users[0]["aliases"]])
+        self.assertNotIn("aliases", self.assertQuery(("GET", "/users?expand=none")).json()[0])
+        self.assertEqual(
+            self.assertQuery(("GET", "/users?fields=name")).json(),
+            self.assertQuery(("GET", "/users?fields=name")).json()
+        )
+        self.assertEqual([], self.assertQuery(("GET", "/refunds?fields=creator,allowed&expand=none")).json())
+        self.assertQuery(("GET", "/transactions?fields=amount,foo"), 400)
+        self.assertQuery(("GET", "/transactions?expand=foo"), 400)
+
+    def test_id_lists(self):
+        self.login()
+        for i in range(5):
+            self.assertQuery(("POST", "/users"), 201, json={"name": f"user{i}"})
+
+        def ids(query: str) -> List[int]:
+            return [u["id"] for u in self.assertQuery(("GET", f"/users?{query}")).json()]
+
+        self.assertEqual([2], ids("id=2"))
+        self.assertEqual([2, 4, 6], ids("id=6&id=2&id=4"))
+        self.assertEqual([2, 4, 6], ids("id=2,4&id=6,2"))
+        self.assertEqual([4], ids("id=4,99"))
+        self.assertEqual([6, 4], ids("id=4,6&descending=true"))
+        self.assertEqual([], [a["id"] for a in self.assertQuery(("GET", "/aliases?id=1,2")).json()])
+        self.assertEqual(1, len(self.assertQuery(("GET", "/applications?id=1&id=2")).json()))
+        self.assertQuery(("GET", "/users?id=1,foo"), 400)
+        self.assertQuery(("GET", "/users?id=-1"), 400)
+        self.assertQuery(("GET", "/users?id=%C2%B2"), 400)
+        for query in ("id=", "id=,", "id=1,", "id=1&id="):
+            self.assertQuery(("GET", f"/users?{query}"), 400)
+        self.assertQuery(("GET", "/users?id=1,%D9%A3"), 400)
+        self.assertQuery(("GET", "/transactions?" + "&".join(f"id={i}" for i in range(101))), 400)
+        self.assertEqual([], self.assertQuery(("GET", "/transactions?id=" + ",".join(map(str, range(100))))).json())
+
+    def test_transaction_export(self):
+        self.login()
+        self.assertEqual("", self.assertQuery(("GET", "/transactions/export"), r_none=True).text)
+        with self.get_db_session() as session:
+            user1 = models.User(name="user1", external=False, permission=True)
+            user2 = models.User(name="user2", external=False, permission=True)
+            session.add_all([user1, user2])
+            session.commit()
+            for i in range(1, 6):
+                reason = f'a, "b" {i}'
+                session.add(models.Transaction(sender_id=user1.id, receiver_id=user2.id, amount=i, reason=reason))
+            session.add(models.Transaction(sender_id=user2.id, receiver_id=1, amount=42))
+            session.commit()
+            user_ids = [user1.id, user2.id]
+
+        expected = [
+            {
+                **{k: v for k, v in t.items() if k not in ("sender", "receiver")},
+                "sender_id": t["sender"]["id"],
+                "receiver_id": t["receiver"]["id"]
+            }
+            for t in self.assertQuery(("GET", "/transactions")).json()
+        ]
+        response = self.assertQuery(
+            ("GET", "/transactions/export"),
+            r_headers={"Content-Type": "application/x-ndjson"},
+            r_is_json=False
+        )
+        lines = response.text.splitlines()
+        self.assertEqual(expected, [json.loads(line) for line in lines])
+
+        query = f"/transactions/export?format=csv&member_id={user_ids[1]}"
+        response = self.assertQuery(("GET", query), r_is_json=False)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/csv"))
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(6, len(rows))
+        self.assertEqual(expected[0]["reason"], rows[0]["reason"])
+        self.assertEqual([str(t["amount"]) for t in expected], [r["amount"] for r in rows])
+        self.assertEqual("", rows[-1]["reason"])
+        self.assertEqual([], list(csv.DictReader(io.StringIO(self.assertQuery(
+            ("GET", f"/transactions/export?format=csv&created_since={expected[-1]['timestamp'] + 60}"),
+            r_is_json=False
+        ).text))))
+        self.assertQuery(("GET", "/transactions/export?format=xml"), 400)
+
+    def test_response_compression(self):
+        self.login()
+        with self.get_db_session() as session:
+            session.add_all([models.User(name=f"user{i}", external=False) for i in range(32)])
+            session.commit()
+            session.add_all([models.Transaction(sender_id=2, receiver_id=3, amount=i) for i in range(1, 2001)])
+            session.commit()
+
+        users = self.assertQuery(("GET", "/users"), headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", users.headers)
+        for accept_encoding in ("gzip", "deflate, gzip;q=0.5", "*"):
+            response = self.assertQuery(("GET", "/users"), headers={"Accept-Encoding": accept_encoding})
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertIn("Accept-Encoding", response.headers["Vary"])
+            self.assertEqual(users.json(), response.json())
+        for accept_encoding in ("gzip;q=0", "deflate", "*;q=0"):
+            response = self.assertQuery(("GET", "/users"), headers={"Accept-Encoding": accept_encoding})
+            self.assertNotIn("Content-Encoding", response.headers)
+
+        # Small responses aren't compressed, while streamed responses are compressed chunk by chunk
+        self.assertNotIn("Content-Encoding", self.assertQuery(("GET", "/users?id=1")).headers)
+        response = self.assertQuery(("GET", "/transactions/export?format=csv"), r_is_json=False)
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(2001, len(response.text.splitlines()))
+
+    @_unittest.skipIf(msgpack is None, "MessagePack support requires the 'msgpack' package")
+    def test_msgpack_negotiation(self):
+        self.login()
+        accept = {"Accept": "application/msgpack"}
+        users = self.assertQuery(("GET", "/users")).json()
+        response = self.assertQuery(("GET", "/users"), headers=accept, r_is_json=False)
+        self.assertEqual("application/msgpack", response.headers["Content-Type"])
+        self.assertIn("Accept", response.headers["Vary"])
+        self.assertEqual(users, msgpack.unpackb(response.content))
+        json_response = self.assertQuery(("GET", "/users"))
+        self.assertIn("Accept", json_response.headers["Vary"])
+        self.assertNotEqual(json_response.headers["ETag"], response.headers["ETag"])
+        self.assertQuery(("GET", "/users"), 200, headers={"If-None-Match": response.headers["ETag"]})
+        not_modified = self.assertQuery(
+            ("GET", "/users"), 304, headers={"If-None-Match": response.headers["ETag"], **accept}, r_none=True
+        )
+        self.assertIn("Accept", not_modified.headers["Vary"])
+        for value in ("application/json, application/msgpack", "application/msgpack;q=0.5, */*", "text/html"):
+            response = self.assertQuery(("GET", "/users"), headers={"Accept": value})
+            self.assertEqual("application/json", response.headers["Content-Type"])
+
+        headers = {"Content-Type": "application/msgpack", **accept}
+        response = self.assertQuery(
+            ("POST", "/users"), 201,
+            headers=headers, data=msgpack.packb({"name": "user1"}), r_is_json=False
+        )
+        user = msgpack.unpackb(response.content)
+        self.assertEqual("user1", user["name"])
+        self.assertEqual(user, self.assertQuery(("GET", f"/users?id={user['id']}")).json()[0])
+        response = self.assertQuery(
+            ("POST", "/users"), 201,
+            headers={"Content-Type": "application/msgpack"}, data=msgpack.packb({"name": "user2"})
+        )
+        self.assertEqual("user2", response.json()["name"])
+
+        # Errors are encoded as MessagePack as well
+        for data in (b"\xc1", msgpack.packb({"name": ["foo"]}), msgpack.packb({"foo": "bar"})):
+            response = self.assertQuery(("POST", "/users"), 400, headers=headers, data=data, r_is_json=False)
+            self.assertEqual(400, msgpack.unpackb(response.content)["status"])
+        self.assertEqual("User with ID 42 was not found.", msgpack.unpackb(self.assertQuery(
+            ("POST", "/users/setName"), 400, headers=headers,
+            data=msgpack.packb({"name": "foo", "issuer": 42}), r_is_json=False
+        ).content)["message"])
+
+    def test_batch_requests(self):
+        self.login()
+        self.assertQuery(("POST", "/callbacks"), 201, json={"url": f"http://localhost:{self.callback_server_port}/"})
+        users = [self.assertQuery(("POST", "/users"), 201, json={"name": f"u{i}"}).json()["id"] for i in range(3)]
+        for user_id in users:
+            self._edit_user(user_id, permission=True, external=False)
+        communism = self.assertQuery(
+            ("POST", "/communisms"),
+            201,
+            json={"amount": 1, "description": "batch", "creator": users[0]}
+        ).json()
+        self.assertEvent("communism_created", {"id": communism["id"]})
+
+        def participate(user) -> dict:
+            return {"method": "POST", "path": "/communisms/increaseParticipation", "body": {"id": 1, "user": user}}
+
+        def participants() -> int:
+            result = self.assertQuery(("GET", "/communisms?id=1"), 200).json()
+            return sum(p["quantity"] for p in result[0]["participants"])
+
+        # All operations succeed and are committed in one transaction, results are in order
+        response = self.assertQuery(("POST", "/batch"), 200, json={"operations": [
+            participate(users[1]),
+            participate(users[2]),
+            {"method": "GET", "path": "/communisms?id=1"}
+        ]}).json()
+        self.assertTrue(response["committed"])
+        self.assertEqual([200, 200, 200], [r["status"] for r in response["results"]])
+        self.assertEqual(3, sum(p["quantity"] for p in response["results"][2]["body"][0]["participants"]))
+        self.assertEqual(3, participants())
+        self.assertEvent("communism_updated", {"id": 1, "participants": 2})
+        self.assertEvent("communism_updated", {"id": 1, "participants": 3})
+
+        # The failing operation rolls back the whole batch in the atomic mode and skips the rest
+        response = self.assertQuery(("POST", "/batch"), 200, json={"mode": "atomic", "operations": [
+            participate(users[1]),
+            participate(42),
+            participate(users[2])
+        ]}).json()
+        self.assertFalse(response["committed"])
+        self.assertEqual([200, 400, 424], [r["status"] for r in response["results"]])
+        self.assertEqual(400, response["results"][1]["body"]["status"])
+        self.assertIsNone(response["results"][2]["body"])
+        self.assertEqual(3, participants())
+
+        # Only the failing operation is rolled back in the independent mode
+        response = self.assertQuery(("POST", "/batch"), 200, json={"mode": "independent", "operations": [
+            participate(users[1]),
+            participate(42),
+            participate(users[2])
+        ]}).json()
+        self.assertTrue(response["committed"])
+        self.assertEqual([200, 400, 200], [r["status"] for r in response["results"]])
+        self.assertEqual(5, participants())
+
+        # Events are only published for committed changes, i.e. not for the rolled back atomic batch
+        updates = []
+        while not self.callback_event_queue.empty() or not updates or len(updates) < 2:
+            event_type, _, data = self.callback_event_queue.get(timeout=2)
+            if event_type == "communism_updated":
+                updates.append(data["participants"])
+        time.sleep(0.5)
+        self.assertTrue(self.callback_event_queue.empty())
+        self.assertEqual([4, 5], updates)
+
+        self.assertQuery(("POST", "/batch"), 400, json={"operations": []})
+        self.assertQuery(("POST", "/batch"), 400, json={"operations": [{"method": "GET", "path": "/batch"}]})
+        self.assertQuery(("POST", "/batch"), 400, json={"operations": [{"method": "HEAD", "path": "/users"}]})
+        self.assertQuery(("POST", "/batch"), 400, json={"operations": [{"method": "GET", "path": "users"}]})
+
+    def test_idempotency_keys(self):
+        self.login()
+        users = [self.assertQuery(("POST", "/users"), 201, json={"name": f"u{i}"}).json()["id"] for i in range(2)]
+        for user_id in users:
+            self._edit_user(user_id, external=False)
+        payment = {"sender": users[0], "receiver": users[1], "amount": 42, "reason": "retry"}
+
+        def transactions() -> int:
+            with self.get_db_session() as session:
+                return session.query(models.Transaction).count()
+
+        # The same key returns the original response without sending money twice
+        key = {"Idempotency-Key": "a"}
+        first = self.assertQuery(("POST", "/transactions/send"), 201, json=payment, headers=key)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        for _ in range(3):
+            replay = self.assertQuery(("POST", "/transactions/send"), 201, json=payment, headers=key)
+            self.assertEqual("true", replay.headers["Idempotent-Replayed"])
+            self.assertEqual(first.json(), replay.json())
+        self.assertEqual(1, transactions())
+
+        # Other keys or no keys at all execute the request again
+        self.assertQuery(("POST", "/transactions/send"), 201, json=payment, headers={"Idempotency-Key": "b"})
+        self.assertQuery(("POST", "/transactions/send"), 201, json=payment)
+        self.assertEqual(3, transactions())
+
+        # Reusing a key for a different request is a conflict, invalid keys are rejected
+        other = {**payment, "amount": 1}
+        self.assertQuery(("POST", "/transactions/send"), 409, json=other, headers={"Idempotency-Key": "a"})
+        self.assertQuery(("POST", "/transactions/send"), 400, json=payment, headers={"Idempotency-Key": "a" * 256})
+        self.assertEqual(3, transactions())
+
+        # Failed requests aren't stored, so they can be retried with the same key after fixing them
+        invalid = {**payment, "receiver": users[0]}
+        self.assertQuery(("POST", "/transactions/send"), 400, json=invalid, headers={"Idempotency-Key": "c"})
+        self.assertQuery(("POST", "/transactions/send"), 400, json=invalid, headers={"Idempotency-Key": "c"})
+        fixed = {**payment, "amount": 2}
+        self.assertQuery(("POST", "/transactions/send"), 201, json=fixed, headers={"Idempotency-Key": "c"})
+        self.assertQuery(("POST", "/transactions/send"), 201, json=fixed, headers={"Idempotency-Key": "c"})
+        self.assertEqual(4, transactions())
+
+        # Concurrent requests with the same key are executed once and all of them return the same response
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(
+                lambda _: self.assertQuery(
+                    ("POST", "/transactions/send"), 201, json=payment, headers={"Idempotency-Key": "d"}
+                ).json(),
+                range(8)
+            ))
+        self.assertEqual(5, transactions())
+        self.assertTrue(all(response == responses[0] for response in responses))
+
+    def test_metrics(self):
+        self.assertQuery(("GET", "/metrics"), 401, no_version=True)
+        self.login()
+        for _ in range(3):
+            self.assertQuery(("GET", "/users"))
+        self.assertQuery(("POST", "/users/delete"), 400, json={"user": "unknown", "issuer": 1})
+
+        response = self.assertQuery(("GET", "/metrics"), no_version=True, r_is_json=False)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+        samples = {}
+        for line in response.text.splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+
+        self.assertEqual(3, samples['matebot_http_requests_total{method="GET",route="/v1/users",status="200"}'])
+        self.assertEqual(1, samples['matebot_http_requests_total{method="POST",route="/v1/users/delete",status="400"}'])
+        self.assertEqual(3, samples['matebot_http_request_duration_seconds_count{method="GET",route="/v1/users"}'])
+        self.assertEqual(
+            3,
+            samples['matebot_http_request_duration_seconds_bucket{method="GET",route="/v1/users",le="+Inf"}']
+        )
+        self.assertGreater(samples['matebot_http_request_db_queries_sum{route="/v1/users"}'], 3)
+        self.assertGreater(samples['matebot_http_request_db_duration_seconds_sum{route="/v1/users"}'], 0)
+        self.assertGreaterEqual(samples['matebot_password_hashing_duration_seconds_count{operation="verify"}'], 1)
+        self.assertIn("matebot_notifier_queue_depth", samples)
+        self.assertIn('matebot_cache_lookups_total{cache="token",result="hit"}', samples)
+        self.assertGreater(samples["matebot_event_loop_lag_seconds_count"], 0)
+        self.assertIn('matebot_event_loop_lag_quantile_seconds{quantile="0.99"}', samples)
+
+    def test_query_headers(self):
+        self.login()
+        self.assertQuery(("POST", "/users"), 201, json={"name": "user"})
+        response = self.assertQuery(("GET", "/users"), r_headers=["X-Query-Count", "Server-Timing"])
+        self.assertGreater(int(response.headers["X-Query-Count"]), 0)
+        timings = [part.strip().split(";") for part in response.headers["Server-Timing"].split(",")]
+        self.assertEqual(["db", "total"], [timing[0] for timing in timings])
+        self.assertEqual(f'desc="{response.headers["X-Query-Count"]} queries"', timings[0][2])
+        self.assertLessEqual(float(timings[0][1][4:]), float(timings[1][1][4:]))
+
+        # Error responses are built outside the route, so they don't have those headers
+        response = self.assertQuery(("POST", "/users/delete"), 400, json={"user": "unknown", "issuer": 1})
+        self.assertNotIn("X-Query-Count", response.headers)
+
+    def test_profiler(self):
+        self.login()
+        self.assertQuery(("POST", "/profiler/stop"), 409)
+        status = self.assertQuery(("POST", "/profiler/start"), json={"interval": 0.001}).json()
+        self.assertTrue(status["running"])
+        self.assertEqual(0.001, status["interval"])
+        self.assertQuery(("POST", "/profiler/start"), 409, json={})
+        for _ in range(10):
+            self.assertQuery(("GET", "/users"))
+        self.assertGreater(self.assertQuery(("GET", "/profiler")).json()["samples"], 0)
+
+        status = self.assertQuery(("POST", "/profiler/stop")).json()
+        self.assertFalse(status["running"])
+        try:
+            with open(status["file"]) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(status["file"])
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            self.assertGreater(len(stack.split(";")), 1)
+        self.assertTrue(any(line.startswith("MainThread;") for line in lines))
+
+        # Only the administrative application may use the profiler
+        with self.get_db_session() as session:
+            session.add(models.Application(name="other", hashed_password=hash_password("password")))
+            session.commit()
+        self.auth = ("other", "password")
+        self.login()
+        self.assertQuery(("GET", "/profiler"), 403)
+        self.assertQuery(("POST", "/profiler/start"), 403, json={})
+
     def test_username_changes(self):
         self.login()
         self.assertEqual(
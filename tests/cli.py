@@ -55,6 +55,16 @@ class StandaloneCLITests(utils.BaseTest):
         self._run_cmd(0, "users", "show", "--help", no_defaults=True)
         self._run_cmd(0, "users", "show", "--json", no_defaults=True)
 
+    def test_run_export(self):
+        self._run_cmd(0, "init", "--database", self.database_url, no_defaults=True)
+        self._run_cmd(0, "export", "--help", no_defaults=True)
+        target = os.path.join("/tmp", f"export_{os.getpid()}.csv")
+        self._run_cmd(0, "export", "--format", "csv", "--output", target, timeout=10, no_defaults=True)
+        with open(target) as f:
+            self.assertEqual("id,sender_id,receiver_id,amount,reason,multi_transaction_id,timestamp\n", f.read())
+        os.unlink(target)
+        self._run_cmd(1, "export", "--batch-size", "0", no_defaults=True)
+
     def test_init_command1(self):
         self._run_cmd(0, "init")
 
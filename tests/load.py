@@ -2,13 +2,22 @@
 MateBot load testing of the API endpoints
 """
 
+import json
 import time
 import asyncio
+import timeit
 import threading
+import unittest as _unittest
 
 import aiohttp
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from matebot_core import schemas as _schemas
+from matebot_core.persistence import models
 
 from . import conf, utils
 
@@ -98,3 +107,97 @@ class LoadTests(utils.BaseAPITests):
                 "amount": 50000,
                 "reason": f"test {i}"
             })
+
+    def test_coalesced_searches(self):
+        self.login()
+        with self.get_db_session() as session:
+            session.add_all([models.User(name=f"user{i}", external=False) for i in range(200)])
+            session.commit()
+
+        headers = {"Authorization": f"Bearer {self.token}"}
+
+        async def get(session: aiohttp.ClientSession, query: str):
+            async with session.get(f"{self.server}v1/users?{query}", headers=headers) as r:
+                return r.status, r.headers["ETag"], await r.read()
+
+        async def query():
+            async with aiohttp.ClientSession() as session:
+                return await asyncio.gather(*[
+                    get(session, "active=true&limit=100" if i % 2 else "limit=100&active=true") for i in range(200)
+                ])
+
+        results = asyncio.run(query())
+        self.assertEqual({(200, results[0][1], results[0][2])}, set(results))
+        self.assertEqual(100, len(json.loads(results[0][2])))
+
+    @_unittest.skipIf(msgpack is None, "MessagePack support requires the 'msgpack' package")
+    def test_msgpack_payloads(self):
+        self.login()
+        with self.get_db_session() as session:
+            session.add_all([models.User(name=f"user{i}", external=False) for i in range(2)])
+            session.commit()
+            session.add_all([
+                models.Transaction(sender_id=2, receiver_id=3, amount=i, reason=f"test {i}")
+                for i in range(1, 1001)
+            ])
+            session.commit()
+
+        headers = {"Accept-Encoding": "identity"}
+        json_body = self.assertQuery(("GET", "/transactions"), headers=headers).content
+        msgpack_body = self.assertQuery(
+            ("GET", "/transactions"),
+            headers={"Accept": "application/msgpack", **headers},
+            r_is_json=False
+        ).content
+        self.assertEqual(json.loads(json_body), msgpack.unpackb(msgpack_body))
+
+        # MessagePack payloads are about a third smaller and faster to parse by clients than JSON
+        json_time = min(timeit.repeat(lambda: json.loads(json_body), number=10, repeat=5))
+        msgpack_time = min(timeit.repeat(lambda: msgpack.unpackb(msgpack_body), number=10, repeat=5))
+        self.assertLess(len(msgpack_body), 0.8 * len(json_body))
+        self.assertLess(msgpack_time, json_time)
+
+
+class AdmissionControlTests(utils.BaseAPITests):
+    EXTRA_API_SERVER_ENV_VARS = {
+        "SERVER__MAX_CONCURRENT_REQUESTS": "2",
+        "SERVER__RATE_LIMITS__WRITE__RATE": "0.5",
+        "SERVER__RATE_LIMITS__WRITE__BURST": "3",
+        "SERVER__RATE_LIMITS__APPLICATIONS__APPLICATION__READ__RATE": "0.1",
+        "SERVER__RATE_LIMITS__APPLICATIONS__APPLICATION__READ__BURST": "100"
+    }
+
+    def test_rate_limits(self):
+        self.login()
+        for i in range(3):
+            self.assertQuery(("POST", "/users"), 201, json={"name": f"user{i}"})
+        response = self.assertQuery(("POST", "/users"), 429, json={"name": "user3"})
+        self.assertEqual("2", response.headers["Retry-After"])
+        self.assertTrue(response.json()["repeat"])
+
+        # Reading requests have a separate budget, which has been overwritten for this application
+        for _ in range(5):
+            self.assertQuery(("GET", "/users"), 200)
+
+        time.sleep(2)
+        self.assertQuery(("POST", "/users"), 201, json={"name": "user3"})
+        self.assertQuery(("POST", "/users"), 429, json={"name": "user4"})
+
+    def test_concurrency_limit(self):
+        self.login()
+
+        async def get(session: aiohttp.ClientSession):
+            async with session.get(self.server + "v1/users", headers={"Authorization": f"Bearer {self.token}"}) as r:
+                return r.status, r.headers.get("Retry-After")
+
+        async def query():
+            async with aiohttp.ClientSession() as session:
+                return await asyncio.gather(*[get(session) for _ in range(50)])
+
+        results = asyncio.run(query())
+        statuses = [status for status, _ in results]
+        self.assertEqual({200, 503}, set(statuses), statuses)
+        self.assertTrue(all(retry == "1" for status, retry in results if status == 503))
+
+        # Requests are admitted again as soon as the concurrent requests have been handled
+        self.assertQuery(("GET", "/users"), 200)
@@ -2,11 +2,21 @@
 MateBot unit tests for helpers and other miscellaneous features
 """
 
+import os
+import time
 import random
+import asyncio
 import logging
+import tempfile
 
-from matebot_core.persistence import database, models
-from matebot_core.misc import transactions
+import ujson
+import sqlalchemy.pool
+from fastapi import Request, Response
+from sqlalchemy import delete, update
+
+from matebot_core.api import auth, base, dependency, monitoring
+from matebot_core.persistence import counters, database, models, slow_queries, statistics
+from matebot_core.misc import cache, logger, loop_monitor, metrics, notifier, tracing, transactions
 
 from . import utils
 
@@ -55,6 +65,104 @@ class TransactionTests(utils.BasePersistenceTests):
             self.assertEqual(user4.balance, user4_balance - total)
             self.assertEqual(i+1, len(self.session.query(models.Transaction).all()))
 
+    def test_transactions_bound_to_unit_of_work(self):
+        user1 = self.session.query(models.User).get(1)
+        user4 = self.session.query(models.User).get(4)
+        user1_balance = user1.balance
+
+        # Transactions are flushed but neither committed nor published before committing the session
+        t = transactions.create_transaction(user4, user1, 7, "", self.session, self.logger)
+        self.assertIsNotNone(t.id)
+        self.assertEqual(1, len(self.session.info[notifier.PENDING_EVENTS_KEY]))
+        with database.get_new_session() as session:
+            self.assertEqual(0, len(session.query(models.Transaction).all()))
+            self.assertEqual(user1_balance, session.query(models.User).get(1).balance)
+
+        # Pending events are discarded when the session is rolled back
+        self.session.rollback()
+        self.assertNotIn(notifier.PENDING_EVENTS_KEY, self.session.info)
+        self.assertEqual(0, len(self.session.query(models.Transaction).all()))
+
+        # Committing the session persists the changes and publishes the pending events
+        m, ts = transactions.create_one_to_many_transaction_by_base(
+            user4, [(user1, 1), (self.session.query(models.User).get(2), 2)], 3, "", self.session, self.logger
+        )
+        self.assertEqual(2, len(self.session.info[notifier.PENDING_EVENTS_KEY]))
+        self.session.commit()
+        self.assertNotIn(notifier.PENDING_EVENTS_KEY, self.session.info)
+        with database.get_new_session() as session:
+            self.assertEqual(2, len(session.query(models.Transaction).all()))
+            self.assertEqual(user1_balance + 3, session.query(models.User).get(1).balance)
+
+    def test_tracing(self):
+        user1 = self.session.query(models.User).get(1)
+        user4 = self.session.query(models.User).get(4)
+        self.assertEqual(
+            ("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", True),
+            tracing.parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01")
+        )
+        for header in [
+            None,
+            "",
+            "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331",
+            "00-00000000000000000000000000000000-b7ad6b7169203331-01"
+        ]:
+            self.assertIsNone(tracing.parse_traceparent(header))
+
+        # Nothing is recorded while tracing is disabled, but every trace still has an ID
+        with tracing.trace("disabled") as root:
+            self.assertFalse(root.trace.sampled)
+            self.assertEqual(root.trace.trace_id, tracing.current_trace_id())
+            transactions.create_transaction(user4, user1, 1, "", self.session, self.logger)
+            self.assertEqual(root.trace.trace_id, self.session.info[notifier.PENDING_EVENTS_KEY][-1].trace_id)
+        with tracing.trace("disabled", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01") as root:
+            self.assertFalse(root.trace.sampled)
+            self.assertEqual("0af7651916cd43dd8448eb211c80319c", tracing.current_trace_id())
+        self.assertIsNone(tracing.current_trace_id())
+        self.assertEqual([], root.trace.spans)
+
+        try:
+            tracing.sample_rate = 1.0
+            with self.assertLogs(tracing.__name__, "INFO") as logs:
+                with tracing.trace("POST /test", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01") as root:
+                    transactions.create_transaction(user4, user1, 2, "", self.session, self.logger)
+                    with tracing.span("commit"):
+                        self.session.commit()
+                    with self.assertRaises(ValueError):
+                        with tracing.span("failing"):
+                            raise ValueError("failed")
+
+                # Unsampled traces have an ID for the callbacks, but aren't exported
+                with tracing.trace("unsampled", "00-0af7651916cd43dd8448eb211c80319d-b7ad6b7169203331-00"):
+                    transactions.create_transaction(user4, user1, 3, "", self.session, self.logger)
+                    self.assertEqual(
+                        "0af7651916cd43dd8448eb211c80319d",
+                        self.session.info[notifier.PENDING_EVENTS_KEY][-1].trace_id
+                    )
+                    self.session.rollback()
+        finally:
+            tracing.sample_rate = 0.0
+
+        self.assertEqual(1, len(logs.records))
+        resource_spans = ujson.loads(logs.records[0].getMessage())["resourceSpans"]
+        self.assertEqual(1, len(resource_spans))
+        spans = {s["name"]: s for s in resource_spans[0]["scopeSpans"][0]["spans"]}
+        self.assertEqual({"0af7651916cd43dd8448eb211c80319c"}, {s["traceId"] for s in spans.values()})
+        self.assertEqual("b7ad6b7169203331", spans["POST /test"]["parentSpanId"])
+        self.assertEqual(root.span_id, spans["POST /test"]["spanId"])
+        self.assertEqual(root.span_id, spans["transactions.create_transaction"]["parentSpanId"])
+        self.assertEqual(spans["transactions.create_transaction"]["spanId"], spans["notifier.push"]["parentSpanId"])
+        self.assertEqual(spans["commit"]["spanId"], spans["notifier.enqueue"]["parentSpanId"])
+        self.assertEqual(
+            {"code": tracing.STATUS_CODE_ERROR, "message": "ValueError: failed"},
+            spans["failing"]["status"]
+        )
+        self.assertEqual({"code": tracing.STATUS_CODE_OK}, spans["commit"]["status"])
+        self.assertEqual(tracing.SPAN_KIND_CLIENT, spans["db.query"]["kind"])
+        self.assertIn("db.statement", {a["key"] for a in spans["db.query"]["attributes"]})
+        for s in spans.values():
+            self.assertLessEqual(int(s["startTimeUnixNano"]), int(s["endTimeUnixNano"]))
+
     def test_simple_multi_transaction_restrictions(self):
         users = self.session.query(models.User).all()
 
@@ -240,7 +348,7 @@ class TransactionTests(utils.BasePersistenceTests):
         ]
 
         # Transactions by total amount must be "fair" (=equally distributed) in various situations
-        for total, base, s, rs_a in test_cases:
+        for total, base_amount, s, rs_a in test_cases:
             rs = [(users[r_id], q) for r_id, q, _ in rs_a]
             balances = [u.balance for u in users][:]
             m, ts = transactions.create_one_to_many_transaction_by_total(
@@ -251,7 +359,7 @@ class TransactionTests(utils.BasePersistenceTests):
                 self.session,
                 self.logger
             )
-            self.assertEqual(m.base_amount, base)
+            self.assertEqual(m.base_amount, base_amount)
             self.assertEqual(sum(t.amount for t in m.transactions), sum(t.amount for t in ts))
             self.assertGreaterEqual(sum(t.amount for t in ts), total)
             for user_id, _, increase in rs_a:
@@ -269,7 +377,7 @@ class TransactionTests(utils.BasePersistenceTests):
             (17693, 770, users[3], [(0, 7, 5390), (1, 8, 6160), (2, 8, 6160)])
         ]
 
-        for total, base, r, ss_a in test_cases:
+        for total, base_amount, r, ss_a in test_cases:
             ss = [(users[s_id], q) for s_id, q, _ in ss_a]
             balances = [u.balance for u in users][:]
             m, ts = transactions.create_many_to_one_transaction_by_total(
@@ -280,7 +388,7 @@ class TransactionTests(utils.BasePersistenceTests):
                 self.session,
                 self.logger
             )
-            self.assertEqual(m.base_amount, base)
+            self.assertEqual(m.base_amount, base_amount)
             self.assertEqual(sum(t.amount for t in m.transactions), sum(t.amount for t in ts))
             self.assertGreaterEqual(sum(t.amount for t in ts), total)
             for user_id, _, decrease in ss_a:
@@ -344,3 +452,531 @@ class TransactionTests(utils.BasePersistenceTests):
 
     def test_matrix_transactions(self):
         pass
+
+
+class CacheTests(utils.BasePersistenceTests):
+    def setUp(self) -> None:
+        super().setUp()
+        database._logger.setLevel("ERROR")
+        database.init(self.database_url, echo=False, create_all=False)
+
+    def tearDown(self) -> None:
+        database._engine = None
+        database._make_session = None
+        super().tearDown()
+
+    def test_lru_cache(self):
+        c = cache.LRUCache(3)
+        for i in range(4):
+            c.put(i, str(i))
+        self.assertEqual(3, len(c))
+        self.assertIsNone(c.get(0))
+        self.assertEqual("1", c.get(1))
+        c.put(4, "4")
+        self.assertIsNone(c.get(2))
+        self.assertEqual("1", c.get(1))
+        self.assertEqual(2, c.hits)
+        self.assertEqual(2, c.misses)
+        self.assertAlmostEqual(0.5, c.hit_rate)
+
+        c.maxsize = 0
+        c.clear()
+        c.put(1, "1")
+        self.assertEqual(0, len(c))
+
+    def test_bytes_lru_cache(self):
+        c = cache.BytesLRUCache(8)
+        c.put("a", b"1234")
+        c.put("b", b"5678")
+        self.assertEqual(8, c.total)
+        self.assertEqual(b"1234", c.get("a"))
+        c.put("c", b"90")
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(6, c.total)
+        c.put("d", b"123456789")
+        self.assertIsNone(c.get("d"))
+        c.put("a", b"1")
+        self.assertEqual(3, c.total)
+        c.clear()
+        self.assertEqual((0, 0), (len(c), c.total))
+
+    def test_sqlite_file_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "cache.db")
+            c1 = cache.SQLiteFileCache(filename, 8)
+            c2 = cache.SQLiteFileCache(filename, 8)
+            c1.put("a", b"1234")
+            self.assertEqual(b"1234", c2.get("a"))
+            c2.put("b", b"5678")
+            self.assertEqual(b"1234", c1.get("a"))
+            c1.put("c", b"90")
+            self.assertIsNone(c2.get("b"))
+            self.assertEqual(2, len(c2))
+            c1.put("d", b"123456789")
+            self.assertIsNone(c2.get("d"))
+            c2.clear()
+            self.assertIsNone(c1.get("a"))
+            self.assertEqual((1, 1), (c1.hits, c1.misses))
+            self.assertEqual((1, 2), (c2.hits, c2.misses))
+
+    def test_single_flight(self):
+        flights = cache.SingleFlight()
+        calls = []
+
+        def compute(value):
+            def func():
+                calls.append(value)
+                time.sleep(0.2)
+                if value is None:
+                    raise ValueError
+                return value
+            return func
+
+        async def run():
+            results = await asyncio.gather(
+                *[flights.run("a", compute(1)) for _ in range(5)],
+                *[flights.run("b", compute(2)) for _ in range(3)]
+            )
+            self.assertEqual(0, len(flights))
+            errors = await asyncio.gather(*[flights.run("c", compute(None)) for _ in range(3)], return_exceptions=True)
+            later = await flights.run("a", compute(3))
+
+            # Cancelling the first caller doesn't cancel the call, but it waits for its end
+            leader = asyncio.create_task(flights.run("d", compute(4)))
+            await asyncio.sleep(0.05)
+            waiters = [asyncio.create_task(flights.run("d", compute(5))) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            await asyncio.sleep(0.05)
+            self.assertFalse(leader.done())
+            self.assertEqual([4] * 3, await asyncio.gather(*waiters))
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            self.assertEqual(0, len(flights))
+            return results, errors, later
+
+        results, errors, later = asyncio.run(run())
+        self.assertEqual([1] * 5 + [2] * 3, results)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(3, later)
+        self.assertEqual([1, 2, None, 3, 4], sorted(calls[:2]) + calls[2:])
+        self.assertEqual({"calls": 5, "shared": 11}, flights.stats())
+
+    def test_version_counters(self):
+        self.assertEqual(0, counters.get_counter(self.session, "foo"))
+        counters.bump_counter(self.session, "foo")
+        counters.bump_counter(self.session, "foo")
+        self.assertTrue(counters.has_bumped(self.session, "foo"))
+        self.assertFalse(counters.has_bumped(self.session, "bar"))
+        self.assertEqual(2, counters.get_counter(self.session, "foo"))
+        with database.get_new_session() as session:
+            self.assertEqual(0, counters.get_counter(session, "foo"))
+        self.session.commit()
+        self.assertFalse(counters.has_bumped(self.session, "foo"))
+        with database.get_new_session() as session:
+            self.assertEqual(2, counters.get_counter(session, "foo"))
+            counters.bump_counter(session, "foo")
+            session.rollback()
+            self.assertEqual(2, counters.get_counter(session, "foo"))
+
+    def test_table_counters(self):
+        users = counters.table_counter(models.User.__tablename__)
+        aliases = counters.table_counter(models.Alias.__tablename__)
+        self.assertEqual(({users: 0, aliases: 0}, None), counters.get_versions(self.session, [users, aliases]))
+        user = models.User(name="foo", external=False)
+        self.session.add(user)
+        self.session.commit()
+        versions, last_modified = counters.get_versions(self.session, [users, aliases])
+        self.assertEqual({users: 1, aliases: 0}, versions)
+        self.assertIsNotNone(last_modified)
+
+        # Unmodified objects in the session don't increment any counter
+        self.session.refresh(user)
+        user.name = "foo"
+        self.session.commit()
+        self.assertEqual(1, counters.get_counter(self.session, users))
+        user.balance = 42
+        self.session.commit()
+        self.assertEqual(2, counters.get_counter(self.session, users))
+
+        # Multiple flushes of a transaction increment the counter only once, when committing
+        user.balance = 43
+        self.session.flush()
+        self.assertTrue(counters.has_bumped(self.session, users))
+        user.balance = 44
+        self.session.flush()
+        with database.get_new_session() as session:
+            self.assertEqual(2, counters.get_counter(session, users))
+        self.session.commit()
+        self.assertEqual(3, counters.get_counter(self.session, users))
+
+        # Statements bypassing the unit of work and cascading deletions increment the counters as well
+        app = models.Application(name="app", hashed_password="password")
+        self.session.add(app)
+        self.session.commit()
+        self.session.add(models.Alias(user_id=user.id, application_id=app.id, username="foo"))
+        self.session.commit()
+        self.assertEqual(1, counters.get_counter(self.session, aliases))
+        self.session.execute(update(models.User).where(models.User.id == user.id).values(balance=0))
+        self.session.commit()
+        self.assertEqual(4, counters.get_counter(self.session, users))
+        self.session.execute(delete(models.Application).where(models.Application.id == app.id))
+        self.session.commit()
+        self.assertEqual(2, counters.get_counter(self.session, aliases))
+        self.assertEqual(4, counters.get_counter(self.session, users))
+
+    def test_versioned_cache(self):
+        c = cache.VersionedCache("foo")
+        version = c.validate(self.session)
+        self.assertEqual(0, version)
+        c.put_versioned("a", 1, version)
+        self.assertEqual(1, c.get_versioned("a", version))
+        self.session.commit()
+
+        # Changes by other sessions or processes invalidate the cache once they are visible
+        with database.get_new_session() as session:
+            counters.bump_counter(session, "foo")
+            self.assertIsNone(c.validate(session))
+            session.commit()
+        version = c.validate(self.session)
+        self.assertEqual(1, version)
+        self.assertIsNone(c.get_versioned("a", version))
+
+        # Entries for outdated versions are not stored
+        c.put_versioned("b", 2, 0)
+        self.assertIsNone(c.get_versioned("b", version))
+        c.put_versioned("b", 2, version)
+        self.assertEqual(2, c.get_versioned("b", version))
+
+    def test_token_cache(self):
+        app = models.Application(name="app", hashed_password="unused")
+        self.session.add(app)
+        self.session.commit()
+        token = auth.create_access_token("app")
+        dependency.token_cache.clear()
+        self.assertEqual(0, dependency.token_cache.revalidation_interval)
+
+        identity = dependency.authenticate_application(token, self.session)
+        self.assertEqual((app.id, "app"), (identity.id, identity.name))
+        self.assertEqual(1, len(dependency.token_cache))
+        self.session.commit()
+        self.assertEqual(identity, dependency.authenticate_application(token, self.session))
+        self.assertEqual(1, dependency.token_cache.hits)
+        self.session.commit()
+
+        # Deleting the application (e.g. via the CLI) revokes its cached tokens
+        with database.get_new_session() as session:
+            session.delete(session.get(models.Application, app.id))
+            counters.bump_counter(session, counters.APPLICATIONS)
+            session.commit()
+        with self.assertRaises(base.APIException):
+            dependency.authenticate_application(token, self.session)
+        self.session.rollback()
+        with self.assertRaises(base.APIException):
+            dependency.authenticate_application(token + "x", self.session)
+        self.assertEqual(0, len(dependency.token_cache))
+
+
+class MonitoringTests(utils.BasePersistenceTests):
+    def setUp(self) -> None:
+        super().setUp()
+        database._logger.setLevel("ERROR")
+        database.init(self.database_url, echo=False, create_all=False)
+
+    def tearDown(self) -> None:
+        database._engine = None
+        database._make_session = None
+        super().tearDown()
+
+    def test_metrics(self):
+        registry = metrics.Registry()
+        counter = registry.counter("requests_total", "Number of requests", ("method", "path"))
+        counter.inc("GET", "/a")
+        counter.inc("GET", "/a", amount=2)
+        counter.inc("POST", '/"b"')
+        histogram = registry.histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        registry.register(metrics.CallbackMetric("queue_depth", "Queue\ndepth", lambda: 7))
+        registry.register(metrics.CallbackMetric("broken", "Broken", lambda: 1 / 0))
+        self.assertEqual(3, counter.get("GET", "/a"))
+        self.assertEqual(4, histogram.get_count())
+
+        with self.assertLogs(metrics.__name__, "ERROR"):
+            rendered = registry.render()
+        self.assertEqual(
+            "# HELP requests_total Number of requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{method="GET",path="/a"} 3\n'
+            'requests_total{method="POST",path="/\\"b\\""} 1\n'
+            "# HELP duration_seconds Duration\n"
+            "# TYPE duration_seconds histogram\n"
+            'duration_seconds_bucket{le="0.1"} 2\n'
+            'duration_seconds_bucket{le="1"} 3\n'
+            'duration_seconds_bucket{le="+Inf"} 4\n'
+            "duration_seconds_sum 3.65\n"
+            "duration_seconds_count 4\n"
+            "# HELP queue_depth Queue\\ndepth\n"
+            "# TYPE queue_depth gauge\n"
+            "queue_depth 7\n",
+            rendered
+        )
+
+    def test_query_statistics(self):
+        self.assertIsNone(statistics.current())
+        outer, outer_token = statistics.start()
+        with database.get_new_session() as session:
+            session.query(models.User).all()
+            inner, inner_token = statistics.start()
+            session.query(models.User).all()
+            session.query(models.Transaction).all()
+            statistics.stop(inner_token)
+            self.assertIs(outer, statistics.current())
+        statistics.stop(outer_token)
+        self.assertIsNone(statistics.current())
+        self.assertEqual(2, inner.count)
+        self.assertEqual(3, outer.count)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+
+    def test_query_budgets(self):
+        def run_request(queries: int) -> monitoring.RequestTimer:
+            timer = monitoring.RequestTimer()
+            with database.get_new_session() as session:
+                for _ in range(queries):
+                    session.query(models.User).all()
+            timer.stop("GET", "/test", 200)
+            return timer
+
+        try:
+            monitoring.query_count_budget = 2
+            with self.assertLogs(monitoring.__name__, "WARNING") as logs:
+                self.assertEqual(2, run_request(2).queries.count)
+                self.assertEqual(3, run_request(3).queries.count)
+            self.assertEqual(1, len(logs.records))
+            self.assertIn("GET /test (200) exceeded the query budget: 3 queries", logs.output[0])
+        finally:
+            monitoring.query_count_budget = 0
+
+    def test_event_loop_monitor(self):
+        monitor = loop_monitor.EventLoopMonitor(interval=0.01, threshold=0.1)
+
+        def blocking_handler():
+            time.sleep(0.4)
+
+        async def run():
+            monitor.start()
+            await asyncio.sleep(0.2)
+            blocking_handler()
+            await asyncio.sleep(0.2)
+            monitor.stop()
+
+        with self.assertLogs(loop_monitor.__name__, "WARNING") as logs:
+            asyncio.run(run())
+        self.assertFalse(monitor.running)
+        self.assertEqual(1, monitor.blocked)
+        self.assertEqual(1, len(logs.records))
+        self.assertIn("in blocking_handler", logs.output[0])
+        self.assertGreater(len(monitor.lags), 10)
+        percentiles = monitor.percentiles(0.5, 1.0)
+        self.assertLess(percentiles[0.5], 0.1)
+        self.assertGreater(percentiles[1.0], 0.3)
+
+
+class LoggingTests(utils.BasePersistenceTests):
+    def setUp(self) -> None:
+        super().setUp()
+        database._logger.setLevel("ERROR")
+        database.init(self.database_url, echo=False, create_all=False)
+
+    def tearDown(self) -> None:
+        database._engine = None
+        database._make_session = None
+        super().tearDown()
+
+    def test_access_log(self):
+        request = Request({
+            "type": "http",
+            "method": "GET",
+            "path": "/v1/users/1",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "client": ("127.0.0.1", 4242),
+            "state": {"application": "app"}
+        })
+        timer = monitoring.RequestTimer()
+        with database.get_new_session() as session:
+            session.query(models.User).all()
+        timer.stop("GET", "/v1/users/{user_id}", 200)
+
+        # The entries and traces don't end up in the general log, even without handlers of their own
+        self.assertFalse(monitoring.access_logger.propagate)
+        self.assertFalse(logging.getLogger(tracing.__name__).propagate)
+        with self.assertLogs(monitoring.access_logger, "INFO") as logs:
+            monitoring.log_access(request, "/v1/users/{user_id}", 200, timer, Response(b"content"))
+            monitoring.log_access(request, "/v1/users/{user_id}", 404, timer)
+        self.assertEqual(
+            ["GET /v1/users/{user_id} 200", "GET /v1/users/{user_id} 404"],
+            [record.getMessage() for record in logs.records]
+        )
+
+        entry = ujson.loads(logger.JSONFormatter().format(logs.records[0]))
+        self.assertEqual(
+            {
+                "method": "GET",
+                "route": "/v1/users/{user_id}",
+                "path": "/v1/users/1",
+                "status": 200,
+                "application": "app",
+                "client": "127.0.0.1",
+                "db_queries": 1,
+                "response_size": 7,
+                "trace_id": None
+            },
+            {key: value for key, value in entry.items() if key not in ("time", "duration_ms", "db_duration_ms")}
+        )
+        self.assertLessEqual(entry["db_duration_ms"], entry["duration_ms"])
+        self.assertTrue(entry["time"].endswith("+00:00"))
+        self.assertIsNone(ujson.loads(logger.JSONFormatter().format(logs.records[1]))["response_size"])
+
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "plain %s", ("message",), None)
+        entry = ujson.loads(logger.JSONFormatter().format(record))
+        self.assertEqual({"level": "INFO", "logger": "test", "message": "plain message"}, {
+            key: value for key, value in entry.items() if key != "time"
+        })
+
+    def test_slow_queries(self):
+        self.assertEqual(
+            {"name": slow_queries.REDACTED, "ids": [1, slow_queries.REDACTED], "active": True},
+            slow_queries.redact({"name": "secret", "ids": [1, b"2"], "active": True})
+        )
+
+        try:
+            slow_queries.threshold = 1e-9
+            slow_queries.max_entries_per_minute = 2
+            _, token = statistics.start("/v1/test")
+            with self.assertLogs(slow_queries.__name__, "WARNING") as logs:
+                with database.get_new_session() as session:
+                    for name in ("alice", "bob", "charlie"):
+                        session.query(models.User).filter_by(name=name).all()
+            statistics.stop(token)
+        finally:
+            slow_queries.threshold = 0.0
+            slow_queries.max_entries_per_minute = 10
+
+        self.assertEqual(2, len(logs.records))
+        self.assertGreaterEqual(slow_queries.suppressed, 1)
+        for output in logs.output:
+            self.assertIn("in /v1/test: 'SELECT", output)
+            self.assertIn(slow_queries.REDACTED, output)
+            self.assertNotIn("alice", output)
+            self.assertIn("Query plan:", output)
+            self.assertIn("users", output.split("Query plan:")[1].lower())
+
+        # Queries are explained with another (idle) connection of the pool only
+        engine = sqlalchemy.create_engine(database.get_engine().url, poolclass=sqlalchemy.pool.QueuePool)
+        try:
+            with engine.connect() as connection:
+                with self.assertRaises(RuntimeError):
+                    slow_queries.get_query_plan(connection, "SELECT 1", ())
+                engine.connect().close()
+                self.assertIsNotNone(slow_queries.get_query_plan(connection, "SELECT 1", ()))
+                self.assertEqual(1, engine.pool.checkedout())
+        finally:
+            engine.dispose()
+
+    def test_background_file_handler(self):
+        class Model:
+            def __str__(self):
+                return "model"
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.log")
+            handler = logger.create_background_file_handler(filename, max_bytes="200", backup_count="2")
+            handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+            log = logging.getLogger("matebot_core.tests.background")
+            log.propagate = False
+            log.addHandler(handler)
+            try:
+                log.info("%s and %d", Model(), 42)
+                for i in range(50):
+                    log.warning("line %d", i)
+            finally:
+                log.removeHandler(handler)
+                handler.close()
+
+            self.assertEqual(["test.log", "test.log.1", "test.log.2"], sorted(os.listdir(directory)))
+            for name in os.listdir(directory):
+                self.assertLessEqual(os.path.getsize(os.path.join(directory, name)), 200)
+            with open(filename) as f:
+                self.assertEqual("WARNING line 49", f.read().splitlines()[-1])
+
+            handler = logger.create_background_file_handler(filename, delay="true", queue_size=1)
+            handler.listener.stop()
+            handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "%s", (Model(),), None))
+            handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "dropped", None, None))
+            self.assertEqual(1, handler.dropped)
+            self.assertEqual("model", handler.queue.get_nowait().msg)
+            handler.listener = None
+            handler.close()
+
+
+class AuthTests(utils.BasePersistenceTests):
+    def setUp(self) -> None:
+        super().setUp()
+        database._logger.setLevel("ERROR")
+        database.init(self.database_url, echo=False, create_all=False)
+
+    def tearDown(self) -> None:
+        auth.token_secret = None
+        database._engine = None
+        database._make_session = None
+        super().tearDown()
+
+    def test_refresh_tokens(self):
+        app = models.Application(name="app", hashed_password="unused")
+        self.session.add(app)
+        self.session.commit()
+        token = auth.create_refresh_token(self.session, app.id, "app")
+        self.session.commit()
+        self.assertEqual(("app", app.id, 0), auth.decode_refresh_token(token))
+        with self.assertRaises(ValueError):
+            auth.decode_refresh_token(auth.create_access_token("app"))
+
+        # Refresh tokens can be used only once
+        self.assertEqual(app.id, auth.use_refresh_token(self.session, token).application_id)
+        new_token = auth.create_refresh_token(self.session, app.id, "app")
+        self.session.commit()
+        with self.assertRaises(ValueError):
+            auth.use_refresh_token(self.session, token)
+        self.session.rollback()
+
+        # All refresh tokens of an application can be revoked
+        auth.revoke_refresh_tokens(self.session, app.id)
+        self.session.commit()
+        with self.assertRaises(ValueError):
+            auth.use_refresh_token(self.session, new_token)
+        self.session.rollback()
+
+        # Tokens are bound to the ID of the application, which may be reused after deleting it (e.g. via the CLI)
+        token = auth.create_refresh_token(self.session, app.id, "app")
+        self.session.delete(app)
+        auth.revoke_refresh_tokens(self.session, app.id)
+        self.session.commit()
+        with self.assertRaises(ValueError):
+            auth.use_refresh_token(self.session, token)
+        self.session.rollback()
+        self.session.add(models.Application(name="app", hashed_password="unused"))
+        self.session.commit()
+        with self.assertRaises(ValueError):
+            auth.use_refresh_token(self.session, token)
+        self.session.rollback()
+
+        # Tokens signed with the persistent secret stay valid when the key of the process changes
+        auth.token_secret = "x" * 32
+        token = auth.create_access_token("app")
+        runtime_key, base.runtime_key = base.runtime_key, "other"
+        try:
+            self.assertEqual("app", auth.decode_token(token, auth.ACCESS_TOKEN_TYPE)[0])
+        finally:
+            base.runtime_key = runtime_key
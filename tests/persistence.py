@@ -11,6 +11,7 @@ import sqlalchemy.orm
 import sqlalchemy.exc
 from sqlalchemy.engine import Engine as _Engine
 
+from matebot_core import schemas
 from matebot_core.api import auth
 from matebot_core.persistence import models
 
@@ -423,6 +424,37 @@ class DatabaseUsabilityTests(utils.BasePersistenceTests):
         self.assertEqual(len(m3.transactions), 12)
         self.assertEqual(m3.schema.total_amount, 140)
 
+    def test_trusted_schemas(self):
+        users = self.get_sample_users()[:4]
+        self.session.add_all(users)
+        app = models.Application(name="app", hashed_password="")
+        self.session.add(app)
+        self.session.commit()
+
+        ballot = models.Ballot()
+        multi = models.MultiTransaction(base_amount=2)
+        transaction = models.Transaction(sender=users[0], receiver=users[1], amount=2, reason="foo")
+        multi.transactions.append(models.Transaction(sender=users[1], receiver=users[2], amount=2))
+        communism = models.Communism(amount=4, description="bar", creator=users[2], multi_transaction=multi)
+        communism.participants.append(models.CommunismUsers(user=users[3], quantity=2))
+        self.session.add_all([
+            models.Alias(user=users[0], application=app, username="foo", confirmed=True),
+            models.Callback(url="http://localhost/", app=app),
+            models.Vote(vote=True, user=users[1], ballot=ballot),
+            models.Poll(variant=schemas.PollVariant.GET_INTERNAL, user=users[0], creator=users[0], ballot=ballot),
+            models.Refund(amount=2, description="baz", creator=users[3], ballot=ballot, transaction=transaction),
+            communism
+        ])
+        self.session.commit()
+
+        # The schemas built without validation must equal validated schemas
+        for mapper in models.Base.registry.mappers:
+            objects = self.session.query(mapper.class_).all()
+            self.assertGreater(len(objects), 0, mapper.class_)
+            for obj in objects:
+                schema = obj.schema
+                self.assertEqual(type(schema)(**schema.dict()).json(), schema.json())
+
 
 class DatabaseRestrictionTests(utils.BasePersistenceTests):
     """
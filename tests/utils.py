@@ -227,6 +227,7 @@ class BaseAPITests(BaseTest):
 
     auth: Optional[Tuple[str, str]] = None
     token: Optional[str] = None
+    refresh_token: Optional[str] = None
 
     callback_server: Optional[http.server.HTTPServer] = None
     callback_server_port: Optional[int] = None
@@ -434,6 +435,7 @@ class BaseAPITests(BaseTest):
         )
         if response.ok:
             self.token = response.json()["access_token"]
+            self.refresh_token = response.json()["refresh_token"]
         else:
             self.fail(f"Failed to login ({response.status_code})")
 